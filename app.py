@@ -1,51 +1,123 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import (Flask, Blueprint, Response, abort, current_app, get_flashed_messages, render_template,
+                   request, redirect, stream_template, url_for, flash, session, jsonify)
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
-from functools import wraps
-from dotenv import load_dotenv
+import csv
+import io
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import stripe
+import archive
+import billing
+import checkout
+import entity_cache
+import metrics
+import query_audit
+import quran_text
+import receipts
+import recordings
+from attendance import REPORT_MONTHS as ATTENDANCE_MONTHS, attendance, attendance_rates
+from auth import admin_required, login_required, teacher_required
+from billing import billing as billing_bp, save_payment_method
+from checkout import (cached_intent, discard_intent, ensure_intent, get_stripe, intent_amount,
+                      prefetch_intent, stripe_enabled, wait_for_prefetch)
+from enrollments import available_transitions, enrollments
+from entity_cache import get_course, get_course_or_404, get_teacher, invalidate_course, invalidate_teacher
+from metrics import track_outbound
+from payment_status import DUE_SOON_DAYS, OVERDUE, DUE_TODAY, classify, classify_batch
+from query_audit import query_budget
+from hifz import hifz, class_summary, load_progress
+from quran_text import quran
+from receipts import queue_receipt
+from recordings import recitation, recent_recordings
+from revision import revision, todays_queue
+from scheduling import scheduling
+from models import (db, User, Course, Enrollment, Payment, CourseRevenue, TeacherRevenue,
+                    MonthlyRevenue, HifzProgress, SavedPaymentMethod, record_revenue)
 
-# Load environment variables from .env file
-load_dotenv()
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///quran_academy.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'static', 'uploads', 'icons')
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB max file size
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg', 'webp'}
 
-# Email configuration (configure with your SMTP settings)
-app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', 'your-email@gmail.com')
-app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', 'your-app-password')
-app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@raindropsacademy.com')
+# Student billing history rows per dashboard page
+BILLING_PAGE_SIZE = 12
 
-# Stripe configuration
-stripe_secret = os.environ.get('STRIPE_SECRET_KEY', '')
-stripe_public = os.environ.get('STRIPE_PUBLIC_KEY', '')
+# Streamed admin reports - rows fetched per database round trip, and bytes sent per write
+REPORT_FETCH_SIZE = 500
+REPORT_FLUSH_BYTES = 16 * 1024
 
-# Only set Stripe key if it's a valid key (not placeholder)
-if stripe_secret and not stripe_secret.endswith('_here') and stripe_secret.startswith('sk_'):
-    stripe.api_key = stripe_secret
-else:
-    stripe.api_key = None  # Will trigger demo mode
-    
-app.config['STRIPE_PUBLIC_KEY'] = stripe_public if (stripe_public and stripe_public.startswith('pk_')) else ''
+# Bulk CSV import - rows are validated and inserted this many at a time
+IMPORT_BATCH_SIZE = 500
+IMPORT_COLUMNS = {
+    'students': ['username', 'email', 'password', 'full_name'],
+    'teachers': ['username', 'email', 'password', 'full_name'],
+    'enrollments': ['username', 'course']
+}
 
-# Create upload directory if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+main = Blueprint('main', __name__)
 
-db = SQLAlchemy(app)
+def create_app(test_config=None):
+    # Load environment variables from .env file
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///quran_academy.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'static', 'uploads', 'icons')
+    app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB max file size
+    
+    # Email configuration (configure with your SMTP settings)
+    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+    app.config['MAIL_USE_TLS'] = True
+    app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', 'your-email@gmail.com')
+    app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', 'your-app-password')
+    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@raindropsacademy.com')
+    
+    # Stripe configuration - the SDK itself is only imported on first use (see checkout.get_stripe)
+    stripe_secret = os.environ.get('STRIPE_SECRET_KEY', '')
+    stripe_public = os.environ.get('STRIPE_PUBLIC_KEY', '')
+    
+    # Only keep the Stripe key if it's a valid key (not placeholder) - otherwise demo mode
+    valid_secret = stripe_secret and not stripe_secret.endswith('_here') and stripe_secret.startswith('sk_')
+    app.config['STRIPE_SECRET_KEY'] = stripe_secret if valid_secret else None
+    app.config['STRIPE_PUBLIC_KEY'] = stripe_public if (stripe_public and stripe_public.startswith('pk_')) else ''
+    # Point the SDK at a local stand-in (python stripe_stub.py) instead of api.stripe.com
+    app.config['STRIPE_API_BASE'] = os.environ.get('STRIPE_API_BASE') or None
+    
+    # Request metrics (latency, SQL, templates, outbound calls) served on /metrics
+    app.config['METRICS_SLOW_REQUEST_MS'] = int(os.environ.get('METRICS_SLOW_REQUEST_MS', 500))
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN') or None
+    app.config['METRICS_ALLOW_IPS'] = tuple(ip.strip() for ip in os.environ.get('METRICS_ALLOW_IPS', '').split(',') if ip.strip())
+    
+    if test_config:
+        app.config.update(test_config)
+    
+    db.init_app(app)
+    archive.init_app(app)
+    metrics.init_app(app)
+    query_audit.init_app(app)
+    entity_cache.init_app(app)
+    checkout.init_app(app)
+    billing.init_app(app)
+    quran_text.init_app(app)
+    recordings.init_app(app)
+    receipts.init_app(app)
+    app.register_blueprint(main)
+    app.register_blueprint(billing_bp)
+    app.register_blueprint(attendance)
+    app.register_blueprint(enrollments)
+    app.register_blueprint(scheduling)
+    app.register_blueprint(hifz)
+    app.register_blueprint(revision)
+    app.register_blueprint(quran)
+    app.register_blueprint(recitation)
+    app.register_blueprint(receipts.receipts)
+    # Favicons and social cards from python create_logo.py build, once they have been rendered
+    app.jinja_env.globals['brand_assets'] = os.path.exists(
+        os.path.join(app.static_folder, 'images', 'brand', 'favicon.ico'))
+    return app
 
 # Helper function for file uploads
 def allowed_file(filename):
@@ -53,125 +125,267 @@ def allowed_file(filename):
 
 # Helper function for sending emails
 def send_email(to_email, subject, body):
+    # Mail modules are only needed here, so they are not imported at startup
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    
+    config = current_app.config
     try:
         msg = MIMEMultipart('alternative')
-        msg['From'] = app.config['MAIL_DEFAULT_SENDER']
+        msg['From'] = config['MAIL_DEFAULT_SENDER']
         msg['To'] = to_email
         msg['Subject'] = subject
         
         html_part = MIMEText(body, 'html')
         msg.attach(html_part)
         
-        with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT']) as server:
+        with track_outbound('smtp'), smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT']) as server:
             server.starttls()
-            server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
+            server.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
             server.send_message(msg)
         return True
     except Exception as e:
         print(f"Email error: {str(e)}")
         return False
 
-# Database Models
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(200), nullable=False)
-    full_name = db.Column(db.String(120), nullable=False)
-    phone = db.Column(db.String(20))
-    is_admin = db.Column(db.Boolean, default=False)
-    is_teacher = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Teacher profile fields
-    profile_picture = db.Column(db.String(200))
-    bio = db.Column(db.Text)
-    qualifications = db.Column(db.Text)  # Degrees and certifications
-    specializations = db.Column(db.Text)  # Areas of strength
-    experience_years = db.Column(db.Integer)
-    languages = db.Column(db.String(200))
-    ijazah = db.Column(db.String(200))  # Ijazah certificates
-    teaching_style = db.Column(db.Text)
-    
-    enrollments = db.relationship('Enrollment', backref='student', lazy=True)
-    teaching_courses = db.relationship('Course', backref='teacher', lazy=True)
+def duplicate_user_message(error):
+    # The unique index that fired names the column, e.g. "UNIQUE constraint failed: user.email"
+    if 'email' in str(error.orig):
+        return 'Email already registered!'
+    return 'Username already exists!'
 
-class Course(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.Text, nullable=False)
-    duration = db.Column(db.String(50))
-    tuition_fee = db.Column(db.Float, nullable=False)
-    icon = db.Column(db.String(50))
-    features = db.Column(db.Text)
-    teacher_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    enrollments = db.relationship('Enrollment', backref='course', lazy=True)
+# Bulk CSV import of students, teachers and enrollments
+def import_csv(stream, kind, hash_workers=None):
+    """Import a CSV text stream in batches.
 
-class Enrollment(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
-    enrollment_date = db.Column(db.DateTime, default=datetime.utcnow)
-    status = db.Column(db.String(20), default='pending')  # pending, active, completed
-    payment_status = db.Column(db.String(20), default='unpaid')  # unpaid, paid
-    next_payment_due = db.Column(db.DateTime)  # Next monthly payment due date
-    last_payment_date = db.Column(db.DateTime)  # Last payment received date
-    payment = db.relationship('Payment', backref='enrollment', uselist=False, lazy=True)
+    Returns (created, errors) where errors is a list of (line number, message).
+    Duplicates are checked with one IN query per batch, passwords are hashed
+    in a process pool and each batch is written with a single executemany.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    reader = csv.DictReader(stream)
+    fieldnames = [name.strip().lower() for name in (reader.fieldnames or [])]
+    missing = [column for column in IMPORT_COLUMNS[kind] if column not in fieldnames]
+    if missing:
+        return 0, [(1, f"Missing column(s): {', '.join(missing)}")]
+    reader.fieldnames = fieldnames
+    
+    created = 0
+    errors = []
+    seen = set()  # Keys already taken earlier in this file
+    pool = ProcessPoolExecutor(max_workers=hash_workers) if kind != 'enrollments' else None
+    courses = None
+    if kind == 'enrollments':
+        courses = {}
+        for course_id, name in db.session.query(Course.id, Course.name):
+            courses[str(course_id)] = course_id
+            courses[name.strip().lower()] = course_id
+    
+    try:
+        batch = []
+        for line_no, row in enumerate(reader, start=2):
+            batch.append((line_no, {key: (value or '').strip() for key, value in row.items() if key}))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                created += _import_batch(kind, batch, seen, errors, pool, courses)
+                batch = []
+        if batch:
+            created += _import_batch(kind, batch, seen, errors, pool, courses)
+    finally:
+        if pool:
+            pool.shutdown()
+    
+    errors.sort()
+    return created, errors
 
-class Payment(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
-    payment_date = db.Column(db.DateTime, default=datetime.utcnow)
-    payment_method = db.Column(db.String(50))  # 'stripe', 'cash', 'bank_transfer', etc.
-    transaction_id = db.Column(db.String(100))  # Stripe payment intent ID
-    stripe_payment_intent = db.Column(db.String(200))  # Full Stripe payment intent ID
-    stripe_customer_id = db.Column(db.String(200))  # Stripe customer ID
-    status = db.Column(db.String(20), default='pending')  # pending, completed, failed, refunded
+def _import_batch(kind, batch, seen, errors, pool, courses):
+    if kind == 'enrollments':
+        return _import_enrollment_batch(batch, seen, errors, courses)
+    return _import_user_batch(batch, seen, errors, pool, is_teacher=(kind == 'teachers'))
 
-# Login decorator
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
-        return f(*args, **kwargs)
-    return decorated_function
+def _import_user_batch(batch, seen, errors, pool, is_teacher):
+    valid = []
+    for line_no, row in batch:
+        missing = [column for column in IMPORT_COLUMNS['students'] if not row.get(column)]
+        if missing:
+            errors.append((line_no, f"Missing value(s): {', '.join(missing)}"))
+        elif '@' not in row['email']:
+            errors.append((line_no, f"Invalid email: {row['email']}"))
+        elif len(row['password']) < 6:
+            errors.append((line_no, 'Password must be at least 6 characters'))
+        elif ('username', row['username'].lower()) in seen:
+            errors.append((line_no, f"Duplicate username in file: {row['username']}"))
+        elif ('email', row['email'].lower()) in seen:
+            errors.append((line_no, f"Duplicate email in file: {row['email']}"))
+        else:
+            seen.add(('username', row['username'].lower()))
+            seen.add(('email', row['email'].lower()))
+            valid.append((line_no, row))
+    if not valid:
+        return 0
+    
+    # One set-based query per unique column instead of two lookups per row
+    taken_usernames = {username for (username,) in db.session.query(User.username).filter(
+        User.username.in_([row['username'] for _, row in valid]))}
+    taken_emails = {email for (email,) in db.session.query(User.email).filter(
+        User.email.in_([row['email'] for _, row in valid]))}
+    
+    rows = []
+    for line_no, row in valid:
+        if row['username'] in taken_usernames:
+            errors.append((line_no, f"Username already exists: {row['username']}"))
+        elif row['email'] in taken_emails:
+            errors.append((line_no, f"Email already registered: {row['email']}"))
+        else:
+            rows.append(row)
+    if not rows:
+        return 0
+    
+    passwords = [row['password'] for row in rows]
+    if pool:
+        hashes = list(pool.map(generate_password_hash, passwords, chunksize=16))
+    else:
+        hashes = [generate_password_hash(password) for password in passwords]
+    
+    now = datetime.utcnow()
+    db.session.execute(db.insert(User), [{
+        'username': row['username'],
+        'email': row['email'],
+        'password_hash': password_hash,
+        'full_name': row['full_name'],
+        'phone': row.get('phone', ''),
+        'is_admin': False,
+        'is_teacher': is_teacher,
+        'created_at': now
+    } for row, password_hash in zip(rows, hashes)])
+    db.session.commit()
+    return len(rows)
 
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        user = None
-        if 'user_id' in session:
-            user = User.query.get(session['user_id'])
-        if not user or not user.is_admin:
-            flash('Administrative access required.', 'danger')
-            return redirect(url_for('dashboard'))
-        return f(*args, **kwargs)
-    return decorated_function
+def _import_enrollment_batch(batch, seen, errors, courses):
+    user_ids = {username: user_id for user_id, username in db.session.query(User.id, User.username).filter(
+        User.username.in_({row.get('username', '') for _, row in batch}))}
+    
+    valid = []
+    for line_no, row in batch:
+        user_id = user_ids.get(row.get('username', ''))
+        course_id = courses.get(row.get('course', '').lower())
+        status = row.get('status') or 'pending'
+        payment_status = row.get('payment_status') or 'unpaid'
+        if user_id is None:
+            errors.append((line_no, f"Unknown username: {row.get('username', '')}"))
+        elif course_id is None:
+            errors.append((line_no, f"Unknown course: {row.get('course', '')}"))
+        elif status not in ('pending', 'active', 'completed'):
+            errors.append((line_no, f"Invalid status: {status}"))
+        elif payment_status not in ('unpaid', 'paid'):
+            errors.append((line_no, f"Invalid payment status: {payment_status}"))
+        elif ('enrollment', user_id, course_id) in seen:
+            errors.append((line_no, 'Duplicate enrollment in file'))
+        else:
+            seen.add(('enrollment', user_id, course_id))
+            valid.append((line_no, user_id, course_id, status, payment_status))
+    if not valid:
+        return 0
+    
+    existing = set(db.session.query(Enrollment.user_id, Enrollment.course_id).filter(
+        Enrollment.user_id.in_({user_id for _, user_id, _, _, _ in valid})))
+    
+    now = datetime.utcnow()
+    rows = []
+    for line_no, user_id, course_id, status, payment_status in valid:
+        if (user_id, course_id) in existing:
+            errors.append((line_no, 'Student is already enrolled in this course'))
+            continue
+        rows.append({
+            'user_id': user_id,
+            'course_id': course_id,
+            'enrollment_date': now,
+            'status': status,
+            'payment_status': payment_status,
+            'next_payment_due': now + timedelta(days=7)  # 7 days to make first payment
+        })
+    if not rows:
+        return 0
+    
+    # A concurrent enrollment that slips past the check above is skipped by the unique index
+    result = db.session.connection().execute(
+        sqlite_insert(Enrollment.__table__).on_conflict_do_nothing(index_elements=['user_id', 'course_id']),
+        rows
+    )
+    db.session.commit()
+    return result.rowcount
 
-def teacher_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        user = None
-        if 'user_id' in session:
-            user = User.query.get(session['user_id'])
-        if not user or not user.is_teacher:
-            flash('Teacher access required.', 'danger')
-            return redirect(url_for('dashboard'))
-        return f(*args, **kwargs)
-    return decorated_function
+def stream_page(template_name, **context):
+    """Render a page that extends base.html as a stream, flushing every REPORT_FLUSH_BYTES."""
+    # base.html pops the flashed messages - take them now, while the session cookie can still change
+    get_flashed_messages(with_categories=True)
+    pieces = stream_template(template_name, **context)
+    
+    def chunks():
+        buffered, size = [], 0
+        for piece in pieces:
+            buffered.append(piece)
+            size += len(piece)
+            if size >= REPORT_FLUSH_BYTES:
+                yield ''.join(buffered)
+                buffered, size = [], 0
+        if buffered:
+            yield ''.join(buffered)
+    return Response(chunks(), mimetype='text/html')
+
+def report_rows(rows, now):
+    """Attach payment status to (enrollment, student, course) rows as they stream past."""
+    for enrollment, student, course in rows:
+        status = classify(enrollment.next_payment_due, now)
+        yield {
+            'enrollment': enrollment,
+            'user': student,
+            'student': student,
+            'course': course,
+            'monthly_fee': course.tuition_fee,
+            'payment_status': status.label,
+            'status_class': status.css_class,
+            'days_until_due': status.days_until_due,
+            'is_overdue': status.kind == OVERDUE,
+            'overdue_days': -status.days_until_due if status.kind == OVERDUE else 0
+        }
+
+def payment_summary(query, now, source=Enrollment):
+    """Row count, overdue and due-soon counts and fee total for a filtered enrollment query."""
+    # A due date before now is overdue; within DUE_SOON_DAYS whole days counts as due soon
+    due = source.next_payment_due
+    due_soon_end = now + timedelta(days=DUE_SOON_DAYS + 1)
+    return query.with_entities(
+        db.func.count(source.id),
+        db.func.coalesce(db.func.sum(db.case((due < now, 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((db.and_(due >= now, due < due_soon_end), 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(Course.tuition_fee), 0)
+    ).one()
+
+def student_matrix(courses):
+    """One row per enrollment in the given courses, with its payment status."""
+    rows = [(course, enrollment) for course in courses for enrollment in course.enrollments]
+    statuses, counts = classify_batch(enrollment.next_payment_due for _, enrollment in rows)
+    student_data = [{
+        'student': enrollment.student,
+        'course': course,
+        'enrollment': enrollment,
+        'payment_status': status.label,
+        'status_class': status.css_class,
+        'days_until_due': status.days_until_due
+    } for (course, enrollment), status in zip(rows, statuses)]
+    return student_data, counts
 
 # Routes
-@app.route('/')
+@main.route('/')
+@query_budget(2)
 def index():
     courses = Course.query.all()
     teachers = User.query.filter_by(is_teacher=True).limit(3).all()
     return render_template('index.html', courses=courses, teachers=teachers)
 
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -180,16 +394,7 @@ def register():
         full_name = request.form['full_name']
         phone = request.form.get('phone', '')
         
-        # Check if user exists
-        if User.query.filter_by(username=username).first():
-            flash('Username already exists!', 'danger')
-            return redirect(url_for('register'))
-        
-        if User.query.filter_by(email=email).first():
-            flash('Email already registered!', 'danger')
-            return redirect(url_for('register'))
-        
-        # Create new user
+        # Create new user - the unique indexes on username and email reject duplicates
         hashed_password = generate_password_hash(password)
         new_user = User(
             username=username,
@@ -200,14 +405,19 @@ def register():
         )
         
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            flash(duplicate_user_message(e), 'danger')
+            return redirect(url_for('main.register'))
         
         flash('Registration successful! Please log in.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -225,38 +435,85 @@ def login():
             
             # Redirect based on user role
             if user.is_teacher and not user.is_admin:
-                return redirect(url_for('teacher_dashboard'))
+                return redirect(url_for('main.teacher_dashboard'))
             else:
-                return redirect(url_for('dashboard'))
+                return redirect(url_for('main.dashboard'))
         else:
             flash('Invalid username or password!', 'danger')
     
     return render_template('login.html')
 
-@app.route('/logout')
+@main.route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out successfully.', 'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/dashboard')
+@main.route('/dashboard')
 @login_required
+@query_budget(8)
 def dashboard():
     user = User.query.get(session['user_id'])
-    enrollments = Enrollment.query.filter_by(user_id=user.id).all()
+    enrollments = Enrollment.query.filter_by(user_id=user.id).options(db.joinedload(Enrollment.course)).all()
     
     # Show payment success message if redirected from payment
     if request.args.get('payment') == 'success':
         flash('Payment successful! Your course is now active.', 'success')
     
-    return render_template('dashboard.html', user=user, enrollments=enrollments)
+    # Per-enrollment totals are aggregated in SQL rather than by loading every payment
+    now = datetime.utcnow()
+    balances = {
+        row.enrollment_id: row
+        for row in db.session.query(
+            Enrollment.id.label('enrollment_id'),
+            db.func.count(Payment.id).label('payment_count'),
+            db.func.coalesce(db.func.sum(Payment.amount), 0).label('total_paid'),
+            db.func.max(Payment.payment_date).label('last_payment'),
+            db.case(
+                (db.and_(Enrollment.status != 'completed', Enrollment.next_payment_due <= now), Course.tuition_fee),
+                else_=0
+            ).label('amount_due')
+        ).join(
+            Course, Enrollment.course_id == Course.id
+        ).outerjoin(
+            Payment, db.and_(Payment.enrollment_id == Enrollment.id, Payment.status == 'completed')
+        ).filter(
+            Enrollment.user_id == user.id
+        ).group_by(Enrollment.id)
+    }
+    
+    # Billing history, newest first, one page at a time
+    billing = Payment.query.join(
+        Enrollment, Payment.enrollment_id == Enrollment.id
+    ).join(
+        Course, Enrollment.course_id == Course.id
+    ).filter(
+        Enrollment.user_id == user.id
+    ).options(
+        db.contains_eager(Payment.enrollment).contains_eager(Enrollment.course)
+    ).order_by(Payment.payment_date.desc(), Payment.id.desc()).paginate(
+        page=request.args.get('billing_page', 1, type=int),
+        per_page=BILLING_PAGE_SIZE,
+        error_out=False
+    )
+    
+    # Memorized ayahs for enrollments whose teacher tracks Hifz progress
+    hifz_counts = dict(db.session.query(HifzProgress.enrollment_id, HifzProgress.memorized_count).filter(
+        HifzProgress.enrollment_id.in_([enrollment.id for enrollment in enrollments])
+    ).all()) if enrollments else {}
+    
+    return render_template('dashboard.html', user=user, enrollments=enrollments,
+                           balances=balances, billing=billing, hifz_counts=hifz_counts,
+                           revision_queue=todays_queue(hifz_counts),
+                           saved_card=db.session.get(SavedPaymentMethod, user.id))
 
-@app.route('/courses')
+@main.route('/courses')
+@query_budget(1)
 def courses():
-    all_courses = Course.query.all()
+    all_courses = Course.query.options(db.joinedload(Course.teacher)).all()
     return render_template('courses.html', courses=all_courses)
 
-@app.route('/admin/courses', methods=['GET', 'POST'])
+@main.route('/admin/courses', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def admin_courses():
@@ -283,7 +540,8 @@ def admin_courses():
         filename = secure_filename(file.filename)
         timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
         filename = f"{timestamp}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         icon = f"/static/uploads/icons/{filename}"
 
@@ -299,18 +557,44 @@ def admin_courses():
         db.session.add(course)
         db.session.commit()
         flash('Course added successfully.', 'success')
-        return redirect(url_for('admin_courses'))
+        return redirect(url_for('main.admin_courses'))
 
     courses = Course.query.order_by(Course.created_at.desc()).all()
     teachers = User.query.filter_by(is_teacher=True).all()
     return render_template('admin_courses.html', courses=courses, teachers=teachers)
 
-@app.route('/enroll/<int:course_id>', methods=['GET', 'POST'])
+@main.route('/enroll/<int:course_id>', methods=['GET', 'POST'])
 @login_required
 def enroll(course_id):
-    course = Course.query.get_or_404(course_id)
+    course = get_course_or_404(course_id)
     user_id = session['user_id']
     
+    if request.method == 'POST':
+        # Create enrollment in one statement - the (user_id, course_id) unique
+        # index turns a duplicate or racing submission into a no-op
+        result = db.session.execute(
+            sqlite_insert(Enrollment).values(
+                user_id=user_id,
+                course_id=course_id,
+                enrollment_date=datetime.utcnow(),
+                status='pending',
+                payment_status='unpaid',
+                next_payment_due=datetime.utcnow() + timedelta(days=7)  # 7 days to make first payment
+            ).on_conflict_do_nothing(index_elements=['user_id', 'course_id'])
+        )
+        db.session.commit()
+        
+        if not result.rowcount:
+            flash('You are already enrolled in this course!', 'warning')
+            return redirect(url_for('main.dashboard'))
+        
+        # The PaymentIntent is created while the student's browser follows the redirect
+        enrollment_id = result.inserted_primary_key[0]
+        prefetch_intent(enrollment_id)
+        
+        flash('Enrollment successful! Please proceed with payment.', 'success')
+        return redirect(url_for('main.payment', enrollment_id=enrollment_id))
+    
     # Check if already enrolled
     existing_enrollment = Enrollment.query.filter_by(
         user_id=user_id, 
@@ -319,47 +603,33 @@ def enroll(course_id):
     
     if existing_enrollment:
         flash('You are already enrolled in this course!', 'warning')
-        return redirect(url_for('dashboard'))
-    
-    if request.method == 'POST':
-        # Create enrollment
-        new_enrollment = Enrollment(
-            user_id=user_id,
-            course_id=course_id,
-            status='pending',
-            payment_status='unpaid',
-            next_payment_due=datetime.utcnow() + timedelta(days=7)  # 7 days to make first payment
-        )
-        db.session.add(new_enrollment)
-        db.session.commit()
-        
-        flash('Enrollment successful! Please proceed with payment.', 'success')
-        return redirect(url_for('payment', enrollment_id=new_enrollment.id))
+        return redirect(url_for('main.dashboard'))
     
     return render_template('enroll.html', course=course)
 
-@app.route('/payment/<int:enrollment_id>', methods=['GET', 'POST'])
+@main.route('/payment/<int:enrollment_id>', methods=['GET', 'POST'])
 @login_required
 def payment(enrollment_id):
     enrollment = Enrollment.query.get_or_404(enrollment_id)
-    user = User.query.get(session['user_id'])
     
     # Verify ownership
     if enrollment.user_id != session['user_id']:
         flash('Unauthorized access!', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
+    
+    course = get_course(enrollment.course_id)
     
     # Check if already paid
     if enrollment.payment_status == 'paid':
         flash('This enrollment has already been paid for.', 'info')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     
     # Check if Stripe is configured with valid keys
     stripe_configured = (
-        stripe.api_key and 
-        app.config['STRIPE_PUBLIC_KEY'] and
-        app.config['STRIPE_PUBLIC_KEY'].startswith('pk_') and
-        not app.config['STRIPE_PUBLIC_KEY'].endswith('_here')
+        stripe_enabled() and 
+        current_app.config['STRIPE_PUBLIC_KEY'] and
+        current_app.config['STRIPE_PUBLIC_KEY'].startswith('pk_') and
+        not current_app.config['STRIPE_PUBLIC_KEY'].endswith('_here')
     )
     
     # Handle demo mode POST for non-Stripe payments
@@ -367,7 +637,7 @@ def payment(enrollment_id):
         # Create payment record for demo
         new_payment = Payment(
             enrollment_id=enrollment_id,
-            amount=enrollment.course.tuition_fee,
+            amount=course.tuition_fee,
             payment_method='demo',
             transaction_id=f'DEMO{datetime.utcnow().strftime("%Y%m%d%H%M%S")}{enrollment_id}',
             status='completed'
@@ -380,17 +650,30 @@ def payment(enrollment_id):
         enrollment.next_payment_due = datetime.utcnow() + timedelta(days=30)
         
         db.session.add(new_payment)
+        record_revenue(new_payment, course)
         db.session.commit()
+        queue_receipt(new_payment.id)
         
         flash('Demo payment successful! Your course is now active.', 'success')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
+    
+    # Hand over the intent created in the background, or start one for the page's fallback call
+    client_secret = None
+    if stripe_configured:
+        intent = cached_intent(enrollment.id, intent_amount(course))
+        if intent is not None:
+            client_secret = intent.client_secret
+        else:
+            prefetch_intent(enrollment.id)
     
     return render_template('payment.html', 
                          enrollment=enrollment,
-                         stripe_public_key=app.config['STRIPE_PUBLIC_KEY'],
+                         course=course,
+                         client_secret=client_secret,
+                         stripe_public_key=current_app.config['STRIPE_PUBLIC_KEY'],
                          stripe_configured=stripe_configured)
 
-@app.route('/create-payment-intent/<int:enrollment_id>', methods=['POST'])
+@main.route('/create-payment-intent/<int:enrollment_id>', methods=['POST'])
 @login_required
 def create_payment_intent(enrollment_id):
     enrollment = Enrollment.query.get_or_404(enrollment_id)
@@ -401,40 +684,23 @@ def create_payment_intent(enrollment_id):
         return jsonify({'error': 'Unauthorized'}), 403
     
     # Check if Stripe is configured
-    if not stripe.api_key or not stripe.api_key.startswith('sk_'):
+    if not stripe_enabled():
         return jsonify({'error': 'Stripe is not configured. Using demo mode instead.'}), 400
     
+    stripe = get_stripe()
     try:
-        # Create or retrieve Stripe customer
         if not user.email:
             return jsonify({'error': 'Email required for payment. Please update your profile.'}), 400
         
-        # Create Stripe customer if doesn't exist
-        customer = stripe.Customer.create(
-            email=user.email,
-            name=user.full_name,
-            metadata={'user_id': user.id}
-        )
-        
-        # Create payment intent
-        amount = int(enrollment.course.tuition_fee * 100)  # Convert to cents
-        
-        intent = stripe.PaymentIntent.create(
-            amount=amount,
-            currency='usd',
-            customer=customer.id,
-            metadata={
-                'enrollment_id': enrollment_id,
-                'user_id': user.id,
-                'course_id': enrollment.course_id,
-                'course_name': enrollment.course.name
-            },
-            description=f'Payment for {enrollment.course.name}'
-        )
+        # Normally the background worker has already created the intent - this is the fallback
+        wait_for_prefetch(enrollment_id)
+        intent = ensure_intent(enrollment_id)
+        if intent is None:
+            return jsonify({'error': 'This enrollment has already been paid for.'}), 400
         
         return jsonify({
             'clientSecret': intent.client_secret,
-            'amount': enrollment.course.tuition_fee
+            'amount': intent.amount / 100
         })
     
     except stripe.error.AuthenticationError as e:
@@ -444,7 +710,7 @@ def create_payment_intent(enrollment_id):
     except Exception as e:
         return jsonify({'error': f'Payment initialization failed: {str(e)}'}), 400
 
-@app.route('/payment-success/<int:enrollment_id>', methods=['POST'])
+@main.route('/payment-success/<int:enrollment_id>', methods=['POST'])
 @login_required
 def payment_success(enrollment_id):
     enrollment = Enrollment.query.get_or_404(enrollment_id)
@@ -459,20 +725,27 @@ def payment_success(enrollment_id):
     if not payment_intent_id:
         return jsonify({'error': 'No payment intent ID provided'}), 400
     
+    # Check if Stripe is configured
+    if not stripe_enabled():
+        # Stripe not configured - this shouldn't happen if we got here
+        return jsonify({'error': 'Stripe is not properly configured'}), 400
+    
+    stripe = get_stripe()
     try:
-        # Check if Stripe is configured
-        if not stripe.api_key or not stripe.api_key.startswith('sk_'):
-            # Stripe not configured - this shouldn't happen if we got here
-            return jsonify({'error': 'Stripe is not properly configured'}), 400
-        
         # Verify payment with Stripe
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+        with track_outbound('stripe'):
+            intent = stripe.PaymentIntent.retrieve(payment_intent_id)
         
         if intent.status == 'succeeded':
+            # A refresh or double submit posts the same intent again - it is already recorded
+            if Payment.query.filter_by(stripe_payment_intent=payment_intent_id).first():
+                return jsonify({'success': True, 'message': 'Payment successful!'})
+            
             # Create payment record
+            course = get_course(enrollment.course_id)
             new_payment = Payment(
                 enrollment_id=enrollment_id,
-                amount=enrollment.course.tuition_fee,
+                amount=course.tuition_fee,
                 payment_method='stripe',
                 transaction_id=payment_intent_id,
                 stripe_payment_intent=payment_intent_id,
@@ -487,7 +760,17 @@ def payment_success(enrollment_id):
             enrollment.next_payment_due = datetime.utcnow() + timedelta(days=30)
             
             db.session.add(new_payment)
-            db.session.commit()
+            record_revenue(new_payment, course)
+            discard_intent(enrollment_id)
+            if intent.customer and intent.payment_method:
+                save_payment_method(enrollment.user_id, intent.customer, intent.payment_method)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent request recorded this intent first
+                db.session.rollback()
+                return jsonify({'success': True, 'message': 'Payment successful!'})
+            queue_receipt(new_payment.id)
             
             return jsonify({'success': True, 'message': 'Payment successful!'})
         else:
@@ -507,38 +790,42 @@ def payment_success(enrollment_id):
         traceback.print_exc()
         return jsonify({'error': f'Payment verification failed: {str(e)}'}), 400
 
-@app.route('/about')
+@main.route('/about')
 def about():
     return render_template('about.html')
 
-@app.route('/contact')
+@main.route('/contact')
 def contact():
     return render_template('contact.html')
 
-@app.route('/founder')
+@main.route('/founder')
 def founder():
     return render_template('founder.html')
 
 # Public Teacher Routes
-@app.route('/teachers')
+@main.route('/teachers')
+@query_budget(2)
 def teachers():
-    all_teachers = User.query.filter_by(is_teacher=True).all()
+    all_teachers = User.query.filter_by(is_teacher=True).options(db.selectinload(User.teaching_courses)).all()
     return render_template('teachers.html', teachers=all_teachers)
 
-@app.route('/teachers/<int:teacher_id>')
+@main.route('/teachers/<int:teacher_id>')
+@query_budget(2)
 def teacher_public_profile(teacher_id):
-    teacher = User.query.get_or_404(teacher_id)
+    teacher = get_teacher(teacher_id)
+    if teacher is None:
+        abort(404)
     
     if not teacher.is_teacher:
         flash('Teacher not found.', 'danger')
-        return redirect(url_for('teachers'))
+        return redirect(url_for('main.teachers'))
     
     # Get courses taught by this teacher
     courses = Course.query.filter_by(teacher_id=teacher.id).all()
     
     return render_template('teacher_public_profile.html', teacher=teacher, courses=courses)
 
-@app.route('/admin/courses/edit/<int:course_id>', methods=['GET', 'POST'])
+@main.route('/admin/courses/edit/<int:course_id>', methods=['GET', 'POST'])
 @admin_required
 def edit_course(course_id):
     course = Course.query.get_or_404(course_id)
@@ -562,7 +849,8 @@ def edit_course(course_id):
                 filename = secure_filename(file.filename)
                 timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
                 filename = f"{timestamp}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+                filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
                 file.save(filepath)
                 course.icon = f"/static/uploads/icons/{filename}"
             else:
@@ -577,13 +865,14 @@ def edit_course(course_id):
         course.teacher_id = int(teacher_id) if teacher_id else None
         
         db.session.commit()
+        invalidate_course(course.id)
         flash(f'Course "{course.name}" updated successfully!', 'success')
-        return redirect(url_for('admin_courses'))
+        return redirect(url_for('main.admin_courses'))
     
     teachers = User.query.filter_by(is_teacher=True).all()
     return render_template('edit_course.html', course=course, teachers=teachers)
 
-@app.route('/admin/courses/delete/<int:course_id>', methods=['POST'])
+@main.route('/admin/courses/delete/<int:course_id>', methods=['POST'])
 @admin_required
 def delete_course(course_id):
     course = Course.query.get_or_404(course_id)
@@ -593,79 +882,94 @@ def delete_course(course_id):
     enrollments = Enrollment.query.filter_by(course_id=course_id).all()
     if enrollments:
         flash(f'Cannot delete "{course_name}" because it has active enrollments.', 'danger')
-        return redirect(url_for('admin_courses'))
+        return redirect(url_for('main.admin_courses'))
     
     db.session.delete(course)
     db.session.commit()
+    invalidate_course(course_id)
     flash(f'Course "{course_name}" deleted successfully!', 'success')
-    return redirect(url_for('admin_courses'))
+    return redirect(url_for('main.admin_courses'))
 
-@app.route('/admin/reports')
+@main.route('/admin/reports')
 @login_required
 @admin_required
+@query_budget(5)
 def admin_reports():
-    # Get all active enrollments with payment information
-    enrollments = db.session.query(Enrollment, User, Course).join(
+    # Active enrollments, overdue first then soonest due - ordered in SQL so rows can stream
+    active = db.session.query(Enrollment).join(
         User, Enrollment.user_id == User.id
     ).join(
         Course, Enrollment.course_id == Course.id
     ).filter(
         Enrollment.status == 'active'
-    ).all()
+    )
+    now = datetime.utcnow()
+    total_students, overdue_count, due_soon, monthly_revenue = payment_summary(active, now)
     
-    # Calculate payment status for each enrollment
-    report_data = []
-    current_date = datetime.utcnow()
+    rows = active.with_entities(Enrollment, User, Course).options(
+        db.joinedload(Course.teacher)
+    ).order_by(
+        Enrollment.next_payment_due.is_(None), Enrollment.next_payment_due, Enrollment.id
+    ).yield_per(REPORT_FETCH_SIZE)
     
-    for enrollment, user, course in enrollments:
-        # Calculate days until next payment or overdue
-        days_until_due = None
-        is_overdue = False
-        overdue_days = 0
-        
-        if enrollment.next_payment_due:
-            time_diff = enrollment.next_payment_due - current_date
-            days_until_due = time_diff.days
-            if days_until_due < 0:
-                is_overdue = True
-                overdue_days = abs(days_until_due)
-        
-        report_data.append({
-            'enrollment': enrollment,
-            'user': user,
-            'course': course,
-            'monthly_fee': course.tuition_fee,
-            'days_until_due': days_until_due,
-            'is_overdue': is_overdue,
-            'overdue_days': overdue_days
-        })
+    # Bulk status changes can be narrowed to one course
+    courses = Course.query.order_by(Course.name).all()
     
-    # Sort by overdue first, then by days until due
-    report_data.sort(key=lambda x: (not x['is_overdue'], x['days_until_due'] if x['days_until_due'] is not None else 999))
+    return stream_page('admin_reports.html',
+                       report_data=report_rows(rows, now),
+                       courses=courses,
+                       transitions=available_transitions(('active',)),
+                       total_students=total_students,
+                       overdue_count=overdue_count,
+                       due_soon=due_soon,
+                       monthly_revenue=monthly_revenue)
+
+@main.route('/admin/finance')
+@login_required
+@admin_required
+@query_budget(5)
+def admin_finance():
+    # Every figure here is read from the revenue rollups - no payment scans
+    monthly = MonthlyRevenue.query.order_by(MonthlyRevenue.period.desc()).limit(12).all()
+    totals = db.session.query(
+        db.func.coalesce(db.func.sum(MonthlyRevenue.total_amount), 0),
+        db.func.coalesce(db.func.sum(MonthlyRevenue.payment_count), 0)
+    ).one()
+    course_revenue = CourseRevenue.query.options(
+        db.joinedload(CourseRevenue.course)
+    ).order_by(CourseRevenue.total_amount.desc()).all()
+    teacher_revenue = TeacherRevenue.query.options(
+        db.joinedload(TeacherRevenue.teacher)
+    ).order_by(TeacherRevenue.total_amount.desc()).all()
     
-    return render_template('admin_reports.html', report_data=report_data)
+    return render_template('admin_finance.html',
+                         monthly=monthly,
+                         total_revenue=totals[0],
+                         total_payments=totals[1],
+                         course_revenue=course_revenue,
+                         teacher_revenue=teacher_revenue)
 
-@app.route('/admin/send-reminder/<int:enrollment_id>', methods=['POST'])
+@main.route('/admin/send-reminder/<int:enrollment_id>', methods=['POST'])
 @login_required
 @admin_required
 def send_payment_reminder(enrollment_id):
     enrollment = Enrollment.query.get_or_404(enrollment_id)
     user = User.query.get(enrollment.user_id)
-    course = Course.query.get(enrollment.course_id)
+    course = get_course(enrollment.course_id)
     
     # Prepare email content
     subject = f"Payment Reminder - {course.name}"
     
+    status = classify(enrollment.next_payment_due)
     if enrollment.next_payment_due:
         due_date = enrollment.next_payment_due.strftime('%B %d, %Y')
-        days_diff = (enrollment.next_payment_due - datetime.utcnow()).days
         
-        if days_diff < 0:
-            status_text = f"<strong style='color: #dc3545;'>OVERDUE by {abs(days_diff)} days</strong>"
-        elif days_diff == 0:
+        if status.kind == OVERDUE:
+            status_text = f"<strong style='color: #dc3545;'>OVERDUE by {-status.days_until_due} days</strong>"
+        elif status.kind == DUE_TODAY:
             status_text = "<strong style='color: #ffc107;'>DUE TODAY</strong>"
         else:
-            status_text = f"due in {days_diff} days"
+            status_text = f"due in {status.days_until_due} days"
     else:
         due_date = "Not set"
         status_text = "pending"
@@ -723,10 +1027,10 @@ def send_payment_reminder(enrollment_id):
     else:
         flash(f'Failed to send email to {user.email}. Please check email configuration.', 'danger')
     
-    return redirect(url_for('admin_reports'))
+    return redirect(url_for('main.admin_reports'))
 
 # Teacher Routes
-@app.route('/teacher/profile', methods=['GET', 'POST'])
+@main.route('/teacher/profile', methods=['GET', 'POST'])
 @login_required
 @teacher_required
 def teacher_profile():
@@ -766,7 +1070,7 @@ def teacher_profile():
                 filename = f"teacher_{teacher.id}_{timestamp}_{filename}"
                 
                 # Create teachers folder if not exists
-                teachers_folder = os.path.join(app.config['UPLOAD_FOLDER'], '..', 'teachers')
+                teachers_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], '..', 'teachers')
                 os.makedirs(teachers_folder, exist_ok=True)
                 
                 filepath = os.path.join(teachers_folder, filename)
@@ -777,61 +1081,43 @@ def teacher_profile():
                 return render_template('teacher_profile.html', teacher=teacher)
         
         db.session.commit()
+        invalidate_teacher(teacher.id)
         flash('Profile updated successfully!', 'success')
-        return redirect(url_for('teacher_profile'))
+        return redirect(url_for('main.teacher_profile'))
     
     return render_template('teacher_profile.html', teacher=teacher)
 
-@app.route('/teacher/dashboard')
+@main.route('/teacher/dashboard')
 @login_required
 @teacher_required
+@query_budget(6)
 def teacher_dashboard():
     teacher = User.query.get(session['user_id'])
-    courses = Course.query.filter_by(teacher_id=teacher.id).all()
+    # Enrollments and their students come in with the courses, not one query per row
+    courses = Course.query.filter_by(teacher_id=teacher.id).options(
+        db.selectinload(Course.enrollments).joinedload(Enrollment.student)
+    ).all()
     
     # Get student matrix for teacher's courses
-    student_data = []
-    for course in courses:
-        enrollments = Enrollment.query.filter_by(course_id=course.id).all()
-        for enrollment in enrollments:
-            student = User.query.get(enrollment.user_id)
-            
-            # Calculate payment status
-            payment_status = 'No payment yet'
-            status_class = 'warning'
-            days_until_due = None
-            
-            if enrollment.next_payment_due:
-                days_until_due = (enrollment.next_payment_due - datetime.utcnow()).days
-                
-                if days_until_due < 0:
-                    payment_status = f'Overdue by {abs(days_until_due)} days'
-                    status_class = 'danger'
-                elif days_until_due == 0:
-                    payment_status = 'Due today'
-                    status_class = 'warning'
-                elif days_until_due <= 7:
-                    payment_status = f'Due in {days_until_due} days'
-                    status_class = 'warning'
-                else:
-                    payment_status = f'Due in {days_until_due} days'
-                    status_class = 'success'
-            
-            student_data.append({
-                'student': student,
-                'course': course,
-                'enrollment': enrollment,
-                'payment_status': payment_status,
-                'status_class': status_class,
-                'days_until_due': days_until_due
-            })
-    
-    return render_template('teacher_dashboard.html', teacher=teacher, courses=courses, student_data=student_data)
+    student_data, status_counts = student_matrix(courses)
+    
+    # Class-wide Hifz aggregates from the progress bitsets
+    hifz_progress = load_progress([item['enrollment'].id for item in student_data]) if student_data else {}
+    
+    return render_template('teacher_dashboard.html', teacher=teacher, courses=courses,
+                           student_data=student_data, status_counts=status_counts,
+                           hifz_summary=class_summary(list(hifz_progress.values())),
+                           hifz_counts={enrollment_id: bits.bit_count()
+                                        for enrollment_id, (bits, _) in hifz_progress.items()},
+                           revision_queue=todays_queue(hifz_progress),
+                           recordings=recent_recordings(item['enrollment'].id for item in student_data),
+                           transitions=available_transitions())
 
 # Admin Teacher Management Routes
-@app.route('/admin/teachers', methods=['GET', 'POST'])
+@main.route('/admin/teachers', methods=['GET', 'POST'])
 @login_required
 @admin_required
+@query_budget(3)
 def admin_teachers():
     if request.method == 'POST':
         username = request.form['username']
@@ -840,16 +1126,7 @@ def admin_teachers():
         full_name = request.form['full_name']
         phone = request.form.get('phone', '')
         
-        # Check if user exists
-        if User.query.filter_by(username=username).first():
-            flash('Username already exists!', 'danger')
-            return redirect(url_for('admin_teachers'))
-        
-        if User.query.filter_by(email=email).first():
-            flash('Email already registered!', 'danger')
-            return redirect(url_for('admin_teachers'))
-        
-        # Create new teacher
+        # Create new teacher - the unique indexes on username and email reject duplicates
         hashed_password = generate_password_hash(password)
         new_teacher = User(
             username=username,
@@ -861,14 +1138,46 @@ def admin_teachers():
         )
         
         db.session.add(new_teacher)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            flash(duplicate_user_message(e), 'danger')
+            return redirect(url_for('main.admin_teachers'))
         flash(f'Teacher {full_name} added successfully!', 'success')
-        return redirect(url_for('admin_teachers'))
+        return redirect(url_for('main.admin_teachers'))
     
-    teachers = User.query.filter_by(is_teacher=True).all()
+    teachers = User.query.filter_by(is_teacher=True).options(db.selectinload(User.teaching_courses)).all()
     return render_template('admin_teachers.html', teachers=teachers)
 
-@app.route('/admin/teachers/delete/<int:teacher_id>', methods=['POST'])
+@main.route('/admin/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def admin_import():
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        file = request.files.get('csv_file')
+        if kind not in IMPORT_COLUMNS:
+            flash('Please choose what the file contains.', 'danger')
+            return redirect(url_for('main.admin_import'))
+        if not file or not file.filename:
+            flash('Please choose a CSV file to upload.', 'danger')
+            return redirect(url_for('main.admin_import'))
+        
+        # Stream the upload through the csv reader instead of reading it into memory
+        stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+        created, errors = import_csv(stream, kind)
+        
+        if created:
+            flash(f'Imported {created} {kind}.', 'success')
+        if errors:
+            flash(f'{len(errors)} row(s) were skipped. See the report below.', 'warning')
+        return render_template('admin_import.html', columns=IMPORT_COLUMNS, kind=kind,
+                               created=created, errors=errors)
+    
+    return render_template('admin_import.html', columns=IMPORT_COLUMNS)
+
+@main.route('/admin/teachers/delete/<int:teacher_id>', methods=['POST'])
 @login_required
 @admin_required
 def delete_teacher(teacher_id):
@@ -878,84 +1187,75 @@ def delete_teacher(teacher_id):
     assigned_courses = Course.query.filter_by(teacher_id=teacher_id).count()
     if assigned_courses > 0:
         flash(f'Cannot delete teacher. {assigned_courses} courses are assigned to this teacher. Please reassign courses first.', 'danger')
-        return redirect(url_for('admin_teachers'))
+        return redirect(url_for('main.admin_teachers'))
     
     db.session.delete(teacher)
     db.session.commit()
+    invalidate_teacher(teacher_id)
     flash(f'Teacher {teacher.full_name} deleted successfully.', 'success')
-    return redirect(url_for('admin_teachers'))
+    return redirect(url_for('main.admin_teachers'))
 
-@app.route('/admin/reports/teacher/<int:teacher_id>')
+@main.route('/admin/reports/teacher/<int:teacher_id>')
 @login_required
 @admin_required
+@query_budget(9)
 def admin_teacher_report(teacher_id):
     teacher = User.query.get_or_404(teacher_id)
     
     if not teacher.is_teacher:
         flash('User is not a teacher.', 'danger')
-        return redirect(url_for('admin_reports'))
+        return redirect(url_for('main.admin_reports'))
     
-    courses = Course.query.filter_by(teacher_id=teacher.id).all()
+    # Archived enrollments are only read when the history is asked for
+    history = request.args.get('history') == '1'
+    source = archive.enrollment_source(history)
     
-    # Get student matrix for this teacher's courses
-    student_data = []
-    total_students = 0
-    total_revenue = 0
-    overdue_count = 0
+    courses = Course.query.filter_by(teacher_id=teacher.id).order_by(Course.id).all()
+    enrollment_counts = dict(db.session.query(
+        source.course_id, db.func.count(source.id)
+    ).join(
+        Course, source.course_id == Course.id
+    ).filter(
+        Course.teacher_id == teacher.id
+    ).group_by(source.course_id).all())
     
-    for course in courses:
-        enrollments = Enrollment.query.filter_by(course_id=course.id).all()
-        total_students += len(enrollments)
-        
-        for enrollment in enrollments:
-            student = User.query.get(enrollment.user_id)
-            
-            # Calculate payment status
-            payment_status = 'No payment yet'
-            status_class = 'warning'
-            days_until_due = None
-            
-            if enrollment.next_payment_due:
-                days_until_due = (enrollment.next_payment_due - datetime.utcnow()).days
-                
-                if days_until_due < 0:
-                    payment_status = f'Overdue by {abs(days_until_due)} days'
-                    status_class = 'danger'
-                    overdue_count += 1
-                elif days_until_due == 0:
-                    payment_status = 'Due today'
-                    status_class = 'warning'
-                elif days_until_due <= 7:
-                    payment_status = f'Due in {days_until_due} days'
-                    status_class = 'warning'
-                else:
-                    payment_status = f'Due in {days_until_due} days'
-                    status_class = 'success'
-            
-            if enrollment.last_payment_date:
-                total_revenue += course.tuition_fee
-            
-            student_data.append({
-                'student': student,
-                'course': course,
-                'enrollment': enrollment,
-                'payment_status': payment_status,
-                'status_class': status_class,
-                'days_until_due': days_until_due
-            })
-    
-    return render_template('admin_teacher_report.html', 
-                         teacher=teacher, 
-                         courses=courses, 
-                         student_data=student_data,
-                         total_students=total_students,
-                         total_revenue=total_revenue,
-                         overdue_count=overdue_count)
-
-    return redirect(url_for('admin_reports'))
+    # Student matrix for this teacher's courses - totals first, then rows streamed in course order
+    enrollments = db.session.query(source).join(
+        User, source.user_id == User.id
+    ).join(
+        Course, source.course_id == Course.id
+    ).filter(
+        Course.teacher_id == teacher.id
+    )
+    now = datetime.utcnow()
+    total_students, overdue_count, _, _ = payment_summary(enrollments, now, source)
+    rows = enrollments.with_entities(source, User, Course).order_by(
+        Course.id, source.id
+    ).yield_per(REPORT_FETCH_SIZE)
+    
+    # Revenue comes from the ledger rollup rather than fee x enrollments
+    teacher_revenue = TeacherRevenue.query.get(teacher.id)
+    total_revenue = teacher_revenue.total_amount if teacher_revenue else 0
+    
+    # Attendance rates are read from the monthly rollups
+    student_attendance, course_attendance = attendance_rates(course.id for course in courses)
+    
+    return stream_page('admin_teacher_report.html',
+                       teacher=teacher,
+                       courses=courses,
+                       enrollment_counts=enrollment_counts,
+                       student_data=report_rows(rows, now),
+                       total_students=total_students,
+                       total_revenue=total_revenue,
+                       overdue_count=overdue_count,
+                       history=history,
+                       archive_enabled=archive.enabled(),
+                       student_attendance=student_attendance,
+                       course_attendance=course_attendance,
+                       attendance_months=ATTENDANCE_MONTHS)
 
 # Initialize database and sample data
-def init_db():
+def init_db(app):
     with app.app_context():
         db.create_all()
         
@@ -1032,5 +1332,6 @@ def init_db():
             print("Created sample teacher user (username: teacher, password: Teacher@1234)")
 
 if __name__ == '__main__':
-    init_db()
+    app = create_app()
+    init_db(app)
     app.run(debug=True, port=5000)
@@ -0,0 +1,301 @@
+"""
+Archival of old enrollments and payments for Raindrops Academy
+Completed enrollments that have been idle for ARCHIVE_COMPLETED_DAYS, with
+their payments, and any payment older than ARCHIVE_PAYMENT_DAYS are moved
+out of the live tables into a separate SQLite file (ARCHIVE_DATABASE,
+default <database>-archive.db) so dashboards and reports only ever scan the
+working set. The file is attached to every connection as "archive", and
+the temporary views enrollment_history and payment_history union the live
+and archived rows for the historical reports that ask for them.
+
+An archived enrollment takes its history with it - Hifz progress and
+snapshots, revision state, attendance marks and monthly rollups, and past
+bookings - and its cached checkout intent and revision queue are deleted.
+Tables whose rows have their own ids are keyed by (enrollment_id, id) in the
+archive, so an id SQLite hands out again after a move never collides there.
+Ledger entries, receipts and the enrollment audit trail stay in the main
+database as permanent records; receipts and the revenue rebuild read
+payments through payment_history. Enrollments that still have recordings are
+not archived, because the audio files and quota are tracked by the live
+table.
+
+Rows move in batches of ARCHIVE_BATCH_SIZE, one transaction each: copy into
+the archive, then delete from the live table. In WAL mode a crash can commit
+the copy without the delete, so each run first drops live rows that are
+already archived, and copies use INSERT OR REPLACE. The newest row of each
+table is never archived, so SQLite never hands its id out again.
+
+    python archive.py run              # move everything past the horizons
+    python archive.py run --dry-run
+    python archive.py status
+
+backup.py snapshots and restores the archive file together with the main
+database.
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import MetaData, Table, event
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from models import (db, Attendance, Booking, CheckoutIntent, Enrollment, HifzProgress, HifzSnapshot, Payment,
+                    Recording, RevisionQueue, RevisionState, StudentAttendance)
+
+SCHEMA = 'archive'
+
+_archive_metadata = MetaData()
+
+
+def _archive_table(table, *indexes, by_enrollment=False):
+    """Copy of a live table in the archive schema - same columns, no foreign keys, plus archived_at.
+
+    by_enrollment adds enrollment_id to the primary key.
+    """
+    archived = Table(table.name, _archive_metadata,
+                     *[db.Column(column.name, column.type,
+                                 primary_key=column.primary_key or (by_enrollment and column.name == 'enrollment_id'))
+                       for column in table.columns],
+                     db.Column('archived_at', db.DateTime), schema=SCHEMA)
+    for name, columns in indexes:
+        db.Index(name, *[archived.c[column] for column in columns])
+    return archived
+
+
+ARCHIVED_TABLES = {
+    'enrollment': _archive_table(Enrollment.__table__, ('ix_archive_enrollment_course', ['course_id']),
+                                 ('ix_archive_enrollment_user', ['user_id'])),
+    'payment': _archive_table(Payment.__table__, ('ix_archive_payment_enrollment_date',
+                                                  ['enrollment_id', 'payment_date'])),
+}
+HISTORY_VIEWS = ('enrollment', 'payment')
+
+# Rows that move with their enrollment
+ENROLLMENT_TABLES = [model.__table__ for model in (HifzProgress, HifzSnapshot, RevisionState, Attendance,
+                                                    StudentAttendance, Booking)]
+ARCHIVED_TABLES.update({table.name: _archive_table(table, by_enrollment=True) for table in ENROLLMENT_TABLES})
+
+# Rows that are of no use once their enrollment is archived
+DISCARDED_TABLES = [model.__table__ for model in (CheckoutIntent, RevisionQueue)]
+
+# Live plus archived rows - the same columns as the live table and an "archived" flag
+_history_metadata = MetaData()
+enrollment_history = Table('enrollment_history', _history_metadata,
+                           *[db.Column(column.name, column.type, primary_key=column.primary_key)
+                             for column in Enrollment.__table__.columns],
+                           db.Column('archived', db.Boolean))
+payment_history = Table('payment_history', _history_metadata,
+                        *[db.Column(column.name, column.type, primary_key=column.primary_key)
+                          for column in Payment.__table__.columns],
+                        db.Column('archived', db.Boolean))
+
+
+def _setup_connection(path, dialect):
+    """Return a connect listener that attaches the archive and creates its tables and views."""
+    statements = []
+    for table in ARCHIVED_TABLES.values():
+        statements.append(str(CreateTable(table, if_not_exists=True).compile(dialect=dialect)))
+        statements.extend(str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect))
+                          for index in table.indexes)
+
+    def attach(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f'ATTACH DATABASE ? AS {SCHEMA}', (path,))
+            for statement in statements:
+                cursor.execute(statement)
+            for name, table in ARCHIVED_TABLES.items():
+                # Columns added to the live table since the archive was created
+                existing = {row[1] for row in cursor.execute(f'PRAGMA {SCHEMA}.table_info({name})')}
+                for column in table.columns:
+                    if column.name not in existing:
+                        cursor.execute(f'ALTER TABLE {SCHEMA}.{name} ADD COLUMN {column.name} '
+                                       f'{column.type.compile(dialect=dialect)}')
+                if name not in HISTORY_VIEWS:
+                    continue
+                columns = ', '.join(column.name for column in table.columns if column.name != 'archived_at')
+                cursor.execute(f'CREATE TEMP VIEW IF NOT EXISTS {name}_history AS '
+                               f'SELECT {columns}, 0 AS archived FROM main.{name} UNION ALL '
+                               f'SELECT {columns}, 1 AS archived FROM {SCHEMA}.{name}')
+        finally:
+            cursor.close()
+    return attach
+
+
+def archive_path(app):
+    """Where the archive lives, or None when the main database is not a SQLite file."""
+    if app.config['ARCHIVE_DATABASE']:
+        return app.config['ARCHIVE_DATABASE']
+    with app.app_context():
+        url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    return f'{os.path.splitext(url.database)[0]}-archive.db'
+
+
+def init_app(app):
+    app.config.setdefault('ARCHIVE_DATABASE', None)        # default: <database>-archive.db
+    app.config.setdefault('ARCHIVE_COMPLETED_DAYS', 90)    # completed enrollments idle this long move out
+    app.config.setdefault('ARCHIVE_PAYMENT_DAYS', 730)     # payments older than this move out
+    app.config.setdefault('ARCHIVE_BATCH_SIZE', 500)       # rows per transaction
+
+    path = archive_path(app)
+    app.extensions['archive'] = path
+    if path is None:
+        return
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'connect', _setup_connection(path, engine.dialect))
+
+
+def enabled():
+    return current_app.extensions['archive'] is not None
+
+
+def enrollment_source(include_archived=False):
+    """Enrollment for day-to-day queries, or Enrollment over live and archived rows for history."""
+    if not include_archived or not enabled():
+        return Enrollment
+    return db.aliased(Enrollment, enrollment_history, adapt_on_names=True)
+
+
+def payment_source(include_archived=False):
+    if not include_archived or not enabled():
+        return Payment
+    return db.aliased(Payment, payment_history, adapt_on_names=True)
+
+
+def _move(name, ids, now):
+    """Copy rows into the archive and delete them from the live table, in the caller's transaction."""
+    live = db.metadata.tables[name]
+    archived = ARCHIVED_TABLES[name]
+    columns = [column.name for column in live.columns]
+    db.session.execute(archived.insert().prefix_with('OR REPLACE').from_select(
+        columns + ['archived_at'],
+        db.select(*[live.c[column] for column in columns], db.literal(now)).where(ids)
+    ))
+    return db.session.execute(db.delete(live).where(ids)).rowcount
+
+
+def _repair():
+    """Drop live rows a previous run archived but did not get to delete."""
+    repaired = 0
+    for name, archived in ARCHIVED_TABLES.items():
+        live = db.metadata.tables[name]
+        key = [column.name for column in archived.primary_key]
+        repaired += db.session.execute(db.delete(live).where(
+            db.tuple_(*[live.c[column] for column in key]).in_(db.select(*[archived.c[column] for column in key]))
+        )).rowcount
+    db.session.commit()
+    return repaired
+
+
+def _completed_batch(cutoff, now, size):
+    newest = db.select(db.func.max(Enrollment.id)).scalar_subquery()
+    upcoming = db.select(Booking.id).where(
+        Booking.enrollment_id == Enrollment.id, Booking.status == 'booked', Booking.starts_at >= now
+    ).exists()
+    recordings = db.select(Recording.id).where(Recording.enrollment_id == Enrollment.id).exists()
+    return [row[0] for row in db.session.query(Enrollment.id).filter(
+        Enrollment.status == 'completed',
+        db.func.coalesce(Enrollment.last_payment_date, Enrollment.enrollment_date) < cutoff,
+        Enrollment.id < newest,
+        ~upcoming,
+        ~recordings
+    ).order_by(Enrollment.id).limit(size)]
+
+
+def _payment_batch(cutoff, size):
+    newest = db.select(db.func.max(Payment.id)).scalar_subquery()
+    return [row[0] for row in db.session.query(Payment.id).filter(
+        Payment.payment_date < cutoff, Payment.id < newest
+    ).order_by(Payment.id).limit(size)]
+
+
+def run(now=None, dry_run=False):
+    """Move everything past the horizons into the archive. Call inside an app context. Returns stats."""
+    if not enabled():
+        raise RuntimeError('Archiving needs a SQLite file database')
+    config = current_app.config
+    now = now or datetime.utcnow()
+    size = config['ARCHIVE_BATCH_SIZE']
+    completed_cutoff = now - timedelta(days=config['ARCHIVE_COMPLETED_DAYS'])
+    payment_cutoff = now - timedelta(days=config['ARCHIVE_PAYMENT_DAYS'])
+    started = time.perf_counter()
+    stats = {'repaired': 0, 'enrollments': 0, 'payments': 0, 'history': 0, 'discarded': 0, 'batches': 0}
+
+    if dry_run:
+        stats['enrollments'] = len(_completed_batch(completed_cutoff, now, None))
+        stats['payments'] = len(_payment_batch(payment_cutoff, None))
+        stats['seconds'] = round(time.perf_counter() - started, 2)
+        return stats
+
+    stats['repaired'] = _repair()
+    while True:
+        ids = _completed_batch(completed_cutoff, now, size)
+        if not ids:
+            break
+        stats['payments'] += _move('payment', Payment.enrollment_id.in_(ids), now)
+        for table in ENROLLMENT_TABLES:
+            stats['history'] += _move(table.name, table.c.enrollment_id.in_(ids), now)
+        for table in DISCARDED_TABLES:
+            stats['discarded'] += db.session.execute(db.delete(table).where(table.c.enrollment_id.in_(ids))).rowcount
+        stats['enrollments'] += _move('enrollment', Enrollment.id.in_(ids), now)
+        db.session.commit()
+        stats['batches'] += 1
+    while True:
+        ids = _payment_batch(payment_cutoff, size)
+        if not ids:
+            break
+        stats['payments'] += _move('payment', Payment.id.in_(ids), now)
+        db.session.commit()
+        stats['batches'] += 1
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+def counts():
+    """{table name: (live rows, archived rows)} for every archived table."""
+    return {name: (db.session.query(db.func.count()).select_from(db.metadata.tables[name]).scalar(),
+                   db.session.query(db.func.count()).select_from(archived).scalar())
+            for name, archived in ARCHIVED_TABLES.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move old enrollments and payments into the archive database.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('run', help='Archive everything past the horizons')
+    command.add_argument('--dry-run', action='store_true', help='Only count what would move')
+    commands.add_parser('status', help='Live and archived row counts')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        if not enabled():
+            print('❌ Archiving needs a SQLite file database')
+            return 1
+        db.create_all()
+        if args.command == 'status':
+            print(f"✓ Archive: {current_app.extensions['archive']}")
+            for name, (live, archived) in counts().items():
+                print(f'  {name:<18} {live:>9} live {archived:>9} archived')
+            return 0
+        stats = run(dry_run=args.dry_run)
+    if args.dry_run:
+        print(f"✓ Would archive {stats['enrollments']} completed enrollments and "
+              f"{stats['payments']} old payments")
+        return 0
+    print(f"✓ Archived {stats['enrollments']} enrollments and {stats['payments']} payments in "
+          f"{stats['batches']} batches ({stats['repaired']} repaired), {stats['seconds']}s")
+    print(f"  {stats['history']} progress, attendance and booking rows moved with them, "
+          f"{stats['discarded']} checkout and revision queue rows deleted")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
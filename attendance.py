@@ -0,0 +1,159 @@
+"""
+Class attendance for Raindrops Academy
+Teachers mark a whole class for a session date in one form post. Each mark
+is an Attendance row per enrollment, and the monthly rollups
+(StudentAttendance per enrollment, CourseAttendance per course) are moved by
+the difference between the old and new mark in the same transaction, so
+attendance rates are a read of a few rollup rows rather than a count over
+every session ever marked.
+
+Present and late count as attended; excused sessions count for nothing, so
+they never lower a student's rate.
+"""
+
+from datetime import date, datetime
+
+from flask import Blueprint, flash, redirect, render_template, request, session, url_for
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from auth import login_required
+from entity_cache import get_course_or_404
+from models import db, Attendance, CourseAttendance, Enrollment, StudentAttendance, User
+from query_audit import query_budget
+
+# status -> (sessions, attended) it adds to the rollups
+WEIGHTS = {'present': (1, 1), 'late': (1, 1), 'absent': (1, 0), 'excused': (0, 0)}
+STATUSES = tuple(WEIGHTS)
+REPORT_MONTHS = 3  # attendance rates on reports cover this month and the two before
+
+attendance = Blueprint('attendance', __name__, url_prefix='/attendance')
+
+
+def period_of(day):
+    return day.strftime('%Y-%m')
+
+
+def first_period(months, today=None):
+    """YYYY-MM of the month months-1 before today's, so a range of months ends with this one."""
+    today = today or datetime.utcnow().date()
+    month = today.year * 12 + today.month - 1 - (months - 1)
+    return f'{month // 12:04d}-{month % 12 + 1:02d}'
+
+
+def _bump(model, keys, rows):
+    """Add (sessions, attended) deltas to rollup rows, creating them as needed - one statement."""
+    if not rows:
+        return
+    stmt = sqlite_insert(model)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=keys, set_={
+        'sessions': model.sessions + stmt.excluded.sessions,
+        'attended': model.attended + stmt.excluded.attended
+    }), rows)
+
+
+def mark_class(course_id, session_date, marks, marked_by):
+    """Record {enrollment_id: status} for one session and update the rollups. Caller commits.
+
+    Returns how many marks changed.
+    """
+    if not marks:
+        return 0
+    previous = dict(db.session.query(Attendance.enrollment_id, Attendance.status).filter(
+        Attendance.enrollment_id.in_(list(marks)), Attendance.session_date == session_date
+    ).all())
+    changed = {enrollment_id: status for enrollment_id, status in marks.items()
+               if previous.get(enrollment_id) != status}
+    if not changed:
+        return 0
+
+    now = datetime.utcnow()
+    stmt = sqlite_insert(Attendance)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['enrollment_id', 'session_date'], set_={
+        'status': stmt.excluded.status, 'marked_by': stmt.excluded.marked_by, 'marked_at': stmt.excluded.marked_at
+    }), [{'enrollment_id': enrollment_id, 'course_id': course_id, 'session_date': session_date,
+          'status': status, 'marked_by': marked_by, 'marked_at': now}
+         for enrollment_id, status in changed.items()])
+
+    period = period_of(session_date)
+    deltas = []
+    for enrollment_id, status in changed.items():
+        old_sessions, old_attended = WEIGHTS.get(previous.get(enrollment_id), (0, 0))
+        new_sessions, new_attended = WEIGHTS[status]
+        if (new_sessions, new_attended) != (old_sessions, old_attended):
+            deltas.append({'enrollment_id': enrollment_id, 'period': period, 'course_id': course_id,
+                           'sessions': new_sessions - old_sessions, 'attended': new_attended - old_attended})
+    _bump(StudentAttendance, ['enrollment_id', 'period'], deltas)
+    if deltas:
+        _bump(CourseAttendance, ['course_id', 'period'], [{
+            'course_id': course_id, 'period': period,
+            'sessions': sum(delta['sessions'] for delta in deltas),
+            'attended': sum(delta['attended'] for delta in deltas)
+        }])
+    return len(changed)
+
+
+def attendance_rates(course_ids, months=REPORT_MONTHS):
+    """({enrollment_id: (attended, sessions)}, {course_id: (attended, sessions)}) over recent months."""
+    course_ids = list(course_ids)
+    if not course_ids:
+        return {}, {}
+    since = first_period(months)
+    students = {enrollment_id: (attended, sessions) for enrollment_id, attended, sessions in db.session.query(
+        StudentAttendance.enrollment_id, db.func.sum(StudentAttendance.attended),
+        db.func.sum(StudentAttendance.sessions)
+    ).filter(
+        StudentAttendance.course_id.in_(course_ids), StudentAttendance.period >= since
+    ).group_by(StudentAttendance.enrollment_id)}
+    courses = {course_id: (attended, sessions) for course_id, attended, sessions in db.session.query(
+        CourseAttendance.course_id, db.func.sum(CourseAttendance.attended), db.func.sum(CourseAttendance.sessions)
+    ).filter(
+        CourseAttendance.course_id.in_(course_ids), CourseAttendance.period >= since
+    ).group_by(CourseAttendance.course_id)}
+    return students, courses
+
+
+@attendance.route('/course/<int:course_id>', methods=['GET', 'POST'])
+@login_required
+@query_budget(6)
+def take(course_id):
+    course = get_course_or_404(course_id)
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or (user.is_teacher and course.teacher_id == user.id)):
+        flash('Unauthorized access!', 'danger')
+        return redirect(url_for('main.dashboard'))
+
+    try:
+        session_date = date.fromisoformat(request.values.get('date') or datetime.utcnow().date().isoformat())
+    except ValueError:
+        flash('Please choose a valid date.', 'danger')
+        return redirect(url_for('attendance.take', course_id=course.id))
+    if session_date > datetime.utcnow().date():
+        flash('Attendance cannot be marked for a future date.', 'danger')
+        return redirect(url_for('attendance.take', course_id=course.id))
+
+    roster = db.session.query(Enrollment, User).join(
+        User, Enrollment.user_id == User.id
+    ).filter(
+        Enrollment.course_id == course.id, Enrollment.status == 'active'
+    ).order_by(User.full_name).all()
+
+    if request.method == 'POST':
+        everyone = request.form.get('mark_all')
+        marks = {}
+        for enrollment, _ in roster:
+            status = everyone or request.form.get(f'status-{enrollment.id}')
+            if status in WEIGHTS:
+                marks[enrollment.id] = status
+        changed = mark_class(course.id, session_date, marks, user.id)
+        db.session.commit()
+        flash(f'Attendance for {session_date.strftime("%b %d, %Y")} saved ({changed} updated).', 'success')
+        return redirect(url_for('attendance.take', course_id=course.id, date=session_date.isoformat()))
+
+    ids = [enrollment.id for enrollment, _ in roster]
+    marked = dict(db.session.query(Attendance.enrollment_id, Attendance.status).filter(
+        Attendance.enrollment_id.in_(ids), Attendance.session_date == session_date
+    ).all()) if ids else {}
+    student_rates, course_rates = attendance_rates([course.id])
+    return render_template('attendance.html', course=course, roster=roster, session_date=session_date,
+                           marked=marked, statuses=STATUSES, student_rates=student_rates,
+                           course_rate=course_rates.get(course.id), months=REPORT_MONTHS)
@@ -0,0 +1,53 @@
+"""
+Login and role checks for view functions
+"""
+
+from functools import wraps
+from urllib.parse import urlsplit
+
+from flask import flash, redirect, request, session, url_for
+
+from models import User
+
+def safe_next(default):
+    """The form's 'next' URL when it is a path on this site, otherwise default."""
+    target = request.form.get('next') or ''
+    parts = urlsplit(target)
+    if target.startswith('/') and not target.startswith('//') and '\\' not in target \
+            and not parts.scheme and not parts.netloc:
+        return target
+    return default
+
+# Login decorator
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Please log in to access this page.', 'warning')
+            return redirect(url_for('main.login'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user = None
+        if 'user_id' in session:
+            user = User.query.get(session['user_id'])
+        if not user or not user.is_admin:
+            flash('Administrative access required.', 'danger')
+            return redirect(url_for('main.dashboard'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def teacher_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user = None
+        if 'user_id' in session:
+            user = User.query.get(session['user_id'])
+        if not user or not user.is_teacher:
+            flash('Teacher access required.', 'danger')
+            return redirect(url_for('main.dashboard'))
+        return f(*args, **kwargs)
+    return decorated_function
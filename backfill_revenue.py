@@ -0,0 +1,66 @@
+"""
+Rebuild the revenue ledger and its rollups from Payment history
+Run this once after upgrading, or whenever the rollups need to be recomputed
+Archived payments and enrollments (see archive.py) are included
+"""
+
+import archive
+from app import create_app
+from models import db, Course, LedgerEntry, CourseRevenue, TeacherRevenue, MonthlyRevenue
+
+def rebuild_revenue(app=None):
+    app = app or create_app()
+    with app.app_context():
+        # Ledger and rollups are derived data - clear and rebuild them in one transaction
+        for model in (MonthlyRevenue, TeacherRevenue, CourseRevenue, LedgerEntry):
+            db.session.execute(db.delete(model))
+        
+        # Live and archived rows, so archiving never takes revenue out of the totals
+        payments, enrollments = archive.payment_source(True), archive.enrollment_source(True)
+        ledger_rows = db.select(
+            payments.id,
+            payments.enrollment_id,
+            Course.id,
+            Course.teacher_id,
+            payments.amount,
+            db.func.strftime('%Y-%m', payments.payment_date),
+            payments.payment_date,
+            db.func.current_timestamp()
+        ).join(
+            enrollments, payments.enrollment_id == enrollments.id
+        ).join(
+            Course, enrollments.course_id == Course.id
+        ).where(
+            payments.status == 'completed',
+            payments.payment_date.isnot(None)
+        )
+        db.session.execute(db.insert(LedgerEntry).from_select(
+            ['payment_id', 'enrollment_id', 'course_id', 'teacher_id', 'amount',
+             'period', 'payment_date', 'recorded_at'],
+            ledger_rows
+        ))
+        
+        rollup_columns = ['total_amount', 'payment_count', 'last_payment_date']
+        for model, key in ((CourseRevenue, LedgerEntry.course_id),
+                           (TeacherRevenue, LedgerEntry.teacher_id),
+                           (MonthlyRevenue, LedgerEntry.period)):
+            rollup_rows = db.select(
+                key,
+                db.func.sum(LedgerEntry.amount),
+                db.func.count(LedgerEntry.id),
+                db.func.max(LedgerEntry.payment_date)
+            ).where(key.isnot(None)).group_by(key)
+            db.session.execute(db.insert(model).from_select(
+                [model.__mapper__.primary_key[0].key] + rollup_columns,
+                rollup_rows
+            ))
+        
+        db.session.commit()
+        
+        entries = LedgerEntry.query.count()
+        total = db.session.query(db.func.coalesce(db.func.sum(LedgerEntry.amount), 0)).scalar()
+        print(f"✓ Rebuilt revenue ledger: {entries} payments, ${total:.2f} total")
+        print("\n✅ Revenue rollups rebuilt!")
+
+if __name__ == '__main__':
+    rebuild_revenue()
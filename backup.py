@@ -0,0 +1,334 @@
+"""
+Online backups for the academy database
+Copies the live SQLite database with the online backup API a few pages at a
+time, sleeping between steps so enrollments and payments keep committing
+while a snapshot is taken. Every snapshot is integrity-checked before it is
+kept, and old snapshots are rotated away. The archive database (see
+archive.py) is copied into the same snapshot as <name>-<stamp>.archive.db,
+right after the main file: a move that lands in between leaves rows in both
+copies, which the next archive.py run repairs, never in neither.
+
+    python backup.py create                  # one snapshot into backups/
+    python backup.py run --every 3600        # snapshot every hour, keep the newest --keep
+    python backup.py list
+    python backup.py verify backups/quran_academy-20260101T000000Z.db
+    python backup.py restore --latest --yes  # stop the app first
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+PAGES_PER_STEP = 256      # pages copied per backup step
+STEP_SLEEP_SECONDS = 0.05  # pause between steps so writers get the database
+MAX_RESTARTS = 5          # writes restart a stepped backup - after this many, copy in one step
+DEFAULT_KEEP = 14
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def database_paths():
+    """Absolute paths of the database the app is configured to use and of its archive (None if disabled)."""
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        raise BackupError(f'Only file-based SQLite databases can be backed up (got {url})')
+    return url.database, app.extensions.get('archive')
+
+
+def archive_snapshot(path):
+    """The archive copy that belongs to a snapshot."""
+    return f'{os.path.splitext(path)[0]}.archive.db'
+
+
+def enable_wal(path):
+    """Switch the database to WAL so readers (including backups) never block writers. Persistent."""
+    with sqlite3.connect(path) as conn:
+        mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    return mode
+
+
+def integrity_check(path):
+    """Return 'ok' or the problems PRAGMA integrity_check reports."""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute('PRAGMA integrity_check').fetchall()
+    finally:
+        conn.close()
+    return '; '.join(row[0] for row in rows)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _copy(source_path, target_path, pages, sleep):
+    """Stepped online backup. Returns (steps, restarts)."""
+    source = sqlite3.connect(source_path)
+    state = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+    def progress(status, remaining, total):
+        state['steps'] += 1
+        # Remaining pages going back up means another connection wrote and SQLite restarted the copy
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > MAX_RESTARTS:
+                raise _Restarted()
+        state['remaining'] = remaining
+
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            try:
+                source.backup(target, pages=pages, progress=progress, sleep=sleep)
+            except _Restarted:
+                # Under constant writes, finish with one step - a single read snapshot that,
+                # in WAL mode, still leaves writers alone
+                source.backup(target, pages=-1)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return state['steps'], state['restarts']
+
+
+def snapshots(directory):
+    """Snapshot paths, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, '*-????????T??????Z.db')))
+
+
+def _snapshot_file(source, final_path, pages, sleep):
+    """Copy one database file into a checked snapshot at final_path. Returns (steps, restarts)."""
+    partial_path = final_path + '.partial'
+    try:
+        steps, restarts = _copy(source, partial_path, pages, sleep)
+        result = integrity_check(partial_path)
+        if result != 'ok':
+            raise BackupError(f'Snapshot failed its integrity check: {result}')
+        # Snapshots are self-contained rollback-journal files, not WAL
+        with sqlite3.connect(partial_path) as conn:
+            conn.execute('PRAGMA journal_mode=DELETE')
+        os.replace(partial_path, final_path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return steps, restarts
+
+
+def create_snapshot(directory=DEFAULT_DIR, pages=PAGES_PER_STEP, sleep=STEP_SLEEP_SECONDS, source=None, suffix='',
+                    archive=None):
+    if source is None:
+        source, archive = database_paths()
+    if not os.path.exists(source):
+        raise BackupError(f'{source} does not exist')
+    if enable_wal(source) != 'wal':
+        print('  Could not switch the database to WAL - writers may wait on backup steps')
+
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    name = os.path.splitext(os.path.basename(source))[0]
+    final_path = os.path.join(directory, f'{name}-{stamp}{suffix}.db')
+
+    started = time.perf_counter()
+    steps, restarts = _snapshot_file(source, final_path, pages, sleep)
+    manifest = {
+        'source': source,
+        'created_at': stamp,
+        'bytes': os.path.getsize(final_path),
+        'sha256': _sha256(final_path),
+        'steps': steps,
+        'restarts': restarts
+    }
+    # Always after the main file - see the module docstring
+    if archive and os.path.exists(archive):
+        archive_path = archive_snapshot(final_path)
+        try:
+            _snapshot_file(archive, archive_path, pages, sleep)
+        except BaseException:
+            os.remove(final_path)
+            raise
+        manifest['archive'] = {'source': archive, 'bytes': os.path.getsize(archive_path),
+                               'sha256': _sha256(archive_path)}
+    manifest['seconds'] = round(time.perf_counter() - started, 3)
+    with open(final_path + '.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return final_path, manifest
+
+
+def rotate(directory=DEFAULT_DIR, keep=DEFAULT_KEEP):
+    """Delete all but the newest `keep` snapshots. Returns the removed paths."""
+    removed = []
+    existing = snapshots(directory)
+    for path in existing[:max(0, len(existing) - keep)]:
+        for leftover in (path, path + '.json', archive_snapshot(path)):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        removed.append(path)
+    return removed
+
+
+def verify_snapshot(path):
+    """Integrity check plus, when a manifest exists, a checksum comparison - for the archive copy too."""
+    result = integrity_check(path)
+    if result != 'ok':
+        return False, f'integrity_check: {result}'
+    manifest = {}
+    if os.path.exists(path + '.json'):
+        with open(path + '.json') as f:
+            manifest = json.load(f)
+        if manifest.get('sha256') and manifest['sha256'] != _sha256(path):
+            return False, 'checksum does not match the manifest'
+    archive_path = archive_snapshot(path)
+    if 'archive' in manifest and not os.path.exists(archive_path):
+        return False, f'{archive_path} is missing'
+    if os.path.exists(archive_path):
+        result = integrity_check(archive_path)
+        if result != 'ok':
+            return False, f'archive integrity_check: {result}'
+        if manifest.get('archive', {}).get('sha256') not in (None, _sha256(archive_path)):
+            return False, 'archive checksum does not match the manifest'
+    return True, 'ok'
+
+
+def _restore_file(path, target):
+    source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        destination = sqlite3.connect(target)
+        try:
+            # One step - other connections see either the old database or the restored one
+            source.backup(destination, pages=-1)
+        finally:
+            destination.close()
+    finally:
+        source.close()
+
+
+def restore_snapshot(path, target=None, directory=DEFAULT_DIR, archive=None):
+    """Replace the live database, and its archive, with a verified snapshot, keeping a copy of what it replaced.
+
+    A snapshot taken before archiving existed leaves the archive alone: rows it
+    holds that are also in the restored database are dropped from the live
+    tables by the next archive.py run.
+    """
+    ok, detail = verify_snapshot(path)
+    if not ok:
+        raise BackupError(f'{path} failed verification: {detail}')
+    if target is None:
+        target, archive = database_paths()
+
+    # Kept outside rotation and --latest, so a second restore cannot pick it up by accident
+    safety = None
+    if os.path.exists(target):
+        safety, _ = create_snapshot(directory, source=target, suffix='.pre-restore', archive=archive)
+
+    _restore_file(path, target)
+    if archive and os.path.exists(archive_snapshot(path)):
+        _restore_file(archive_snapshot(path), archive)
+    return safety
+
+
+def _print_snapshot(path, manifest):
+    print(f"✓ Snapshot {path} ({manifest['bytes'] / 1024:.0f} KB, {manifest['steps']} steps, "
+          f"{manifest['restarts']} restarts, {manifest['seconds']}s)")
+    if 'archive' in manifest:
+        print(f"  with archive {archive_snapshot(path)} ({manifest['archive']['bytes'] / 1024:.0f} KB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Online backups for the academy database.')
+    parser.add_argument('--dir', default=DEFAULT_DIR, help='Snapshot directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('create', 'run'):
+        command = commands.add_parser(name)
+        command.add_argument('--pages', type=int, default=PAGES_PER_STEP, help='Pages copied per step')
+        command.add_argument('--sleep', type=float, default=STEP_SLEEP_SECONDS, help='Seconds between steps')
+        command.add_argument('--keep', type=int, default=DEFAULT_KEEP, help='Snapshots to keep after rotation')
+    commands.choices['run'].add_argument('--every', type=int, default=3600, help='Seconds between snapshots')
+
+    commands.add_parser('list')
+    verify = commands.add_parser('verify')
+    verify.add_argument('snapshot')
+    restore = commands.add_parser('restore')
+    restore.add_argument('snapshot', nargs='?')
+    restore.add_argument('--latest', action='store_true', help='Restore the newest snapshot')
+    restore.add_argument('--yes', action='store_true', help='Do not ask for confirmation')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'create':
+            path, manifest = create_snapshot(args.dir, args.pages, args.sleep)
+            _print_snapshot(path, manifest)
+            for removed in rotate(args.dir, args.keep):
+                print(f'  Rotated out {removed}')
+
+        elif args.command == 'run':
+            print(f'Taking a snapshot every {args.every}s into {args.dir} (Ctrl+C to stop)')
+            while True:
+                started = time.monotonic()
+                try:
+                    path, manifest = create_snapshot(args.dir, args.pages, args.sleep)
+                    _print_snapshot(path, manifest)
+                    for removed in rotate(args.dir, args.keep):
+                        print(f'  Rotated out {removed}')
+                except (BackupError, sqlite3.Error) as e:
+                    print(f'❌ Snapshot failed: {e}')
+                time.sleep(max(0, args.every - (time.monotonic() - started)))
+
+        elif args.command == 'list':
+            for path in snapshots(args.dir):
+                print(f'{path}  {os.path.getsize(path) / 1024:.0f} KB')
+
+        elif args.command == 'verify':
+            ok, detail = verify_snapshot(args.snapshot)
+            print(f"{'✅' if ok else '❌'} {args.snapshot}: {detail}")
+            return 0 if ok else 1
+
+        elif args.command == 'restore':
+            path = args.snapshot
+            if args.latest:
+                existing = snapshots(args.dir)
+                path = existing[-1] if existing else None
+            if not path:
+                parser.error('give a snapshot path or --latest')
+            if not args.yes:
+                answer = input(f'Replace the live database with {path}? Stop the app first. [y/N] ')
+                if answer.strip().lower() != 'y':
+                    print('Restore cancelled')
+                    return 1
+            safety = restore_snapshot(path, directory=args.dir)
+            print(f'✅ Restored {path}')
+            if safety:
+                print(f'  The previous database was saved as {safety}')
+    except KeyboardInterrupt:
+        return 130
+    except (BackupError, sqlite3.Error) as e:
+        print(f'❌ {e}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
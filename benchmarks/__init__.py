@@ -0,0 +1,18 @@
+"""
+Benchmark suite for Raindrops Academy
+
+    python -m benchmarks.dataset --database benchmarks/academy_bench.db
+    python -m benchmarks.load --database benchmarks/academy_bench.db
+
+Both commands point the app at the given database through DATABASE_URL,
+which create_app() reads when the app is built.
+"""
+
+import os
+
+
+def use_database(path):
+    """Point create_app() at a benchmark database."""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(path)
+    # Every request is "slow" at benchmark scale - keep the log quiet
+    os.environ.setdefault('METRICS_SLOW_REQUEST_MS', '600000')
@@ -0,0 +1,146 @@
+"""
+Synthetic academy dataset for benchmarks
+Bulk-generates teachers, courses, students, enrollments and monthly payment
+history with executemany inserts. The same --seed always gives the same data.
+
+    python -m benchmarks.dataset --database benchmarks/academy_bench.db --students 50000
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import use_database
+
+CHUNK_SIZE = 5000
+COURSE_NAMES = ['Learning Quran', 'Memorizing Quran', 'Tajweed Mastery', 'Islamic Studies',
+                'Arabic Grammar', 'Seerah', 'Fiqh Essentials', 'Hadith Studies']
+FEES = [120.0, 150.0, 180.0, 200.0]
+BENCH_PASSWORD = 'Bench@1234'
+
+
+def _bulk_insert(db, model, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(db.insert(model), rows[start:start + CHUNK_SIZE])
+
+
+def generate(students=50000, courses=500, teachers=200, months=12, seed=42):
+    from werkzeug.security import generate_password_hash
+    from app import create_app
+    from models import db, User, Course, Enrollment, Payment
+    from backfill_revenue import rebuild_revenue
+
+    app = create_app()
+
+    rng = random.Random(seed)
+    # Anchor to midnight so reruns on the same day produce identical rows
+    now = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    # One hash shared by every synthetic account - hashing is not what we benchmark
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    timings = {}
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('PRAGMA synchronous=OFF')
+
+        started = time.perf_counter()
+        users = [{
+            'id': 1, 'username': 'admin', 'email': 'admin@bench.local', 'password_hash': password_hash,
+            'full_name': 'Bench Admin', 'is_admin': True, 'is_teacher': False, 'created_at': now
+        }]
+        teacher_ids = list(range(2, teachers + 2))
+        for teacher_id in teacher_ids:
+            users.append({
+                'id': teacher_id, 'username': f'teacher{teacher_id}', 'email': f'teacher{teacher_id}@bench.local',
+                'password_hash': password_hash, 'full_name': f'Teacher {teacher_id}', 'phone': '+1 555 0100',
+                'is_admin': False, 'is_teacher': True, 'created_at': now - timedelta(days=rng.randint(30, 900)),
+                'bio': 'Synthetic teacher profile', 'experience_years': rng.randint(1, 25)
+            })
+        student_ids = list(range(teachers + 2, teachers + 2 + students))
+        for student_id in student_ids:
+            users.append({
+                'id': student_id, 'username': f'student{student_id}', 'email': f'student{student_id}@bench.local',
+                'password_hash': password_hash, 'full_name': f'Student {student_id}', 'phone': '+1 555 0199',
+                'is_admin': False, 'is_teacher': False, 'created_at': now - timedelta(days=rng.randint(0, months * 30))
+            })
+        _bulk_insert(db, User, users)
+
+        course_rows = []
+        for course_id in range(1, courses + 1):
+            course_rows.append({
+                'id': course_id, 'name': f'{rng.choice(COURSE_NAMES)} {course_id}',
+                'description': 'Synthetic benchmark course', 'duration': f'{rng.randint(3, 24)} months',
+                'tuition_fee': rng.choice(FEES), 'icon': '/static/images/logo.png',
+                'features': 'One-on-one sessions|Flexible scheduling|Progress tracking',
+                'teacher_id': rng.choice(teacher_ids), 'created_at': now - timedelta(days=months * 31)
+            })
+        _bulk_insert(db, Course, course_rows)
+        fees = {row['id']: row['tuition_fee'] for row in course_rows}
+
+        enrollments = []
+        payments = []
+        enrollment_id = 0
+        payment_id = 0
+        for student_id in student_ids:
+            for course_id in rng.sample(range(1, courses + 1), rng.randint(1, 3)):
+                enrollment_id += 1
+                enrolled = now - timedelta(days=rng.randint(0, months * 30))
+                roll = rng.random()
+                status = 'pending' if roll < 0.1 else ('completed' if roll > 0.9 else 'active')
+                last_payment = None
+                if status != 'pending':
+                    paid = enrolled
+                    while paid <= now:
+                        # Most students pay on time, some drift and fall overdue
+                        if rng.random() < 0.05:
+                            break
+                        payment_id += 1
+                        payments.append({
+                            'id': payment_id, 'enrollment_id': enrollment_id, 'amount': fees[course_id],
+                            'payment_date': paid, 'payment_method': rng.choice(['stripe', 'demo']),
+                            'transaction_id': f'BENCH{payment_id}', 'status': 'completed'
+                        })
+                        last_payment = paid
+                        paid += timedelta(days=30)
+                enrollments.append({
+                    'id': enrollment_id, 'user_id': student_id, 'course_id': course_id,
+                    'enrollment_date': enrolled, 'status': status,
+                    'payment_status': 'paid' if last_payment else 'unpaid',
+                    'last_payment_date': last_payment,
+                    'next_payment_due': (last_payment + timedelta(days=30)) if last_payment else enrolled + timedelta(days=7)
+                })
+        _bulk_insert(db, Enrollment, enrollments)
+        _bulk_insert(db, Payment, payments)
+        db.session.commit()
+        timings['insert'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rebuild_revenue(app)
+    timings['revenue_rollups'] = time.perf_counter() - started
+
+    print(f"✓ Generated {len(teacher_ids)} teachers, {len(student_ids)} students, {courses} courses, "
+          f"{len(enrollments)} enrollments, {len(payments)} payments")
+    print(f"  inserts {timings['insert']:.1f}s, revenue rollups {timings['revenue_rollups']:.1f}s")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic academy dataset for benchmarks.')
+    parser.add_argument('--database', default=os.path.join('benchmarks', 'academy_bench.db'))
+    parser.add_argument('--students', type=int, default=50000)
+    parser.add_argument('--courses', type=int, default=500)
+    parser.add_argument('--teachers', type=int, default=200)
+    parser.add_argument('--months', type=int, default=12, help='Months of payment history')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    use_database(args.database)
+    generate(args.students, args.courses, args.teachers, args.months, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Hifz bitset microbenchmark
+Times class-wide aggregates (per-juz averages and completions, ayahs added
+this week) over progress bitsets against the same numbers computed from
+one row per memorized ayah, and checks that both agree.
+
+    python -m benchmarks.hifz --students 200
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from hifz import JUZ_SIZES, ayah_mask, class_summary, span_mask, to_blob
+from quran_meta import SURAH_AYAHS, TOTAL_AYAHS
+
+
+def synthetic_progress(students, seed):
+    """Students memorizing from An-Naas backwards, as most Hifz classes do, plus scattered surahs."""
+    rng = random.Random(seed)
+    progress = []
+    for _ in range(students):
+        done = rng.randint(0, TOTAL_AYAHS // 2)
+        bits = span_mask(TOTAL_AYAHS - done, TOTAL_AYAHS)
+        for surah in rng.sample(range(1, 115), 3):
+            bits |= ayah_mask(surah, 1, rng.randint(1, SURAH_AYAHS[surah - 1]))
+        # Last week's state: the same, minus a few new ayahs
+        baseline = bits & ~span_mask(TOTAL_AYAHS - done, TOTAL_AYAHS - done + rng.randint(0, 20))
+        progress.append((bits, baseline))
+    return progress
+
+
+def row_summary(rows):
+    """The same aggregates from (student, ayah, memorized_this_week) rows."""
+    juz_of = []
+    for juz, size in enumerate(JUZ_SIZES):
+        juz_of.extend([juz] * size)
+    juz_counts = {}
+    added = 0
+    for student, ayah, new in rows:
+        key = (student, juz_of[ayah])
+        juz_counts[key] = juz_counts.get(key, 0) + 1
+        added += new
+    complete = [0] * len(JUZ_SIZES)
+    memorized = [0] * len(JUZ_SIZES)
+    for (_, juz), count in juz_counts.items():
+        memorized[juz] += count
+        complete[juz] += count == JUZ_SIZES[juz]
+    return added, complete, memorized
+
+
+def best_of(runs, func):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Hifz bitset aggregates against per-ayah rows.')
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    progress = synthetic_progress(args.students, args.seed)
+    rows = [(student, ayah, not (baseline >> ayah) & 1)
+            for student, (bits, baseline) in enumerate(progress)
+            for ayah in range(TOTAL_AYAHS) if (bits >> ayah) & 1]
+
+    bitset, summary = best_of(args.runs, lambda: class_summary(progress))
+    per_row, (added, complete, memorized) = best_of(args.runs, lambda: row_summary(rows))
+
+    if (summary['added_this_week'] != added or [juz['complete'] for juz in summary['juz']] != complete
+            or summary['memorized'] != sum(memorized)):
+        print('❌ Bitset and per-row aggregates differ')
+        return 1
+
+    print(f'{args.students} students, {len(rows)} memorized ayahs, best of {args.runs}')
+    print(f'  storage              {args.students * len(to_blob(0)) / 1024:8.1f} KB of bitsets vs {len(rows)} rows')
+    print(f'  bitset class_summary {bitset * 1000:8.1f}ms')
+    print(f'  per-ayah rows        {per_row * 1000:8.1f}ms')
+    print(f"  class average {summary['average_percent']:.1f}%, {summary['added_this_week']} ayahs this week, "
+          f"juz 30 completed by {summary['juz'][-1]['complete']}")
+    print('✅ Bitset and per-row aggregates agree')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Import-time budget check
+Imports each entry point in a fresh interpreter with -X importtime and fails
+if it is over budget or pulls in a module that should only load on first use.
+
+    python -m benchmarks.import_time
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time budgets in milliseconds
+BUDGETS_MS = {
+    'models': 600,
+    'app': 650
+}
+
+# Modules that must stay out of the import path until first use
+LAZY_MODULES = ('stripe', 'smtplib', 'email.mime.multipart', 'dotenv', 'multiprocessing')
+
+
+def measure(module):
+    """Return ({module name: cumulative microseconds}, total ms) for a fresh import."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr}')
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, _, timings = line.partition(':')
+        _, total, name = timings.split('|')
+        cumulative[name.strip()] = int(total)
+    return cumulative, cumulative.get(module, 0) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check import time of app entry points.')
+    parser.add_argument('--runs', type=int, default=5, help='Take the fastest of this many imports')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply budgets, e.g. on slow CI machines')
+    args = parser.parse_args()
+
+    failures = []
+    for module, budget in BUDGETS_MS.items():
+        runs = [measure(module) for _ in range(args.runs)]
+        loaded, best = min(runs, key=lambda run: run[1])
+        limit = budget * args.scale
+        eager = [name for name in LAZY_MODULES if name in loaded]
+        status = '✓' if best <= limit and not eager else '✗'
+        print(f"{status} import {module:<8} {best:7.1f}ms (budget {limit:.0f}ms)")
+        if best > limit:
+            failures.append(f'{module} took {best:.1f}ms, budget is {limit:.0f}ms')
+        if eager:
+            failures.append(f"{module} imports {', '.join(eager)} at startup")
+
+    if failures:
+        print('\n❌ Import-time budget exceeded:')
+        for failure in failures:
+            print(f'  - {failure}')
+        return 1
+    print('\n✅ Import time within budget')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Route latency benchmark
+Drives every GET route through the Flask test client (or real HTTP with
+--mode http and --concurrency N) and reports p50/p95/p99 latency and SQL
+queries per request, compared with a stored baseline.
+
+    python -m benchmarks.load --database benchmarks/academy_bench.db --save-baseline
+    python -m benchmarks.load --database benchmarks/academy_bench.db   # exits 1 on regression
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import use_database
+
+SKIP_ENDPOINTS = {'static', 'metrics', 'main.logout'}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _pick_fixtures(app, db, User, Course, Enrollment):
+    """Representative ids for URL arguments and logged-in sessions."""
+    with app.app_context():
+        admin = User.query.filter_by(is_admin=True).first()
+        # The busiest teacher and student give the worst-case dashboards
+        teacher_id = db.session.query(Course.teacher_id).join(
+            Enrollment, Enrollment.course_id == Course.id
+        ).filter(Course.teacher_id.isnot(None)).group_by(Course.teacher_id).order_by(
+            db.func.count(Enrollment.id).desc()
+        ).limit(1).scalar()
+        student_id = db.session.query(Enrollment.user_id).group_by(Enrollment.user_id).order_by(
+            db.func.count(Enrollment.id).desc()
+        ).limit(1).scalar()
+        enrollment = Enrollment.query.filter_by(user_id=student_id, payment_status='unpaid').first() \
+            or Enrollment.query.filter_by(user_id=student_id).first()
+        course_id = db.session.query(Course.id).filter_by(teacher_id=teacher_id).limit(1).scalar()
+        return {
+            'sessions': {'admin': admin.id, 'teacher': teacher_id, 'student': student_id},
+            'args': {'course_id': course_id, 'teacher_id': teacher_id,
+                     'enrollment_id': enrollment.id if enrollment else None}
+        }
+
+
+def discover_routes(app, fixtures):
+    routes = []
+    with app.test_request_context():
+        for rule in app.url_map.iter_rules():
+            if rule.endpoint in SKIP_ENDPOINTS or 'GET' not in rule.methods:
+                continue
+            values = {arg: fixtures['args'].get(arg) for arg in rule.arguments}
+            if any(value is None for value in values.values()):
+                continue
+            if rule.rule.startswith('/admin'):
+                role = 'admin'
+            elif rule.rule.startswith('/teacher/'):
+                role = 'teacher'
+            else:
+                role = 'student'
+            path = app.url_for(rule.endpoint, **values)
+            routes.append((rule.endpoint, path, role))
+    return sorted(routes)
+
+
+def _session_cookie(app, user_id):
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({'user_id': user_id})
+
+
+def run_client(app, routes, fixtures, iterations, warmup):
+    clients = {}
+    for role, user_id in fixtures['sessions'].items():
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        clients[role] = client
+
+    samples = {}
+    statuses = {}
+    for endpoint, path, role in routes:
+        client = clients[role]
+        for _ in range(warmup):
+            client.get(path)
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            response = client.get(path)
+            response.get_data()
+            timings.append(time.perf_counter() - started)
+            statuses[endpoint] = response.status_code
+        samples[endpoint] = timings
+    return samples, statuses
+
+
+def run_http(app, routes, fixtures, iterations, warmup, concurrency):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_port
+    cookies = {role: _session_cookie(app, user_id) for role, user_id in fixtures['sessions'].items()}
+    cookie_name = app.config.get('SESSION_COOKIE_NAME', 'session')
+
+    def fetch(path, role):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        try:
+            started = time.perf_counter()
+            conn.request('GET', path, headers={'Cookie': f'{cookie_name}={cookies[role]}'})
+            response = conn.getresponse()
+            response.read()
+            return time.perf_counter() - started, response.status
+        finally:
+            conn.close()
+
+    samples = {}
+    statuses = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for endpoint, path, role in routes:
+                list(pool.map(lambda _: fetch(path, role), range(warmup)))
+                results = list(pool.map(lambda _: fetch(path, role), range(iterations)))
+                samples[endpoint] = [elapsed for elapsed, _ in results]
+                statuses[endpoint] = results[-1][1]
+    finally:
+        server.shutdown()
+    return samples, statuses
+
+
+def summarize(samples, statuses, snapshot):
+    results = {}
+    for endpoint, timings in samples.items():
+        stats = snapshot.get(endpoint, {})
+        requests = stats.get('requests') or 1
+        results[endpoint] = {
+            'status': statuses.get(endpoint),
+            'p50_ms': round(percentile(timings, 50) * 1000, 2),
+            'p95_ms': round(percentile(timings, 95) * 1000, 2),
+            'p99_ms': round(percentile(timings, 99) * 1000, 2),
+            'queries': round(stats.get('sql_count', 0) / requests, 1)
+        }
+    return results
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    regressions = []
+    for endpoint, current in results.items():
+        previous = baseline.get(endpoint)
+        if not previous:
+            continue
+        if current['queries'] > previous['queries']:
+            regressions.append(f"{endpoint}: queries {previous['queries']} -> {current['queries']}")
+        # Fast routes are dominated by scheduler noise - require an absolute slowdown too
+        limit = max(previous['p95_ms'] * threshold, previous['p95_ms'] + min_delta_ms)
+        if current['p95_ms'] > limit:
+            regressions.append(f"{endpoint}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+    return regressions
+
+
+def print_report(results, baseline):
+    print(f"{'endpoint':<28} {'status':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'base p95':>9}")
+    for endpoint, row in sorted(results.items()):
+        base = baseline.get(endpoint, {}).get('p95_ms', '-')
+        print(f"{endpoint:<28} {row['status']!s:>6} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+              f"{row['p99_ms']:>9} {row['queries']:>8} {base!s:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every GET route against a stored baseline.')
+    parser.add_argument('--database', default=os.path.join('benchmarks', 'academy_bench.db'))
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=8, help='Parallel requests in http mode')
+    parser.add_argument('--baseline', default=os.path.join('benchmarks', 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Allowed p95 slowdown ratio')
+    parser.add_argument('--min-delta-ms', type=float, default=5.0,
+                        help='Ignore p95 slowdowns smaller than this many milliseconds')
+    parser.add_argument('--route', action='append', help='Only benchmark these endpoints')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f'{args.database} not found - run python -m benchmarks.dataset first')
+    use_database(args.database)
+
+    import metrics
+    from app import create_app
+    from models import db, User, Course, Enrollment
+
+    app = create_app()
+
+    fixtures = _pick_fixtures(app, db, User, Course, Enrollment)
+    routes = discover_routes(app, fixtures)
+    if args.route:
+        routes = [route for route in routes if route[0] in args.route]
+
+    metrics.registry.reset()
+    if args.mode == 'http':
+        samples, statuses = run_http(app, routes, fixtures, args.iterations, args.warmup, args.concurrency)
+    else:
+        samples, statuses = run_client(app, routes, fixtures, args.iterations, args.warmup)
+    results = summarize(samples, statuses, metrics.registry.snapshot())
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get(args.mode, {})
+
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = json.load(f)
+        stored[args.mode] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        print(f"\n✓ Saved {args.mode} baseline to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+    if regressions:
+        print('\n❌ Regressions against baseline:')
+        for line in regressions:
+            print(f'  - {line}')
+        return 1
+    print('\n✅ No regressions against baseline' if baseline else '\nNo baseline yet - run with --save-baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
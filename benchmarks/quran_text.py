@@ -0,0 +1,96 @@
+"""
+Quran corpus benchmark
+Compares the memory-mapped corpus against loading the Tanzil text into each
+process: Python heap used, random passage lookups and searches. Both must
+return the same ayahs.
+
+    python quran_text.py build quran-uthmani.txt --metadata quran-data.xml
+    python -m benchmarks.quran_text --text quran-uthmani.txt
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from quran_meta import TOTAL_AYAHS
+from quran_text import Corpus, fold
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'quran.corpus')
+
+
+def load_in_heap(path):
+    """What a per-process loader would keep: every ayah, plus its folded form for search."""
+    texts = [None] * TOTAL_AYAHS
+    index = 0
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            if '|' in line and not line.startswith('#'):
+                texts[index] = line.rstrip('\r\n').split('|', 2)[2].strip()
+                index += 1
+    return texts, [fold(text) for text in texts]
+
+
+def heap_bytes(func):
+    tracemalloc.start()
+    result = func()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used, result
+
+
+def best_of(runs, func):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the memory-mapped Quran corpus.')
+    parser.add_argument('--text', required=True, help='The Tanzil file the corpus was built from')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--searches', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    mapped_heap, corpus = heap_bytes(lambda: Corpus(args.corpus))
+    loaded_heap, (texts, folded) = heap_bytes(lambda: load_in_heap(args.text))
+
+    rng = random.Random(args.seed)
+    passages = [(start, start + rng.randint(1, 10))
+                for start in (rng.randrange(TOTAL_AYAHS - 10) for _ in range(args.lookups))]
+    queries = [rng.choice(texts[rng.randrange(TOTAL_AYAHS)].split()) for _ in range(args.searches)]
+
+    mapped_lookup, mapped_passages = best_of(args.runs, lambda: [
+        [corpus.text(index) for index in range(start, end)] for start, end in passages])
+    heap_lookup, heap_passages = best_of(args.runs, lambda: [texts[start:end] for start, end in passages])
+
+    def scan(query):
+        needle = fold(query)
+        return [index for index, text in enumerate(folded) if needle in text]
+
+    mapped_search, mapped_hits = best_of(args.runs, lambda: [corpus.search(query)[0] for query in queries])
+    heap_search, heap_hits = best_of(args.runs, lambda: [len(scan(query)) for query in queries])
+
+    if mapped_passages != heap_passages or mapped_hits != heap_hits:
+        print('❌ Corpus and in-heap text differ')
+        return 1
+
+    print(f'{os.path.getsize(args.corpus) / 1024:.0f} KB corpus, best of {args.runs}')
+    print(f'  Python heap per process   mapped {mapped_heap / 1024:8.1f} KB   loaded {loaded_heap / 1024:8.1f} KB')
+    print(f'  {args.lookups} passage lookups   mapped {mapped_lookup * 1000:8.1f} ms   loaded {heap_lookup * 1000:8.1f} ms')
+    print(f'  {args.searches} searches           mapped {mapped_search * 1000:8.1f} ms   loaded {heap_search * 1000:8.1f} ms')
+    print('✅ Corpus and in-heap text agree')
+    corpus.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Nightly revision queue benchmark
+Gives one enrollment per student in a benchmark database (see
+benchmarks.dataset) synthetic Hifz progress, then times revision.generate()
+for a first night, which creates every portion's review state, and a
+following night, which only plans queues.
+
+    python -m benchmarks.dataset --database benchmarks/academy_bench.db --students 50000
+    python -m benchmarks.revision --database benchmarks/academy_bench.db --workers 4
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+from benchmarks import use_database
+
+CHUNK_SIZE = 5000
+
+
+def seed(db, students, seed_value):
+    """Replace Hifz progress and revision state. Returns the number of enrollments seeded."""
+    from hifz import ayah_mask, span_mask, to_blob
+    from models import Enrollment, HifzProgress, HifzSnapshot, RevisionQueue, RevisionState
+    from quran_meta import SURAH_AYAHS, TOTAL_AYAHS
+
+    rng = random.Random(seed_value)
+    for model in (RevisionQueue, RevisionState, HifzSnapshot, HifzProgress):
+        db.session.execute(db.delete(model))
+
+    enrollment_ids = [row[0] for row in db.session.query(db.func.min(Enrollment.id)).group_by(
+        Enrollment.user_id
+    ).limit(students)]
+    now = datetime.utcnow()
+    rows = []
+    for enrollment_id in enrollment_ids:
+        # Most students know a few juz from the end; a few are far along
+        done = min(TOTAL_AYAHS, int(rng.expovariate(1 / 900)))
+        bits = span_mask(TOTAL_AYAHS - done, TOTAL_AYAHS) | ayah_mask(1)
+        if rng.random() < 0.3:
+            surah = rng.randint(2, 60)
+            bits |= ayah_mask(surah, 1, rng.randint(1, SURAH_AYAHS[surah - 1]))
+        rows.append({'enrollment_id': enrollment_id, 'bits': to_blob(bits),
+                     'memorized_count': bits.bit_count(), 'updated_at': now})
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(db.insert(HifzProgress), rows[start:start + CHUNK_SIZE])
+    db.session.commit()
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the nightly revision queue job.')
+    parser.add_argument('--database', default=os.path.join('benchmarks', 'academy_bench.db'))
+    parser.add_argument('--students', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=1, help='Planning processes')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    use_database(args.database)
+    from app import create_app
+    from models import db, RevisionState
+    from revision import generate
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seeded = seed(db, args.students, args.seed)
+        print(f'✓ Seeded Hifz progress for {seeded} students')
+
+        day = datetime.utcnow().date()
+        first = generate(day, args.workers, args.chunk_size)
+        print(f"  first night   {first['seconds']:7.1f}s  {first['new_states']} review states created, "
+              f"{first['queued']} portions queued")
+
+        # Spread the states over the coming weeks, as a month of grading would
+        rng = random.Random(args.seed)
+        for offset in range(14):
+            db.session.execute(db.update(RevisionState).where(
+                RevisionState.portion % 14 == offset
+            ).values(due_on=day + timedelta(days=rng.randint(0, 14)), interval_days=rng.randint(1, 30)))
+        db.session.commit()
+
+        nightly = generate(day + timedelta(days=1), args.workers, args.chunk_size)
+        print(f"  next night    {nightly['seconds']:7.1f}s  {nightly['queued']} portions queued "
+              f"({args.workers} worker{'s' if args.workers != 1 else ''})")
+    print('✅ Revision queues generated')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
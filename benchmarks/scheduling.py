@@ -0,0 +1,190 @@
+"""
+Session scheduling benchmark
+Seeds weekly availability for every teacher in a benchmark database (see
+benchmarks.dataset) plus tens of thousands of booked sessions, then times
+open-slot search for one teacher and across all of them, and IntervalIndex
+overlap checks against a linear scan. Every slot returned is checked
+against the bookings so a fast wrong answer cannot pass.
+
+    python -m benchmarks.dataset --database benchmarks/academy_bench.db
+    python -m benchmarks.scheduling --database benchmarks/academy_bench.db --bookings 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import use_database
+
+ZONES = ['America/New_York', 'America/Chicago', 'America/Los_Angeles', 'Europe/London',
+         'Europe/Istanbul', 'Asia/Karachi', 'Asia/Kolkata', 'Asia/Riyadh', 'Asia/Jakarta',
+         'Africa/Cairo', 'Australia/Sydney']
+CHUNK_SIZE = 5000
+
+
+def best_of(runs, func):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def seed(db, bookings, days, seed_value):
+    """Replace availability and bookings with a synthetic schedule. Returns (teachers, bookings made)."""
+    from models import Availability, Booking, Course, Enrollment, User
+    from scheduling import IntervalIndex, SESSION_LENGTHS, SLOT_STEP_MINUTES, expand_availability
+
+    rng = random.Random(seed_value)
+    db.create_all()
+    db.session.execute(db.delete(Booking))
+    db.session.execute(db.delete(Availability))
+
+    teacher_ids = [row[0] for row in db.session.query(User.id).filter(User.is_teacher.is_(True)).all()]
+    windows = []
+    for teacher_id in teacher_ids:
+        zone = rng.choice(ZONES)
+        for weekday in range(7):
+            if rng.random() < 0.2:
+                continue  # a day off
+            start = rng.choice([6, 7, 8, 9]) * 60
+            windows.append({'teacher_id': teacher_id, 'weekday': weekday, 'start_minute': start,
+                            'end_minute': start + rng.choice([240, 300, 360]), 'timezone': zone})
+            if rng.random() < 0.7:
+                evening = rng.choice([16, 17, 18]) * 60
+                windows.append({'teacher_id': teacher_id, 'weekday': weekday, 'start_minute': evening,
+                                'end_minute': evening + rng.choice([180, 240]), 'timezone': zone})
+    db.session.execute(db.insert(Availability), windows)
+
+    # Students who can book each teacher - active enrollments in the teacher's courses
+    students = {}
+    for teacher_id, enrollment_id, student_id in db.session.query(
+        Course.teacher_id, Enrollment.id, Enrollment.user_id
+    ).join(Enrollment, Enrollment.course_id == Course.id).filter(Enrollment.status == 'active').all():
+        students.setdefault(teacher_id, []).append((enrollment_id, student_id))
+
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    expanded = expand_availability(
+        Availability.query.all(), now, now + timedelta(days=days)
+    )
+    step = timedelta(minutes=SLOT_STEP_MINUTES)
+    per_teacher = max(1, bookings // max(1, len(expanded)))
+    rows = []
+    for teacher_id, intervals in expanded.items():
+        if teacher_id not in students:
+            continue
+        starts = [start + step * i for start, end in intervals for i in range(int((end - start) / step))]
+        index = IntervalIndex()
+        taken = []
+        for start in rng.sample(starts, min(len(starts), per_teacher * 2)):
+            length = timedelta(minutes=rng.choice(SESSION_LENGTHS))
+            if len(taken) >= per_teacher or index.overlaps(start, start + length):
+                continue
+            taken.append((start, start + length))
+            index = IntervalIndex(taken)
+        for start, end in taken:
+            enrollment_id, student_id = rng.choice(students[teacher_id])
+            rows.append({'enrollment_id': enrollment_id, 'teacher_id': teacher_id, 'student_id': student_id,
+                         'starts_at': start, 'ends_at': end, 'status': 'booked', 'created_at': now})
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(db.insert(Booking), rows[start:start + CHUNK_SIZE])
+    db.session.commit()
+    return teacher_ids, len(rows)
+
+
+def check_slots(db, slots, minutes):
+    """Return the number of slots that overlap a booked session (should be 0)."""
+    from models import Booking
+
+    bad = 0
+    length = timedelta(minutes=minutes)
+    for teacher_id, starts in slots.items():
+        booked = db.session.query(Booking.starts_at, Booking.ends_at).filter(
+            Booking.teacher_id == teacher_id, Booking.status == 'booked'
+        ).all()
+        for start in starts:
+            bad += any(b_start < start + length and b_end > start for b_start, b_end in booked)
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark availability search and conflict detection.')
+    parser.add_argument('--database', default=os.path.join('benchmarks', 'academy_bench.db'))
+    parser.add_argument('--bookings', type=int, default=20000, help='Sessions to book across all teachers')
+    parser.add_argument('--days', type=int, default=14, help='Search horizon')
+    parser.add_argument('--minutes', type=int, default=60, help='Session length searched for')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    use_database(args.database)
+    from app import create_app
+    from models import db, Booking
+    from scheduling import IntervalIndex, find_open_slots
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        teacher_ids, booked = seed(db, args.bookings, args.days, args.seed)
+        print(f'✓ Seeded availability for {len(teacher_ids)} teachers and {booked} bookings '
+              f'in {time.perf_counter() - started:.1f}s')
+
+        now = datetime.utcnow()
+        end = now + timedelta(days=args.days)
+        busiest = db.session.query(Booking.teacher_id, Booking.student_id).filter(
+            Booking.status == 'booked'
+        ).first()
+
+        one, one_slots = best_of(args.runs, lambda: find_open_slots([busiest.teacher_id], now, end,
+                                                                    args.minutes, busiest.student_id))
+        db.session.remove()
+        # The common "who is free that day" search, then the whole horizon
+        tomorrow = now + timedelta(days=1)
+        day, day_slots = best_of(args.runs, lambda: find_open_slots(teacher_ids, tomorrow, tomorrow + timedelta(days=1),
+                                                                    args.minutes))
+        db.session.remove()
+        every, all_slots = best_of(args.runs, lambda: find_open_slots(teacher_ids, now, end, args.minutes))
+        db.session.remove()
+
+        # Conflict checks: bisect on each teacher's index against scanning the teacher's bookings
+        sessions = {}
+        for teacher_id, start, finish in db.session.query(
+            Booking.teacher_id, Booking.starts_at, Booking.ends_at
+        ).filter(Booking.status == 'booked').all():
+            sessions.setdefault(teacher_id, []).append((start, finish))
+        indexes = {teacher_id: IntervalIndex(rows) for teacher_id, rows in sessions.items()}
+        rng = random.Random(args.seed)
+        teachers = sorted(sessions)
+        probes = [(rng.choice(teachers), now + timedelta(minutes=15 * rng.randint(0, args.days * 96)))
+                  for _ in range(20000)]
+        length = timedelta(minutes=args.minutes)
+        indexed, hits = best_of(args.runs, lambda: sum(
+            indexes[teacher_id].overlaps(p, p + length) for teacher_id, p in probes
+        ))
+        linear, expected = best_of(args.runs, lambda: sum(
+            any(start < p + length and finish > p for start, finish in sessions[teacher_id])
+            for teacher_id, p in probes
+        ))
+
+        print(f'Open {args.minutes}-minute slots, {len(teacher_ids)} teachers, best of {args.runs}')
+        print(f'  one teacher, {args.days} days    {one * 1000:8.1f}ms  {sum(map(len, one_slots.values()))} slots')
+        print(f'  all teachers, 1 day     {day * 1000:8.1f}ms  {sum(map(len, day_slots.values()))} slots')
+        print(f'  all teachers, {args.days} days   {every * 1000:8.1f}ms  {sum(map(len, all_slots.values()))} slots')
+        print(f'  {len(probes)} overlap checks, ~{booked // max(1, len(sessions))} sessions per teacher')
+        print(f'    IntervalIndex         {indexed * 1000:8.1f}ms')
+        print(f'    linear scan           {linear * 1000:8.1f}ms')
+
+        bad = check_slots(db, all_slots, args.minutes)
+        if bad or hits != expected:
+            print(f'❌ {bad} open slots overlap a booking, index hits {hits} vs scan {expected}')
+            return 1
+        print('✅ No open slot overlaps a booked session and the index agrees with the scan')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Payment status classifier microbenchmark
+Times classify_batch() against classifying each due date on its own, and
+checks that both give identical statuses.
+
+    python -m benchmarks.status_classifier --rows 100000
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from payment_status import classify, classify_batch
+
+
+def synthetic_due_dates(rows, seed):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    dates = []
+    for _ in range(rows):
+        if rng.random() < 0.1:
+            dates.append(None)
+        else:
+            dates.append(now + timedelta(seconds=rng.randint(-90 * 86400, 45 * 86400)))
+    return dates
+
+
+def best_of(runs, func):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the batched payment status classifier.')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    due_dates = synthetic_due_dates(args.rows, args.seed)
+    now = datetime.utcnow()
+
+    per_row, expected = best_of(args.runs, lambda: [classify(due, now) for due in due_dates])
+    batched, (statuses, counts) = best_of(args.runs, lambda: classify_batch(due_dates, now))
+    if statuses != expected:
+        print('❌ Batched statuses differ from per-row classification')
+        return 1
+
+    print(f'{args.rows} due dates, best of {args.runs}')
+    print(f'  per-row classify()   {per_row * 1000:8.1f}ms')
+    print(f'  classify_batch()     {batched * 1000:8.1f}ms')
+    print('  ' + ', '.join(f'{kind} {count}' for kind, count in counts.items()))
+    print('✅ Batched and per-row statuses agree')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
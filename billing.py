@@ -0,0 +1,299 @@
+"""
+Recurring monthly billing for Raindrops Academy
+A card paid with at checkout is saved for off-session use (SavedPaymentMethod),
+and a nightly job charges it for every active enrollment whose payment is
+due, so students no longer have to come back to the payment page each month.
+
+Due enrollments are found through the (status, next_payment_due) index. The
+Stripe calls run in a bounded thread pool - at most --workers in flight -
+while this thread records the results, so SQLite only ever sees one writer.
+Each charge carries an idempotency key made of the enrollment, the due date
+and the attempt number: a run that crashes or times out after Stripe charged
+the card replays the same charge on the next run instead of charging twice,
+and a renewal that was already recorded is skipped by a conditional UPDATE
+on next_payment_due. A charge that succeeds for a period that was paid some
+other way in the meantime (by hand, or marked paid by an admin) is still
+recorded, as a Payment with status 'review' and no revenue, and logged, so
+the money can be refunded. A declined card is recorded as a failed Payment, marks
+the enrollment unpaid so the student can pay by hand, and is retried on
+later runs up to BILLING_MAX_ATTEMPTS.
+
+    python billing.py run                     # charge everything due now
+    python billing.py run --workers 8 --dry-run
+
+Schedule it nightly, e.g. cron: 30 1 * * * cd /srv/academy && python billing.py run
+Run it against stripe_stub.py (--decline-rate, --latency-ms) to exercise declines and slow responses.
+"""
+
+import argparse
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from flask import Blueprint, current_app, flash, redirect, session, url_for
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from auth import login_required
+from checkout import get_stripe, intent_amount, stripe_enabled
+from entity_cache import get_course
+from metrics import track_outbound
+from models import db, Enrollment, Payment, SavedPaymentMethod, record_revenue
+
+BILLING_PERIOD = timedelta(days=30)
+COMMIT_EVERY = 50          # results recorded per transaction
+
+billing = Blueprint('billing', __name__, url_prefix='/billing')
+
+Renewal = namedtuple('Renewal', ['enrollment_id', 'user_id', 'course_id', 'due', 'attempt',
+                                 'customer_id', 'payment_method_id'])
+Charge = namedtuple('Charge', ['renewal', 'outcome', 'intent_id', 'amount', 'message'])
+
+# Charge outcomes - only completed and declined are recorded, anything else is retried with the same key
+COMPLETED = 'completed'
+DECLINED = 'declined'
+PENDING = 'pending'
+ERROR = 'error'
+REVIEW = 'review'          # Payment status: charged, but the period was already paid - refund it
+
+
+def save_payment_method(user_id, customer_id, payment_method_id):
+    """Remember the card a student paid with for future renewals. Caller commits."""
+    values = {'customer_id': customer_id, 'payment_method_id': payment_method_id, 'created_at': datetime.utcnow()}
+    db.session.execute(
+        sqlite_insert(SavedPaymentMethod).values(user_id=user_id, **values)
+        .on_conflict_do_update(index_elements=['user_id'], set_=values)
+    )
+
+
+def due_renewals(now, limit=None):
+    """Active enrollments due by now whose student has a saved card, oldest due date first.
+
+    Declined renewals are left alone for BILLING_RETRY_HOURS after each
+    attempt and given up after BILLING_MAX_ATTEMPTS.
+    """
+    config = current_app.config
+    failures = db.session.query(
+        Payment.enrollment_id,
+        db.func.count(Payment.id).label('attempts'),
+        db.func.max(Payment.payment_date).label('last_failed')
+    ).join(
+        Enrollment, Payment.enrollment_id == Enrollment.id
+    ).filter(
+        Payment.status == 'failed',
+        Payment.payment_date >= Enrollment.next_payment_due
+    ).group_by(Payment.enrollment_id).subquery()
+
+    attempts = db.func.coalesce(failures.c.attempts, 0)
+    query = db.session.query(
+        Enrollment.id, Enrollment.user_id, Enrollment.course_id, Enrollment.next_payment_due, attempts,
+        SavedPaymentMethod.customer_id, SavedPaymentMethod.payment_method_id
+    ).join(
+        SavedPaymentMethod, SavedPaymentMethod.user_id == Enrollment.user_id
+    ).outerjoin(
+        failures, failures.c.enrollment_id == Enrollment.id
+    ).filter(
+        Enrollment.status == 'active',
+        Enrollment.next_payment_due <= now,
+        attempts < config['BILLING_MAX_ATTEMPTS'],
+        db.or_(failures.c.last_failed.is_(None),
+               failures.c.last_failed <= now - timedelta(hours=config['BILLING_RETRY_HOURS']))
+    ).order_by(Enrollment.next_payment_due, Enrollment.id)
+    if limit:
+        query = query.limit(limit)
+    return [Renewal(enrollment_id, user_id, course_id, due, attempt, customer_id, payment_method_id)
+            for enrollment_id, user_id, course_id, due, attempt, customer_id, payment_method_id in query]
+
+
+def charge(stripe, renewal, amount, course_name):
+    """Charge one renewal off-session. Runs in a pool thread - no database access."""
+    try:
+        with track_outbound('stripe'):
+            intent = stripe.PaymentIntent.create(
+                amount=amount,
+                currency='usd',
+                customer=renewal.customer_id,
+                payment_method=renewal.payment_method_id,
+                off_session=True,
+                confirm=True,
+                metadata={'enrollment_id': renewal.enrollment_id, 'user_id': renewal.user_id,
+                          'course_id': renewal.course_id, 'renewal_due': renewal.due.date().isoformat()},
+                description=f'{course_name} - {renewal.due.strftime("%B %Y")}',
+                idempotency_key=f'renewal-{renewal.enrollment_id}-{renewal.due:%Y%m%d}-{renewal.attempt}'
+            )
+    except stripe.error.CardError as e:
+        intent = getattr(e.error, 'payment_intent', None)
+        return Charge(renewal, DECLINED, intent.id if intent else None, amount, e.user_message or str(e))
+    except stripe.error.StripeError as e:
+        return Charge(renewal, ERROR, None, amount, str(e))
+    if intent.status == 'succeeded':
+        return Charge(renewal, COMPLETED, intent.id, amount, None)
+    # e.g. 'processing' - the same key picks this intent up again on the next run
+    return Charge(renewal, PENDING, intent.id, amount, f'Payment status is {intent.status}')
+
+
+def record(result, now):
+    """Write one charge's Payment and move the enrollment on. Caller commits.
+
+    Returns the Payment, or None when Stripe replayed an intent that is already recorded.
+    """
+    renewal = result.renewal
+    course = get_course(renewal.course_id)
+    if result.intent_id and db.session.query(Payment.id).filter(
+        Payment.stripe_payment_intent == result.intent_id
+    ).first():
+        current_app.logger.info('Renewal for enrollment %s: %s is already recorded',
+                                renewal.enrollment_id, result.intent_id)
+        return None
+    status = 'failed'
+    if result.outcome == COMPLETED:
+        # Only the charge that moves next_payment_due on pays for the period - a period that starts
+        # today when the due date had long passed, so missed months are not charged one run at a time
+        moved = db.session.execute(db.update(Enrollment).where(
+            Enrollment.id == renewal.enrollment_id, Enrollment.next_payment_due == renewal.due
+        ).values(
+            next_payment_due=max(renewal.due, now) + BILLING_PERIOD, last_payment_date=now, payment_status='paid'
+        )).rowcount
+        status = 'completed' if moved else REVIEW
+        if not moved:
+            current_app.logger.warning(
+                'Renewal for enrollment %s charged %s ($%.2f) but the period due %s was already paid - '
+                'recorded for review, refund it in Stripe', renewal.enrollment_id, result.intent_id,
+                result.amount / 100, renewal.due.date()
+            )
+    else:
+        db.session.execute(db.update(Enrollment).where(
+            Enrollment.id == renewal.enrollment_id
+        ).values(payment_status='unpaid'))
+    payment = Payment(
+        enrollment_id=renewal.enrollment_id,
+        amount=result.amount / 100,
+        payment_date=now,
+        payment_method='stripe',
+        transaction_id=result.intent_id,
+        stripe_payment_intent=result.intent_id,
+        stripe_customer_id=renewal.customer_id,
+        status=status
+    )
+    db.session.add(payment)
+    if status == 'completed':
+        record_revenue(payment, course)
+    return payment
+
+
+def run(now=None, workers=None, limit=None, dry_run=False):
+    """Charge every due renewal. Call inside an app context. Returns stats."""
+    from receipts import generate_receipts
+
+    now = now or datetime.utcnow()
+    workers = workers or current_app.config['BILLING_WORKERS']
+    started = time.perf_counter()
+    renewals = due_renewals(now, limit)
+    stats = {'due': len(renewals), COMPLETED: 0, DECLINED: 0, PENDING: 0, ERROR: 0, REVIEW: 0, 'replayed': 0,
+             'charged': 0.0}
+    if dry_run or not renewals:
+        stats['seconds'] = round(time.perf_counter() - started, 2)
+        return stats
+
+    stripe = get_stripe()
+    paid, uncommitted = [], 0
+    todo = iter(renewals)
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='billing') as pool:
+        while True:
+            # Keep the pool busy without queueing every renewal up front
+            for renewal in todo:
+                course = get_course(renewal.course_id)
+                in_flight.add(pool.submit(charge, stripe, renewal, intent_amount(course), course.name))
+                if len(in_flight) >= workers * 2:
+                    break
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result.outcome in (COMPLETED, DECLINED):
+                    payment = record(result, now)
+                    uncommitted += 1
+                    if payment is None:
+                        stats['replayed'] += 1
+                    elif payment.status == 'completed':
+                        paid.append(payment)
+                        stats[COMPLETED] += 1
+                        stats['charged'] += payment.amount
+                    elif payment.status == REVIEW:
+                        stats[REVIEW] += 1
+                    else:
+                        stats[DECLINED] += 1
+                else:
+                    stats[result.outcome] += 1
+                    current_app.logger.warning('Renewal for enrollment %s not charged: %s',
+                                               result.renewal.enrollment_id, result.message)
+            if uncommitted >= COMMIT_EVERY:
+                db.session.commit()
+                uncommitted = 0
+    db.session.commit()
+    if paid:
+        generate_receipts([payment.id for payment in paid])
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+def init_app(app):
+    app.config.setdefault('BILLING_WORKERS', 4)        # Stripe calls in flight at once
+    app.config.setdefault('BILLING_MAX_ATTEMPTS', 3)   # declined renewals are retried this many times in all
+    app.config.setdefault('BILLING_RETRY_HOURS', 20)   # so a nightly run retries a decline once a day
+
+
+@billing.route('/payment-method/remove', methods=['POST'])
+@login_required
+def remove_payment_method():
+    saved = db.session.get(SavedPaymentMethod, session['user_id'])
+    if saved is None:
+        return redirect(url_for('main.dashboard'))
+    if stripe_enabled():
+        stripe = get_stripe()
+        try:
+            with track_outbound('stripe'):
+                stripe.PaymentMethod.detach(saved.payment_method_id)
+        except stripe.error.StripeError:
+            # Renewals stop once the row is gone either way
+            current_app.logger.exception('Could not detach payment method for user %s', saved.user_id)
+    db.session.delete(saved)
+    db.session.commit()
+    flash('Your saved card has been removed and will not be charged for future renewals. A renewal that was '
+          'already being charged may still go through - contact us if it needs refunding.', 'info')
+    return redirect(url_for('main.dashboard'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Charge due monthly renewals to saved cards.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('run')
+    command.add_argument('--workers', type=int, help='Stripe calls in flight at once (default: BILLING_WORKERS)')
+    command.add_argument('--limit', type=int, help='Charge at most this many renewals')
+    command.add_argument('--dry-run', action='store_true', help='Only count what is due')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        if not stripe_enabled() and not args.dry_run:
+            print('❌ STRIPE_SECRET_KEY is not set')
+            return 1
+        db.create_all()
+        stats = run(workers=args.workers, limit=args.limit, dry_run=args.dry_run)
+    if args.dry_run:
+        print(f"✓ {stats['due']} renewals due")
+        return 0
+    print(f"✓ {stats['due']} renewals due: {stats[COMPLETED]} charged (${stats['charged']:.2f}), "
+          f"{stats[DECLINED]} declined, {stats[PENDING] + stats[ERROR]} to retry, {stats['seconds']}s")
+    if stats[REVIEW]:
+        print(f"❌ {stats[REVIEW]} charged for a period that was already paid - "
+              f"refund the payments with status '{REVIEW}'")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
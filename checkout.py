@@ -0,0 +1,195 @@
+"""
+Stripe checkout for Raindrops Academy
+PaymentIntents are created by a background worker as soon as an enrollment
+is committed and cached in CheckoutIntent, so the payment page can hand the
+client secret to Stripe.js straight away. create_payment_intent() falls
+back to ensure_intent() in the request when nothing is cached yet.
+
+Every Stripe call carries an idempotency key derived from the enrollment,
+so the worker and the fallback can never create two intents for the same
+checkout. Set STRIPE_API_BASE to run against stripe_stub.py locally.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from entity_cache import get_course
+from metrics import track_outbound
+from models import db, CheckoutIntent, Enrollment, SavedPaymentMethod, User
+
+
+def get_stripe():
+    """Import and configure the Stripe SDK on first use."""
+    import stripe
+    stripe.api_key = current_app.config['STRIPE_SECRET_KEY']
+    if current_app.config['STRIPE_API_BASE']:
+        stripe.api_base = current_app.config['STRIPE_API_BASE']
+    return stripe
+
+
+def stripe_enabled():
+    return bool(current_app.config['STRIPE_SECRET_KEY'])
+
+
+def intent_amount(course):
+    return int(round(course.tuition_fee * 100))  # Convert to cents
+
+
+def cached_intent(enrollment_id, amount):
+    """The unexpired intent stored for this enrollment, if it is for the current amount."""
+    intent = db.session.get(CheckoutIntent, enrollment_id)
+    if intent is None or intent.amount != amount or intent.expires_at <= datetime.utcnow():
+        return None
+    return intent
+
+
+def existing_customer(user_id):
+    """The Stripe Customer the student already has - the saved card's, else one from another checkout."""
+    saved = db.session.get(SavedPaymentMethod, user_id)
+    if saved is not None:
+        return saved.customer_id
+    return db.session.query(CheckoutIntent.customer_id).join(
+        Enrollment, CheckoutIntent.enrollment_id == Enrollment.id
+    ).filter(
+        Enrollment.user_id == user_id, CheckoutIntent.customer_id.isnot(None)
+    ).order_by(CheckoutIntent.created_at.desc()).limit(1).scalar()
+
+
+def ensure_intent(enrollment_id):
+    """Return the enrollment's CheckoutIntent, creating it with Stripe if needed.
+
+    Returns None when the enrollment is gone or already paid. Stripe errors
+    propagate to the caller.
+    """
+    enrollment = db.session.get(Enrollment, enrollment_id)
+    if enrollment is None or enrollment.payment_status == 'paid':
+        return None
+    course = get_course(enrollment.course_id)
+    amount = intent_amount(course)
+    intent = cached_intent(enrollment_id, amount)
+    if intent is not None:
+        return intent
+
+    user = db.session.get(User, enrollment.user_id)
+    stripe = get_stripe()
+    customer_id = existing_customer(user.id)
+    if customer_id is None:
+        with track_outbound('stripe'):
+            customer_id = stripe.Customer.create(
+                email=user.email,
+                name=user.full_name,
+                metadata={'user_id': user.id},
+                idempotency_key=f'checkout-customer-{enrollment_id}'
+            ).id
+    with track_outbound('stripe'):
+        stripe_intent = stripe.PaymentIntent.create(
+            amount=amount,
+            currency='usd',
+            customer=customer_id,
+            metadata={
+                'enrollment_id': enrollment_id,
+                'user_id': user.id,
+                'course_id': course.id,
+                'course_name': course.name
+            },
+            description=f'Payment for {course.name}',
+            # Keep the card for the monthly renewals billing.py charges off-session
+            setup_future_usage='off_session',
+            # A fee change needs a new intent, so the amount is part of the key
+            idempotency_key=f'checkout-intent-{enrollment_id}-{amount}'
+        )
+
+    values = {
+        'payment_intent_id': stripe_intent.id,
+        'client_secret': stripe_intent.client_secret,
+        'customer_id': customer_id,
+        'amount': amount,
+        'created_at': datetime.utcnow(),
+        'expires_at': datetime.utcnow() + timedelta(hours=current_app.config['CHECKOUT_INTENT_TTL_HOURS'])
+    }
+    db.session.execute(
+        sqlite_insert(CheckoutIntent).values(enrollment_id=enrollment_id, **values)
+        .on_conflict_do_update(index_elements=['enrollment_id'], set_=values)
+    )
+    db.session.commit()
+    return db.session.get(CheckoutIntent, enrollment_id, populate_existing=True)
+
+
+def discard_intent(enrollment_id):
+    """Forget the cached intent once it has been paid. Caller commits."""
+    db.session.execute(db.delete(CheckoutIntent).where(CheckoutIntent.enrollment_id == enrollment_id))
+
+
+def _state(app):
+    return app.extensions['checkout']
+
+
+def _executor(app):
+    state = _state(app)
+    with state['lock']:
+        if state['executor'] is None:
+            state['executor'] = ThreadPoolExecutor(
+                max_workers=app.config['CHECKOUT_WORKERS'], thread_name_prefix='checkout'
+            )
+        return state['executor']
+
+
+def _prefetch(app, enrollment_id):
+    with app.app_context():
+        try:
+            ensure_intent(enrollment_id)
+        except Exception:
+            app.logger.exception('Background PaymentIntent for enrollment %s failed', enrollment_id)
+            raise
+
+
+def prefetch_intent(enrollment_id):
+    """Start creating the enrollment's intent in the background. Returns the future, or None."""
+    app = current_app._get_current_object()
+    if not app.config['CHECKOUT_PREFETCH'] or not stripe_enabled():
+        return None
+    state = _state(app)
+    with state['lock']:
+        future = state['pending'].get(enrollment_id)
+        if future is not None:
+            return future
+    future = _executor(app).submit(_prefetch, app, enrollment_id)
+    with state['lock']:
+        state['pending'][enrollment_id] = future
+
+    def _done(_):
+        with state['lock']:
+            if state['pending'].get(enrollment_id) is future:
+                del state['pending'][enrollment_id]
+    future.add_done_callback(_done)
+    return future
+
+
+def wait_for_prefetch(enrollment_id):
+    """Give an in-flight background creation a chance to finish before falling back."""
+    app = current_app._get_current_object()
+    state = _state(app)
+    with state['lock']:
+        future = state['pending'].get(enrollment_id)
+    if future is None:
+        return
+    try:
+        future.result(timeout=app.config['CHECKOUT_PREFETCH_WAIT'])
+    except TimeoutError:
+        app.logger.warning('Background PaymentIntent for enrollment %s still running', enrollment_id)
+    except Exception:
+        pass  # Already logged by the worker - the synchronous path will retry
+
+
+def init_app(app):
+    app.config.setdefault('STRIPE_API_BASE', None)       # e.g. http://127.0.0.1:12111 for stripe_stub.py
+    app.config.setdefault('CHECKOUT_PREFETCH', True)     # create intents in the background at enrollment
+    app.config.setdefault('CHECKOUT_WORKERS', 2)
+    app.config.setdefault('CHECKOUT_PREFETCH_WAIT', 10)  # seconds the fallback waits for an in-flight intent
+    app.config.setdefault('CHECKOUT_INTENT_TTL_HOURS', 12)  # inside Stripe's 24h idempotency window
+
+    app.extensions['checkout'] = {'lock': threading.Lock(), 'executor': None, 'pending': {}}
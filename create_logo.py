@@ -1,36 +1,71 @@
-from PIL import Image, ImageDraw, ImageFont
-import os
+"""
+Brand assets for Raindrops Academy
+Draws the logo with Pillow and renders every size and format the site and
+social platforms need - favicon set, app icons, banner, social cards, WebP
+copies - in a process pool. Each output is cached by a hash of what it is
+made from (this file, its entry in ASSETS, the Pillow version and the font
+used), recorded in a manifest beside the outputs, so a rebuild only renders
+what changed.
+
+    python create_logo.py build                    # into static/images/brand
+    python create_logo.py build --workers 4 --force
+    python create_logo.py list
+
+The hand-tuned images already in static/images are never overwritten.
+"""
+
+import argparse
+import hashlib
+import io
+import json
 import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import PIL
+from PIL import Image, ImageDraw, ImageFont
 
-# Create a high-quality logo for Raindrops Academy
-width, height = 800, 800
-image = Image.new('RGBA', (width, height), (255, 255, 255, 0))
-draw = ImageDraw.Draw(image)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(BASE_DIR, 'static', 'images', 'brand')
+MANIFEST = '.assets.json'
+MASTER_SIZE = 800
+FONT_CANDIDATES = ('arial.ttf', 'DejaVuSans.ttf', 'LiberationSans-Regular.ttf')
+ICO_SIZES = [(16, 16), (32, 32), (48, 48)]
 
 # Colors
-teal = (30, 90, 125)  # #1e5a7d
-green = (45, 134, 89)  # #2d8659
-light_blue = (100, 180, 220)
-white = (255, 255, 255)
-
-# Draw circular background with gradient effect
-center_x, center_y = width // 2, height // 2
-circle_radius = 350
-
-# Create gradient-like effect with multiple circles
-for i in range(circle_radius, 0, -10):
-    alpha = int(255 * (i / circle_radius))
-    ratio = (circle_radius - i) / circle_radius
-    r = int(teal[0] + (green[0] - teal[0]) * ratio)
-    g = int(teal[1] + (green[1] - teal[1]) * ratio)
-    b = int(teal[2] + (green[2] - teal[2]) * ratio)
-    draw.ellipse(
-        [center_x - i, center_y - i, center_x + i, center_y + i],
-        fill=(r, g, b, alpha)
-    )
+TEAL = (30, 90, 125)  # #1e5a7d
+GREEN = (45, 134, 89)  # #2d8659
+LIGHT_BLUE = (100, 180, 220)
+WHITE = (255, 255, 255)
+
+TITLE = 'Raindrops Academy'
+TAGLINE = 'Learn • Grow • Succeed'
+
+# (output file, recipe, (width, height), format)
+ASSETS = (
+    ('logo.png', 'logo', (800, 800), 'PNG'),
+    ('logo.webp', 'logo', (800, 800), 'WEBP'),
+    ('logo-256.png', 'logo', (256, 256), 'PNG'),
+    ('logo-256.webp', 'logo', (256, 256), 'WEBP'),
+    ('favicon.ico', 'logo', (48, 48), 'ICO'),
+    ('favicon-16.png', 'logo', (16, 16), 'PNG'),
+    ('favicon-32.png', 'logo', (32, 32), 'PNG'),
+    ('favicon.png', 'logo', (64, 64), 'PNG'),
+    ('apple-touch-icon.png', 'icon', (180, 180), 'PNG'),
+    ('icon-192.png', 'icon', (192, 192), 'PNG'),
+    ('icon-512.png', 'icon', (512, 512), 'PNG'),
+    ('logo_banner.png', 'banner', (1200, 300), 'PNG'),
+    ('logo_banner.webp', 'banner', (1200, 300), 'WEBP'),
+    ('social-card.png', 'card', (1200, 630), 'PNG'),      # Open Graph (Facebook, LinkedIn, WhatsApp)
+    ('social-card.webp', 'card', (1200, 630), 'WEBP'),
+    ('social-card-square.png', 'card', (1080, 1080), 'PNG'),  # Instagram
+)
+
 
-# Draw water droplets
-def draw_droplet(x, y, size, color, alpha=255):
+def draw_droplet(draw, x, y, size, color, alpha=255):
     # Teardrop shape
     points = []
     # Bottom point of drop
@@ -47,57 +82,19 @@ def draw_droplet(x, y, size, color, alpha=255):
         px = x + (size * 0.5) * math.cos(rad)
         py = y - (size * 0.3) + (size * 0.5) * math.sin(rad)
         points.append((px, py))
-    
+
     draw.polygon(points, fill=(*color, alpha))
-    
+
     # Add highlight
     highlight_size = size * 0.2
     draw.ellipse(
-        [x - highlight_size, y - size*0.2 - highlight_size, 
-         x + highlight_size, y - size*0.2 + highlight_size],
+        [x - highlight_size, y - size * 0.2 - highlight_size,
+         x + highlight_size, y - size * 0.2 + highlight_size],
         fill=(255, 255, 255, 200)
     )
 
-# Main central droplet
-draw_droplet(center_x, center_y - 50, 120, white, 255)
-
-# Surrounding smaller droplets
-droplet_positions = [
-    (center_x - 120, center_y - 100, 60),
-    (center_x + 120, center_y - 100, 60),
-    (center_x - 150, center_y + 50, 50),
-    (center_x + 150, center_y + 50, 50),
-    (center_x, center_y + 120, 70),
-]
-
-for x, y, size in droplet_positions:
-    draw_droplet(x, y, size, light_blue, 230)
-
-# Add a crescent moon and star symbol
-# Crescent moon
-moon_center_x = center_x - 80
-moon_center_y = center_y + 180
-moon_radius = 40
-
-# Outer circle for crescent
-draw.ellipse(
-    [moon_center_x - moon_radius, moon_center_y - moon_radius,
-     moon_center_x + moon_radius, moon_center_y + moon_radius],
-    fill=white
-)
-# Inner circle to create crescent
-draw.ellipse(
-    [moon_center_x - moon_radius + 12, moon_center_y - moon_radius + 8,
-     moon_center_x + moon_radius + 12, moon_center_y + moon_radius + 8],
-    fill=(0, 0, 0, 0)
-)
 
-# Star
-star_center_x = center_x + 60
-star_center_y = center_y + 160
-star_size = 30
-
-def draw_star(cx, cy, size, color):
+def draw_star(draw, cx, cy, size, color):
     points = []
     for i in range(10):
         angle = math.radians(i * 36 - 90)
@@ -107,43 +104,247 @@ def draw_star(cx, cy, size, color):
         points.append((x, y))
     draw.polygon(points, fill=color)
 
-draw_star(star_center_x, star_center_y, star_size, white)
-
-# Save the logo
-output_path = 'static/images/logo.png'
-os.makedirs('static/images', exist_ok=True)
-image.save(output_path, 'PNG')
-print(f"✓ Logo created successfully: {output_path}")
-
-# Create a smaller version for favicon
-favicon = image.resize((64, 64), Image.Resampling.LANCZOS)
-favicon.save('static/images/favicon.png', 'PNG')
-print("✓ Favicon created successfully: static/images/favicon.png")
-
-# Create a horizontal banner version with text
-banner_width, banner_height = 1200, 300
-banner = Image.new('RGBA', (banner_width, banner_height), (255, 255, 255, 0))
-banner_draw = ImageDraw.Draw(banner)
-
-# Scale down and place logo on left
-logo_small = image.resize((250, 250), Image.Resampling.LANCZOS)
-banner.paste(logo_small, (25, 25), logo_small)
-
-# Add text "Raindrops Academy" on the right
-try:
-    # Try to use a nice font if available
-    font_large = ImageFont.truetype("arial.ttf", 80)
-    font_small = ImageFont.truetype("arial.ttf", 40)
-except:
-    # Fallback to default font
-    font_large = ImageFont.load_default()
-    font_small = ImageFont.load_default()
-
-text = "Raindrops Academy"
-tagline = "Learn • Grow • Succeed"
-
-banner_draw.text((320, 80), text, fill=teal, font=font_large)
-banner_draw.text((320, 180), tagline, fill=green, font=font_small)
-
-banner.save('static/images/logo_banner.png', 'PNG')
-print("✓ Banner logo created successfully: static/images/logo_banner.png")
+
+@lru_cache(maxsize=None)
+def master_logo():
+    """The 800x800 logo every other asset is scaled from - drawn once per process."""
+    width, height = MASTER_SIZE, MASTER_SIZE
+    image = Image.new('RGBA', (width, height), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(image)
+
+    # Draw circular background with gradient effect
+    center_x, center_y = width // 2, height // 2
+    circle_radius = 350
+
+    # Create gradient-like effect with multiple circles
+    for i in range(circle_radius, 0, -10):
+        alpha = int(255 * (i / circle_radius))
+        ratio = (circle_radius - i) / circle_radius
+        r = int(TEAL[0] + (GREEN[0] - TEAL[0]) * ratio)
+        g = int(TEAL[1] + (GREEN[1] - TEAL[1]) * ratio)
+        b = int(TEAL[2] + (GREEN[2] - TEAL[2]) * ratio)
+        draw.ellipse(
+            [center_x - i, center_y - i, center_x + i, center_y + i],
+            fill=(r, g, b, alpha)
+        )
+
+    # Main central droplet
+    draw_droplet(draw, center_x, center_y - 50, 120, WHITE, 255)
+
+    # Surrounding smaller droplets
+    droplet_positions = [
+        (center_x - 120, center_y - 100, 60),
+        (center_x + 120, center_y - 100, 60),
+        (center_x - 150, center_y + 50, 50),
+        (center_x + 150, center_y + 50, 50),
+        (center_x, center_y + 120, 70),
+    ]
+    for x, y, size in droplet_positions:
+        draw_droplet(draw, x, y, size, LIGHT_BLUE, 230)
+
+    # Crescent moon - a white circle with a transparent one cut out of it
+    moon_center_x = center_x - 80
+    moon_center_y = center_y + 180
+    moon_radius = 40
+    draw.ellipse(
+        [moon_center_x - moon_radius, moon_center_y - moon_radius,
+         moon_center_x + moon_radius, moon_center_y + moon_radius],
+        fill=WHITE
+    )
+    draw.ellipse(
+        [moon_center_x - moon_radius + 12, moon_center_y - moon_radius + 8,
+         moon_center_x + moon_radius + 12, moon_center_y + moon_radius + 8],
+        fill=(0, 0, 0, 0)
+    )
+
+    # Star
+    draw_star(draw, center_x + 60, center_y + 160, 30, WHITE)
+    return image
+
+
+def scaled_logo(size):
+    return master_logo().resize(size, Image.Resampling.LANCZOS)
+
+
+@lru_cache(maxsize=None)
+def font_path():
+    """First TrueType font available, or None for Pillow's built-in font."""
+    for name in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, 10).path
+        except OSError:
+            continue
+    return None
+
+
+def font(size):
+    path = font_path()
+    return ImageFont.truetype(path, size) if path else ImageFont.load_default(size)
+
+
+def render_icon(size):
+    """App icon: the logo on an opaque tile - iOS and Android fill transparency with black."""
+    image = Image.new('RGBA', size, WHITE)
+    logo = scaled_logo((int(size[0] * 0.9), int(size[1] * 0.9)))
+    image.paste(logo, ((size[0] - logo.width) // 2, (size[1] - logo.height) // 2), logo)
+    return image
+
+
+def render_banner(size):
+    """Horizontal logo with the academy name - laid out for 1200x300 and scaled with it."""
+    width, height = size
+    scale = height / 300
+    banner = Image.new('RGBA', size, (255, 255, 255, 0))
+    logo = scaled_logo((int(250 * scale), int(250 * scale)))
+    banner.paste(logo, (int(25 * scale), int(25 * scale)), logo)
+
+    draw = ImageDraw.Draw(banner)
+    draw.text((int(320 * scale), int(80 * scale)), TITLE, fill=TEAL, font=font(int(80 * scale)))
+    draw.text((int(320 * scale), int(180 * scale)), TAGLINE, fill=GREEN, font=font(int(40 * scale)))
+    return banner
+
+
+def render_card(size):
+    """Social card: logo and name on an opaque teal-to-green gradient."""
+    width, height = size
+    gradient = Image.linear_gradient('L').rotate(90).resize(size)
+    card = Image.composite(Image.new('RGBA', size, GREEN), Image.new('RGBA', size, TEAL), gradient)
+    draw = ImageDraw.Draw(card)
+
+    if width >= height * 1.3:
+        # Landscape: logo left, text right
+        logo_size = int(height * 0.7)
+        logo = scaled_logo((logo_size, logo_size))
+        card.paste(logo, (int(width * 0.05), (height - logo_size) // 2), logo)
+        text_x = int(width * 0.05) + logo_size + int(width * 0.04)
+        title_font = font(int(height * 0.11))
+        draw.text((text_x, int(height * 0.36)), TITLE, fill=WHITE, font=title_font)
+        draw.text((text_x, int(height * 0.52)), TAGLINE, fill=LIGHT_BLUE, font=font(int(height * 0.06)))
+    else:
+        # Square or portrait: logo above centered text
+        logo_size = int(min(width, height) * 0.55)
+        logo = scaled_logo((logo_size, logo_size))
+        card.paste(logo, ((width - logo_size) // 2, int(height * 0.1)), logo)
+        for text, y, text_font, color in (
+            (TITLE, int(height * 0.7), font(int(width * 0.08)), WHITE),
+            (TAGLINE, int(height * 0.82), font(int(width * 0.045)), LIGHT_BLUE),
+        ):
+            draw.text((width // 2, y), text, fill=color, font=text_font, anchor='mt')
+    return card.convert('RGB')
+
+
+RECIPES = {'logo': scaled_logo, 'icon': render_icon, 'banner': render_banner, 'card': render_card}
+
+
+def render_asset(asset, output_dir):
+    """Render one asset and write it atomically. Runs in a pool process. Returns (name, seconds, sha256)."""
+    name, recipe, size, image_format = asset
+    started = time.perf_counter()
+    image = RECIPES[recipe](size)
+    buffer = io.BytesIO()
+    if image_format == 'ICO':
+        image.save(buffer, 'ICO', sizes=ICO_SIZES)
+    elif image_format == 'WEBP':
+        image.save(buffer, 'WEBP', quality=90)
+    else:
+        image.save(buffer, image_format, optimize=True)
+    data = buffer.getvalue()
+
+    path = os.path.join(output_dir, name)
+    with open(f'{path}.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(f'{path}.tmp', path)
+    return name, time.perf_counter() - started, hashlib.sha256(data).hexdigest()
+
+
+def input_key(asset):
+    """Hash of everything an asset is made from."""
+    digest = hashlib.sha256()
+    with open(os.path.abspath(__file__), 'rb') as f:
+        digest.update(f.read())
+    digest.update(repr(asset).encode())
+    digest.update(PIL.__version__.encode())
+    path = font_path()
+    if path and asset[1] in ('banner', 'card'):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def build(output_dir=DEFAULT_OUTPUT, workers=None, force=False):
+    """Render every asset whose inputs changed (or whose output is missing or edited). Returns a report."""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+
+    started = time.perf_counter()
+    keys = {asset[0]: input_key(asset) for asset in ASSETS}
+    stale = [asset for asset in ASSETS if force or manifest.get(asset[0], {}).get('key') != keys[asset[0]]
+             or file_hash(os.path.join(output_dir, asset[0])) != manifest[asset[0]].get('sha256')]
+
+    # Slowest first (by last build's timings), so one big render doesn't finish alone at the end
+    stale.sort(key=lambda asset: manifest.get(asset[0], {}).get('ms', 0), reverse=True)
+    rendered = {}
+    if stale:
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(stale) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(stale))) as pool:
+                results = list(pool.map(render_asset, stale, [output_dir] * len(stale)))
+        else:
+            results = [render_asset(asset, output_dir) for asset in stale]
+        for name, seconds, sha256 in results:
+            rendered[name] = seconds
+            manifest[name] = {'key': keys[name], 'sha256': sha256, 'ms': round(seconds * 1000, 1)}
+
+    # Drop entries for assets no longer in ASSETS - their files are left for whoever wants them
+    manifest = {name: manifest[name] for name in keys if name in manifest}
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+    return {'rendered': rendered, 'cached': [name for name in keys if name not in rendered],
+            'seconds': time.perf_counter() - started, 'workers': workers if stale else 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the Raindrops Academy brand assets.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('build', help='Render changed assets')
+    command.add_argument('--output', default=DEFAULT_OUTPUT)
+    command.add_argument('--workers', type=int, help='Render processes (default: one per CPU)')
+    command.add_argument('--force', action='store_true', help='Render everything, ignoring the cache')
+    commands.add_parser('list', help='Show the assets that are built')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name, recipe, (width, height), image_format in ASSETS:
+            print(f'{name:26} {recipe:7} {width}x{height} {image_format}')
+        return 0
+
+    if os.path.abspath(args.output) == os.path.join(BASE_DIR, 'static', 'images'):
+        print('❌ static/images holds hand-tuned images - build into a directory of its own')
+        return 1
+    report = build(args.output, args.workers, args.force)
+    for name in sorted(report['rendered'], key=report['rendered'].get, reverse=True):
+        print(f"✓ {name:26} {report['rendered'][name] * 1000:8.1f} ms")
+    if not font_path() and report['rendered']:
+        print(f"  No TrueType font found ({', '.join(FONT_CANDIDATES)}) - text uses Pillow's built-in font")
+    workers = f", {report['workers']} worker{'s' if report['workers'] != 1 else ''}" if report['workers'] else ''
+    print(f"✅ {len(report['rendered'])} rendered, {len(report['cached'])} unchanged in "
+          f"{report['seconds']:.2f}s{workers} -> {os.path.relpath(args.output)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
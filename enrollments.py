@@ -0,0 +1,135 @@
+"""
+Bulk enrollment status changes for Raindrops Academy
+Admins and teachers move many enrollments at once - e.g. completing a whole
+course at term end - either for the rows they ticked or for every
+enrollment in a course that is in the right state. Each transition lists the
+states it may start from. The change is applied per chunk of
+BULK_CHUNK_SIZE enrollments as two set-based statements in one transaction:
+an INSERT ... SELECT writes the audit rows (old and new value), then an
+UPDATE with the same predicate changes them. Rows in any other state, or
+outside a teacher's own courses, are skipped rather than failing the batch.
+
+Payment status is not changed here: payments go through checkout or
+billing.py, which record them in the revenue ledger and move
+next_payment_due on.
+"""
+
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+from flask import Blueprint, flash, redirect, render_template, request, session, url_for
+
+from auth import admin_required, login_required, safe_next
+from models import db, Course, Enrollment, EnrollmentAudit, User
+from query_audit import query_budget
+
+BULK_CHUNK_SIZE = 500      # enrollments per transaction
+AUDIT_PAGE_SIZE = 50
+
+Transition = namedtuple('Transition', ['label', 'field', 'to', 'allowed_from'])
+
+TRANSITIONS = {
+    'activate': Transition('Activate', 'status', 'active', ('pending',)),
+    'complete': Transition('Complete', 'status', 'completed', ('active',)),
+    'reopen': Transition('Reopen', 'status', 'active', ('completed',)),
+}
+
+enrollments = Blueprint('enrollments', __name__, url_prefix='/enrollments')
+
+
+def available_transitions(statuses=None):
+    """Transitions that can start from one of statuses - the states a page lists - or all of them."""
+    return {name: transition for name, transition in TRANSITIONS.items()
+            if statuses is None or set(transition.allowed_from) & set(statuses)}
+
+
+def _scope(transition, user):
+    """Criteria every changed row must meet: an allowed starting state, and the teacher's own course."""
+    column = getattr(Enrollment, transition.field)
+    criteria = [column.in_(transition.allowed_from)]
+    if not user.is_admin:
+        criteria.append(Enrollment.course_id.in_(db.select(Course.id).where(Course.teacher_id == user.id)))
+    return criteria
+
+
+def matching_ids(transition, user, course_id):
+    """Ids of every enrollment in the course the transition applies to."""
+    criteria = [*_scope(transition, user), Enrollment.course_id == course_id]
+    return [row[0] for row in db.session.query(Enrollment.id).filter(*criteria).order_by(Enrollment.id)]
+
+
+def apply_transition(transition, enrollment_ids, user, chunk_size=BULK_CHUNK_SIZE):
+    """Apply transition to the given enrollments in chunked transactions. Returns (batch_id, changed)."""
+    batch_id = uuid.uuid4().hex
+    column = getattr(Enrollment, transition.field)
+    scope = _scope(transition, user)
+    changed = 0
+    for start in range(0, len(enrollment_ids), chunk_size):
+        criteria = [Enrollment.id.in_(enrollment_ids[start:start + chunk_size]), *scope]
+        now = datetime.utcnow()
+        db.session.execute(db.insert(EnrollmentAudit).from_select(
+            ['batch_id', 'enrollment_id', 'field', 'old_value', 'new_value', 'changed_by', 'changed_at'],
+            db.select(db.literal(batch_id), Enrollment.id, db.literal(transition.field), column,
+                      db.literal(transition.to), db.literal(user.id), db.literal(now)).where(*criteria)
+        ))
+        values = {transition.field: transition.to}
+        if transition.field == 'status' and transition.to == 'active':
+            # Billing picks up from today, not from the months the enrollment sat inactive
+            values['next_payment_due'] = db.func.max(Enrollment.next_payment_due, now)
+        changed += db.session.execute(db.update(Enrollment).where(*criteria).values(values)).rowcount
+        db.session.commit()
+    return batch_id, changed
+
+
+@enrollments.route('/bulk', methods=['POST'])
+@login_required
+def bulk():
+    user = User.query.get(session['user_id'])
+    back = safe_next(url_for('main.teacher_dashboard' if user.is_teacher else 'main.dashboard'))
+    if not (user.is_admin or user.is_teacher):
+        flash('Unauthorized access!', 'danger')
+        return redirect(url_for('main.dashboard'))
+    transition = TRANSITIONS.get(request.form.get('action'))
+    if transition is None:
+        flash('Please choose an action.', 'danger')
+        return redirect(back)
+
+    if request.form.get('scope') == 'filter':
+        course_id = request.form.get('course_id', type=int)
+        if not course_id:
+            flash('Please choose the course to apply the change to.', 'danger')
+            return redirect(back)
+        ids = matching_ids(transition, user, course_id)
+    else:
+        ids = sorted({int(value) for value in request.form.getlist('enrollment_ids') if value.isdigit()})
+        if not ids:
+            flash('Please select at least one enrollment.', 'danger')
+            return redirect(back)
+
+    _, changed = apply_transition(transition, ids, user)
+    skipped = len(ids) - changed
+    message = f'{transition.label}: {changed} enrollment(s) updated.'
+    if skipped:
+        message += f' {skipped} skipped - not {" or ".join(transition.allowed_from)}' + \
+                   ('.' if user.is_admin else ' or not in your courses.')
+    flash(message, 'success' if changed else 'info')
+    return redirect(back)
+
+
+@enrollments.route('/audit')
+@login_required
+@admin_required
+@query_budget(3)
+def audit():
+    # One row per bulk action, newest first
+    batches = db.session.query(
+        EnrollmentAudit.batch_id,
+        db.func.min(EnrollmentAudit.changed_at).label('changed_at'),
+        db.func.min(EnrollmentAudit.field).label('field'),
+        db.func.min(EnrollmentAudit.new_value).label('new_value'),
+        db.func.count(EnrollmentAudit.id).label('count'),
+        db.func.min(EnrollmentAudit.changed_by).label('changed_by')
+    ).group_by(EnrollmentAudit.batch_id).order_by(db.desc('changed_at')).limit(AUDIT_PAGE_SIZE).all()
+    users = {user.id: user for user in User.query.filter(User.id.in_({batch.changed_by for batch in batches}))}
+    return render_template('enrollment_audit.html', batches=batches, users=users)
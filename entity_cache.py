@@ -0,0 +1,159 @@
+"""
+Read-through cache for course and teacher rows
+Checkout and the public pages look the same few courses and teachers up
+again and again, and those rows rarely change. Lookups by id are served
+from a bounded, per-process LRU of immutable snapshots that expire after
+ENTITY_CACHE_TTL seconds. Routes that edit a course or teacher invalidate
+its entry after committing; other processes see the change once the TTL
+runs out.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+from time import monotonic
+
+from flask import abort, current_app
+
+import metrics
+from models import db, Course, User
+
+COURSE_FIELDS = ('id', 'name', 'description', 'duration', 'tuition_fee', 'icon', 'features',
+                 'teacher_id', 'created_at')
+TEACHER_FIELDS = ('id', 'full_name', 'email', 'phone', 'is_teacher', 'profile_picture', 'bio',
+                  'qualifications', 'specializations', 'experience_years', 'languages', 'ijazah',
+                  'teaching_style', 'created_at')
+
+CourseSnapshot = namedtuple('CourseSnapshot', COURSE_FIELDS)
+TeacherSnapshot = namedtuple('TeacherSnapshot', TEACHER_FIELDS)
+
+
+class ReadThroughCache:
+    """Bounded TTL/LRU cache that calls loader(key) on a miss. None is never cached."""
+
+    def __init__(self, name, loader, maxsize=1024, ttl=300):
+        self.name = name
+        self.loader = loader
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = self.loader(key)
+        if value is None or self.maxsize <= 0 or self.ttl <= 0:
+            return value
+
+        with self._lock:
+            # An invalidation while we were loading means the value may already be stale
+            if generation == self._generation:
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+
+def _snapshot_loader(model, snapshot):
+    columns = [getattr(model, field) for field in snapshot._fields]
+
+    def load(key):
+        row = db.session.execute(db.select(*columns).where(model.id == key)).first()
+        return snapshot(*row) if row else None
+    return load
+
+
+def _caches():
+    return current_app.extensions['entity_cache']
+
+
+def get_course(course_id):
+    return _caches()['course'].get(course_id)
+
+
+def get_course_or_404(course_id):
+    course = get_course(course_id)
+    if course is None:
+        abort(404)
+    return course
+
+
+def get_teacher(user_id):
+    """Snapshot of a user's public profile fields; check is_teacher before showing it."""
+    return _caches()['teacher'].get(user_id)
+
+
+def invalidate_course(course_id=None):
+    _caches()['course'].invalidate(course_id)
+
+
+def invalidate_teacher(user_id=None):
+    _caches()['teacher'].invalidate(user_id)
+
+
+def _render_metrics(caches):
+    def collect():
+        stats = {name: cache.stats() for name, cache in sorted(caches.items())}
+        lines = ['# HELP entity_cache_lookups_total Entity cache lookups, by cache and result.',
+                 '# TYPE entity_cache_lookups_total counter']
+        for name, values in stats.items():
+            lines.append(f'entity_cache_lookups_total{{cache="{name}",result="hit"}} {values["hits"]}')
+            lines.append(f'entity_cache_lookups_total{{cache="{name}",result="miss"}} {values["misses"]}')
+        for metric, key, kind, help_text in (
+            ('entity_cache_evictions_total', 'evictions', 'counter', 'Entries evicted to stay within ENTITY_CACHE_SIZE.'),
+            ('entity_cache_entries', 'entries', 'gauge', 'Entries currently cached.'),
+            ('entity_cache_hit_ratio', 'hit_ratio', 'gauge', 'Share of lookups served from the cache.')
+        ):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for name, values in stats.items():
+                lines.append(f'{metric}{{cache="{name}"}} {values[key]:g}')
+        return lines
+    return collect
+
+
+def init_app(app):
+    app.config.setdefault('ENTITY_CACHE_SIZE', 1024)  # entries per cache, 0 disables caching
+    app.config.setdefault('ENTITY_CACHE_TTL', 300)    # seconds
+
+    size = app.config['ENTITY_CACHE_SIZE']
+    ttl = app.config['ENTITY_CACHE_TTL']
+    caches = {
+        'course': ReadThroughCache('course', _snapshot_loader(Course, CourseSnapshot), size, ttl),
+        'teacher': ReadThroughCache('teacher', _snapshot_loader(User, TeacherSnapshot), size, ttl)
+    }
+    app.extensions['entity_cache'] = caches
+    metrics.add_collector(app, _render_metrics(caches))
@@ -0,0 +1,232 @@
+"""
+Hifz (memorization) progress for Raindrops Academy
+Each enrollment's progress is one 6,236-bit set - bit i is ayah i in mushaf
+order - stored as a 780-byte blob in HifzProgress. Coverage per surah or
+juz, weekly diffs and class-wide totals are whole-set operations on Python
+integers (AND with a precomputed mask, then bit_count), so no per-ayah rows
+are ever scanned.
+
+The first change in a week saves the previous state to HifzSnapshot, which
+is what "this week" is measured against.
+"""
+
+from datetime import datetime, timedelta
+
+from flask import Blueprint, abort, flash, redirect, render_template, request, session, url_for
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from auth import login_required
+from entity_cache import get_course
+from models import db, Enrollment, HifzProgress, HifzSnapshot, User
+from query_audit import query_budget
+from quran_meta import (JUZ_OFFSETS, SURAH_AYAHS, SURAH_NAMES, SURAH_OFFSETS, TOTAL_AYAHS,
+                        ayah_index, ayah_ref)
+
+BLOB_BYTES = (TOTAL_AYAHS + 7) // 8
+FULL_MASK = (1 << TOTAL_AYAHS) - 1
+UPDATE_ATTEMPTS = 3  # retries when another teacher saved the same student's progress first
+
+hifz = Blueprint('hifz', __name__, url_prefix='/hifz')
+
+
+def span_mask(start, end):
+    """Bits start..end-1 set."""
+    return ((1 << (end - start)) - 1) << start
+
+
+SURAH_MASKS = tuple(span_mask(start, end) for start, end in zip(SURAH_OFFSETS, SURAH_OFFSETS[1:]))
+JUZ_MASKS = tuple(span_mask(start, end) for start, end in zip(JUZ_OFFSETS, JUZ_OFFSETS[1:]))
+JUZ_SIZES = tuple(end - start for start, end in zip(JUZ_OFFSETS, JUZ_OFFSETS[1:]))
+
+
+def from_blob(blob):
+    return int.from_bytes(blob, 'little') if blob else 0
+
+
+def to_blob(bits):
+    return (bits & FULL_MASK).to_bytes(BLOB_BYTES, 'little')
+
+
+def ayah_mask(surah, first_ayah=None, last_ayah=None):
+    """Mask for surah:first_ayah-last_ayah, the whole surah when the ayahs are left out."""
+    first = ayah_index(surah, first_ayah or 1)
+    last = ayah_index(surah, last_ayah or SURAH_AYAHS[surah - 1])
+    if last < first:
+        raise ValueError(f'{surah}:{first_ayah}-{last_ayah} ends before it starts')
+    return span_mask(first, last + 1)
+
+
+def coverage(bits, masks):
+    """Memorized ayahs inside each mask."""
+    return [(bits & mask).bit_count() for mask in masks]
+
+
+def runs(bits):
+    """Yield (start, end) index ranges of consecutive memorized ayahs."""
+    offset = 0
+    while bits:
+        skip = (bits & -bits).bit_length() - 1
+        bits >>= skip
+        length = (~bits & (bits + 1)).bit_length() - 1  # trailing ones
+        yield offset + skip, offset + skip + length
+        bits >>= length
+        offset += skip + length
+
+
+def describe(bits):
+    """Readable ranges like (surah, first_ayah, last_ayah), split at surah boundaries."""
+    ranges = []
+    for start, end in runs(bits):
+        while start < end:
+            surah, ayah = ayah_ref(start)
+            stop = min(end, SURAH_OFFSETS[surah])
+            ranges.append((surah, ayah, ayah + stop - start - 1))
+            start = stop
+    return ranges
+
+
+def week_start(moment):
+    """Monday of the week moment falls in."""
+    return moment.date() - timedelta(days=moment.weekday())
+
+
+def class_summary(progress):
+    """Aggregates over [(bits, start_of_week_bits)] for a class of students."""
+    union, common = 0, (FULL_MASK if progress else 0)
+    juz_memorized = [0] * len(JUZ_MASKS)
+    juz_complete = [0] * len(JUZ_MASKS)
+    memorized = added = 0
+    for bits, baseline in progress:
+        union |= bits
+        common &= bits
+        memorized += bits.bit_count()
+        added += (bits & ~baseline).bit_count()
+        for juz, count in enumerate(coverage(bits, JUZ_MASKS)):
+            juz_memorized[juz] += count
+            juz_complete[juz] += count == JUZ_SIZES[juz]
+
+    students = len(progress)
+    return {
+        'students': students,
+        'memorized': memorized,
+        'average_percent': memorized * 100 / (students * TOTAL_AYAHS) if students else 0,
+        'added_this_week': added,
+        'union': union.bit_count(),      # ayahs at least one student knows
+        'common': common.bit_count(),    # ayahs every student knows
+        'juz': [{
+            'number': juz + 1,
+            'average_percent': juz_memorized[juz] * 100 / (students * JUZ_SIZES[juz]) if students else 0,
+            'complete': juz_complete[juz]
+        } for juz in range(len(JUZ_MASKS))]
+    }
+
+
+def load_progress(enrollment_ids, week=None):
+    """{enrollment_id: (bits, start_of_week_bits)} for enrollments with any progress, in one query."""
+    week = week or week_start(datetime.utcnow())
+    rows = db.session.query(HifzProgress.enrollment_id, HifzProgress.bits, HifzSnapshot.bits).outerjoin(
+        HifzSnapshot,
+        (HifzSnapshot.enrollment_id == HifzProgress.enrollment_id) & (HifzSnapshot.week_start == week)
+    ).filter(HifzProgress.enrollment_id.in_(list(enrollment_ids))).all()
+    progress = {}
+    for enrollment_id, blob, baseline_blob in rows:
+        bits = from_blob(blob)
+        # No snapshot means nothing changed this week
+        progress[enrollment_id] = (bits, bits if baseline_blob is None else from_blob(baseline_blob))
+    return progress
+
+
+def record_progress(enrollment_id, mask, memorized, user_id):
+    """Mark (or unmark) the ayahs in mask. Returns (bits before, bits after)."""
+    week = week_start(datetime.utcnow())
+    for _ in range(UPDATE_ATTEMPTS):
+        row = db.session.get(HifzProgress, enrollment_id, populate_existing=True)
+        before = from_blob(row.bits) if row else 0
+        after = (before | mask) if memorized else (before & ~mask)
+        if after == before:
+            return before, after
+
+        # Keep the start-of-week state before the week's first change
+        db.session.execute(
+            sqlite_insert(HifzSnapshot).values(enrollment_id=enrollment_id, week_start=week, bits=to_blob(before))
+            .on_conflict_do_nothing()
+        )
+        values = {'bits': to_blob(after), 'memorized_count': after.bit_count(),
+                  'updated_at': datetime.utcnow(), 'updated_by': user_id}
+        stmt = sqlite_insert(HifzProgress).values(enrollment_id=enrollment_id, **values)
+        if row is None:
+            stmt = stmt.on_conflict_do_nothing()
+        else:
+            # Only write over the bits we read - a concurrent save makes this a no-op and we retry
+            stmt = stmt.on_conflict_do_update(index_elements=['enrollment_id'], set_=values,
+                                              where=HifzProgress.bits == row.bits)
+        if db.session.execute(stmt).rowcount:
+            db.session.commit()
+            return before, after
+        db.session.rollback()
+    raise RuntimeError(f'Hifz progress for enrollment {enrollment_id} kept changing, try again')
+
+
+def _can_view(enrollment, user):
+    if user.is_admin or enrollment.user_id == user.id:
+        return True
+    return user.is_teacher and get_course(enrollment.course_id).teacher_id == user.id
+
+
+@hifz.route('/<int:enrollment_id>', methods=['GET', 'POST'])
+@login_required
+@query_budget(6)
+def progress(enrollment_id):
+    enrollment = Enrollment.query.get_or_404(enrollment_id)
+    user = User.query.get(session['user_id'])
+    if not _can_view(enrollment, user):
+        flash('Unauthorized access!', 'danger')
+        return redirect(url_for('main.dashboard'))
+    can_edit = user.is_admin or (user.is_teacher and enrollment.user_id != user.id)
+
+    if request.method == 'POST':
+        if not can_edit:
+            abort(403)
+        try:
+            juz = request.form.get('juz', type=int)
+            if juz:
+                if not 1 <= juz <= len(JUZ_MASKS):
+                    raise ValueError(f'No juz {juz}')
+                mask, label = JUZ_MASKS[juz - 1], f'Juz {juz}'
+            else:
+                surah = request.form.get('surah', type=int) or 0
+                first = request.form.get('first_ayah', type=int)
+                last = request.form.get('last_ayah', type=int)
+                mask = ayah_mask(surah, first, last or first)
+                label = SURAH_NAMES[surah - 1] + (f' {first}-{last or first}' if first else '')
+        except ValueError as e:
+            flash(f'Please choose a valid surah and ayah range ({e}).', 'danger')
+            return redirect(url_for('hifz.progress', enrollment_id=enrollment.id))
+        memorized = request.form.get('action', 'memorized') == 'memorized'
+        before, after = record_progress(enrollment.id, mask, memorized, user.id)
+        changed = (after ^ before).bit_count()
+        flash(f'{label}: {changed} ayah(s) {"marked memorized" if memorized else "cleared"}.',
+              'success' if changed else 'info')
+        return redirect(url_for('hifz.progress', enrollment_id=enrollment.id))
+
+    bits, baseline = load_progress([enrollment.id]).get(enrollment.id, (0, 0))
+    surahs = [{
+        'number': number, 'name': SURAH_NAMES[number - 1], 'memorized': count,
+        'total': SURAH_AYAHS[number - 1]
+    } for number, count in enumerate(coverage(bits, SURAH_MASKS), start=1) if count]
+    juz = [{'number': number, 'memorized': count, 'total': JUZ_SIZES[number - 1]}
+           for number, count in enumerate(coverage(bits, JUZ_MASKS), start=1)]
+    return render_template('hifz_progress.html',
+                           enrollment=enrollment,
+                           student=db.session.get(User, enrollment.user_id),
+                           course=get_course(enrollment.course_id),
+                           can_edit=can_edit,
+                           memorized=bits.bit_count(),
+                           total=TOTAL_AYAHS,
+                           surahs=surahs,
+                           juz=juz,
+                           juz_complete=sum(item['memorized'] == item['total'] for item in juz),
+                           added=describe(bits & ~baseline),
+                           removed=describe(baseline & ~bits),
+                           surah_names=SURAH_NAMES,
+                           surah_ayahs=SURAH_AYAHS)
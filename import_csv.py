@@ -0,0 +1,42 @@
+"""
+Bulk import students, teachers or enrollments from a CSV file
+Usage: python import_csv.py students partner_students.csv [--errors-out errors.csv]
+"""
+
+import argparse
+import csv
+import time
+
+from app import create_app, import_csv, IMPORT_COLUMNS
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import students, teachers or enrollments from CSV.')
+    parser.add_argument('kind', choices=sorted(IMPORT_COLUMNS))
+    parser.add_argument('path')
+    parser.add_argument('--errors-out', help='Write skipped rows and reasons to this CSV file')
+    parser.add_argument('--workers', type=int, help='Password hashing processes (default: CPU count)')
+    args = parser.parse_args()
+    
+    app = create_app()
+    started = time.perf_counter()
+    with app.app_context(), open(args.path, encoding='utf-8-sig', newline='') as f:
+        created, errors = import_csv(f, args.kind, hash_workers=args.workers)
+    elapsed = time.perf_counter() - started
+    
+    print(f"✓ Imported {created} {args.kind} in {elapsed:.1f}s")
+    if errors:
+        print(f"⚠ Skipped {len(errors)} row(s)")
+        for line_no, message in errors[:20]:
+            print(f"  line {line_no}: {message}")
+        if len(errors) > 20:
+            print(f"  ... and {len(errors) - 20} more")
+    
+    if args.errors_out:
+        with open(args.errors_out, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['line', 'problem'])
+            writer.writerows(errors)
+        print(f"Error report written to {args.errors_out}")
+
+if __name__ == '__main__':
+    main()
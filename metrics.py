@@ -0,0 +1,283 @@
+"""
+Request metrics for Raindrops Academy
+Records per-endpoint latency, SQL, template and outbound call timings and
+exposes them on /metrics in the Prometheus text format
+"""
+
+import hmac
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from flask import Response, abort, before_render_template, current_app, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stats for the request currently being handled (None outside a request)
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+    __slots__ = ('start', 'sql_count', 'sql_time', 'template_time', 'template_start',
+                 'outbound', 'queries')
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_start = None
+        self.outbound = {}
+        self.queries = {}  # statement -> [count, total seconds]
+
+    def top_queries(self, limit):
+        ranked = sorted(self.queries.items(), key=lambda item: item[1][1], reverse=True)
+        return ranked[:limit]
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            running += count
+            yield bound, running
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)         # (endpoint, method, status) -> count
+            self.latency = defaultdict(Histogram)    # endpoint -> histogram
+            self.sql_count = defaultdict(int)        # endpoint -> statements
+            self.sql_time = defaultdict(float)       # endpoint -> seconds
+            self.template_time = defaultdict(float)  # endpoint -> seconds
+            self.outbound = defaultdict(Histogram)   # service -> histogram
+            self.slow_requests = defaultdict(int)    # endpoint -> count
+
+    def observe_request(self, endpoint, method, status, duration, stats, slow):
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            self.latency[endpoint].observe(duration)
+            self.sql_count[endpoint] += stats.sql_count
+            self.sql_time[endpoint] += stats.sql_time
+            self.template_time[endpoint] += stats.template_time
+            if slow:
+                self.slow_requests[endpoint] += 1
+
+    def observe_outbound(self, service, duration):
+        with self._lock:
+            self.outbound[service].observe(duration)
+
+    def snapshot(self):
+        """Per-endpoint totals, used by the benchmark suite."""
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': histogram.count,
+                    'seconds': histogram.total,
+                    'sql_count': self.sql_count[endpoint],
+                    'sql_seconds': self.sql_time[endpoint],
+                    'template_seconds': self.template_time[endpoint]
+                }
+                for endpoint, histogram in self.latency.items()
+            }
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# HELP http_requests_total Requests handled, by endpoint, method and status.')
+            lines.append('# TYPE http_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{endpoint="{_escape(endpoint)}",method="{method}",status="{status}"}} {count}')
+
+            lines.append('# HELP http_request_duration_seconds Request latency by endpoint.')
+            lines.append('# TYPE http_request_duration_seconds histogram')
+            for endpoint, histogram in sorted(self.latency.items()):
+                _render_histogram(lines, 'http_request_duration_seconds', f'endpoint="{_escape(endpoint)}"', histogram)
+
+            _render_counter(lines, 'http_request_sql_statements_total', 'SQL statements issued while handling requests.', self.sql_count)
+            _render_counter(lines, 'http_request_sql_seconds_total', 'Time spent executing SQL while handling requests.', self.sql_time)
+            _render_counter(lines, 'http_request_template_seconds_total', 'Time spent rendering templates.', self.template_time)
+            _render_counter(lines, 'http_slow_requests_total', 'Requests slower than METRICS_SLOW_REQUEST_MS.', self.slow_requests)
+
+            lines.append('# HELP outbound_call_duration_seconds Latency of outbound SMTP and Stripe calls.')
+            lines.append('# TYPE outbound_call_duration_seconds histogram')
+            for service, histogram in sorted(self.outbound.items()):
+                _render_histogram(lines, 'outbound_call_duration_seconds', f'service="{_escape(service)}"', histogram)
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _render_counter(lines, name, help_text, values):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for endpoint, value in sorted(values.items()):
+        lines.append(f'{name}{{endpoint="{_escape(endpoint)}"}} {value:g}')
+
+
+def _render_histogram(lines, name, labels, histogram):
+    for bound, count in histogram.cumulative():
+        lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {count}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.total:g}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+registry = MetricsRegistry()
+
+
+def current_stats():
+    return _current.get()
+
+
+def add_collector(app, collector):
+    """Register collector() -> list of Prometheus text lines, appended to the app's /metrics."""
+    app.extensions.setdefault('metrics_collectors', []).append(collector)
+
+
+@contextmanager
+def track_outbound(service):
+    """Time an outbound call (e.g. 'smtp', 'stripe') against the current request."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        duration = perf_counter() - start
+        registry.observe_outbound(service, duration)
+        stats = _current.get()
+        if stats is not None:
+            stats.outbound[service] = stats.outbound.get(service, 0.0) + duration
+
+
+# SQLAlchemy engine events - only requests being measured pay for the bookkeeping
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('metrics_query_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    duration = perf_counter() - starts.pop()
+    stats.sql_count += 1
+    stats.sql_time += duration
+    entry = stats.queries.get(statement)
+    if entry is None:
+        stats.queries[statement] = [1, duration]
+    else:
+        entry[0] += 1
+        entry[1] += duration
+
+
+def _before_render(sender, template, context, **extra):
+    stats = _current.get()
+    if stats is not None:
+        stats.template_start = perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    stats = _current.get()
+    if stats is not None and stats.template_start is not None:
+        stats.template_time += perf_counter() - stats.template_start
+        stats.template_start = None
+
+
+def _scraper_allowed():
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        scheme, _, supplied = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(supplied.strip().encode(), token.encode()):
+            return True
+    return request.remote_addr in current_app.config['METRICS_ALLOW_IPS']
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_SLOW_REQUEST_MS', 500)
+    app.config.setdefault('METRICS_SLOW_REQUEST_TOP_QUERIES', 5)
+    # /metrics is only served to scrapers that send this bearer token or come
+    # from one of these addresses; with neither set the endpoint returns 404
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('METRICS_ALLOW_IPS', ())
+
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    @app.before_request
+    def _start_request_metrics():
+        request.environ['metrics.token'] = _current.set(RequestStats())
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        stats = _current.get()
+        if stats is None:
+            return response
+        duration = perf_counter() - stats.start
+        endpoint = request.endpoint or 'unmatched'
+        slow = duration * 1000 >= app.config['METRICS_SLOW_REQUEST_MS']
+        registry.observe_request(endpoint, request.method, response.status_code, duration, stats, slow)
+        if slow:
+            top = '; '.join(
+                f'{count}x {total * 1000:.1f}ms {statement[:200]!r}'
+                for statement, (count, total) in stats.top_queries(app.config['METRICS_SLOW_REQUEST_TOP_QUERIES'])
+            )
+            app.logger.warning(
+                'Slow request %s %s (%s): %.1fms, %d queries in %.1fms, templates %.1fms, outbound %s. Top queries: %s',
+                request.method, request.path, endpoint, duration * 1000, stats.sql_count,
+                stats.sql_time * 1000, stats.template_time * 1000,
+                {service: round(seconds * 1000, 1) for service, seconds in stats.outbound.items()} or 'none',
+                top or 'none'
+            )
+        return response
+
+    @app.teardown_request
+    def _reset_request_metrics(exc):
+        token = request.environ.pop('metrics.token', None)
+        if token is not None:
+            _current.reset(token)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    def metrics_endpoint():
+        if not _scraper_allowed():
+            abort(404)
+        body = registry.render()
+        for collector in current_app.extensions.get('metrics_collectors', []):
+            body += '\n'.join(collector()) + '\n'
+        return Response(body, mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
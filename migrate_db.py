@@ -3,9 +3,11 @@ Database migration script to update Payment model for Stripe integration
 Run this after updating the Payment model in app.py
 """
 
-from app import db, app
+from app import create_app
+from models import db
 
 def migrate_database():
+    app = create_app()
     with app.app_context():
         # Add new columns to existing Payment table
         with db.engine.connect() as conn:
@@ -27,6 +29,51 @@ def migrate_database():
             except Exception as e:
                 print(f"stripe_customer_id column may already exist: {e}")
             
+            try:
+                # One enrollment per student per course - enroll() relies on this index
+                conn.execute(db.text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS uq_enrollment_user_course ON enrollment (user_id, course_id)"
+                ))
+                print("✓ Added unique index on enrollment (user_id, course_id)")
+            except Exception as e:
+                print(f"Could not add enrollment unique index - remove duplicate enrollments first: {e}")
+            
+            try:
+                # Payment history per enrollment is read newest first
+                conn.execute(db.text(
+                    "CREATE INDEX IF NOT EXISTS ix_payment_enrollment_date ON payment (enrollment_id, payment_date)"
+                ))
+                print("✓ Added payment history index on (enrollment_id, payment_date)")
+            except Exception as e:
+                print(f"Error adding payment history index: {e}")
+            
+            try:
+                # One Payment per Stripe PaymentIntent - payment_success relies on this index
+                conn.execute(db.text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS uq_payment_stripe_intent ON payment (stripe_payment_intent)"
+                ))
+                print("✓ Added unique index on payment (stripe_payment_intent)")
+            except Exception as e:
+                print(f"Could not add payment intent unique index - remove duplicate payments first: {e}")
+            
+            try:
+                # Recurring billing finds due enrollments through this index
+                conn.execute(db.text(
+                    "CREATE INDEX IF NOT EXISTS ix_enrollment_status_due ON enrollment (status, next_payment_due)"
+                ))
+                print("✓ Added billing index on enrollment (status, next_payment_due)")
+            except Exception as e:
+                print(f"Error adding billing index: {e}")
+            
+            try:
+                # Session times are shown in each user's own time zone
+                conn.execute(db.text(
+                    "ALTER TABLE user ADD COLUMN timezone VARCHAR(50) DEFAULT 'UTC'"
+                ))
+                print("✓ Added timezone column to user")
+            except Exception as e:
+                print(f"timezone column may already exist: {e}")
+            
             try:
                 # Update payment_method column comment
                 conn.execute(db.text(
@@ -39,8 +86,10 @@ def migrate_database():
             conn.commit()
         
         print("\n✅ Database migration completed!")
-        print("\nNote: If you encounter errors, you may need to recreate the database.")
-        print("To recreate:")
+        print("\nNote: If you encounter errors, restore the last good snapshot:")
+        print("   python backup.py restore --latest")
+        print("Take one with 'python backup.py create' before migrating. Without a snapshot,")
+        print("you may need to recreate the database. To recreate:")
         print("1. Stop the server")
         print("2. Delete: c:\\QuranAcademy\\instance\\quran_academy.db")
         print("3. Restart the server - it will create a fresh database")
@@ -0,0 +1,326 @@
+"""
+Database models for Raindrops Academy
+Kept separate from app.py so scripts can reach the models without building the web app
+"""
+
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+db = SQLAlchemy()
+
+# Database Models
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(200), nullable=False)
+    full_name = db.Column(db.String(120), nullable=False)
+    phone = db.Column(db.String(20))
+    is_admin = db.Column(db.Boolean, default=False)
+    is_teacher = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Teacher profile fields
+    profile_picture = db.Column(db.String(200))
+    bio = db.Column(db.Text)
+    qualifications = db.Column(db.Text)  # Degrees and certifications
+    specializations = db.Column(db.Text)  # Areas of strength
+    experience_years = db.Column(db.Integer)
+    languages = db.Column(db.String(200))
+    ijazah = db.Column(db.String(200))  # Ijazah certificates
+    teaching_style = db.Column(db.Text)
+    timezone = db.Column(db.String(50), default='UTC')  # IANA name, e.g. 'Europe/London'
+    
+    enrollments = db.relationship('Enrollment', backref='student', lazy=True)
+    teaching_courses = db.relationship('Course', backref='teacher', lazy=True)
+
+class Course(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    duration = db.Column(db.String(50))
+    tuition_fee = db.Column(db.Float, nullable=False)
+    icon = db.Column(db.String(50))
+    features = db.Column(db.Text)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    enrollments = db.relationship('Enrollment', backref='course', lazy=True)
+
+class Enrollment(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'course_id', name='uq_enrollment_user_course'),
+        # The recurring-billing job finds active enrollments whose payment is due
+        db.Index('ix_enrollment_status_due', 'status', 'next_payment_due'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    enrollment_date = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='pending')  # pending, active, completed
+    payment_status = db.Column(db.String(20), default='unpaid')  # unpaid, paid
+    next_payment_due = db.Column(db.DateTime)  # Next monthly payment due date
+    last_payment_date = db.Column(db.DateTime)  # Last payment received date
+    # Monthly fees - one Payment row per charge, newest first
+    payments = db.relationship('Payment', backref='enrollment', lazy='dynamic',
+                               order_by='Payment.payment_date.desc()')
+
+class Payment(db.Model):
+    __table_args__ = (
+        db.Index('ix_payment_enrollment_date', 'enrollment_id', 'payment_date'),
+        # A PaymentIntent is recorded once, however often its success page is posted
+        db.UniqueConstraint('stripe_payment_intent', name='uq_payment_stripe_intent'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    payment_date = db.Column(db.DateTime, default=datetime.utcnow)
+    payment_method = db.Column(db.String(50))  # 'stripe', 'cash', 'bank_transfer', etc.
+    transaction_id = db.Column(db.String(100))  # Stripe payment intent ID
+    stripe_payment_intent = db.Column(db.String(200))  # Full Stripe payment intent ID
+    stripe_customer_id = db.Column(db.String(200))  # Stripe customer ID
+    status = db.Column(db.String(20), default='pending')  # pending, completed, failed, review, refunded
+
+# One row per enrollment changed by a bulk status action - see enrollments.py
+class EnrollmentAudit(db.Model):
+    __table_args__ = (
+        db.Index('ix_enrollment_audit_enrollment', 'enrollment_id', 'changed_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(32), nullable=False, index=True)  # one bulk action
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
+    field = db.Column(db.String(20), nullable=False)  # status or payment_status
+    old_value = db.Column(db.String(20))
+    new_value = db.Column(db.String(20), nullable=False)
+    changed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Stripe PaymentIntent created ahead of checkout - at most one per unpaid enrollment
+class CheckoutIntent(db.Model):
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), primary_key=True)
+    payment_intent_id = db.Column(db.String(200), nullable=False)
+    client_secret = db.Column(db.String(200), nullable=False)
+    customer_id = db.Column(db.String(200))
+    amount = db.Column(db.Integer, nullable=False)  # Cents - a fee change makes the intent stale
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+# Card a student saved at checkout - renewals are charged to it off-session, see billing.py
+class SavedPaymentMethod(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    customer_id = db.Column(db.String(200), nullable=False)  # Stripe customer the card is attached to
+    payment_method_id = db.Column(db.String(200), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Weekly teaching window in the teacher's own time zone, e.g. Mondays 09:00-12:00
+class Availability(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    start_minute = db.Column(db.Integer, nullable=False)  # Minutes after local midnight
+    end_minute = db.Column(db.Integer, nullable=False)
+    timezone = db.Column(db.String(50), nullable=False)  # Zone the window was published in
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# One-on-one session booked by a student - times are stored in UTC
+class Booking(db.Model):
+    __table_args__ = (
+        # Conflict checks and slot search scan a teacher's (or student's) sessions by start
+        # time - ends_at and status are included so the scan never touches the table
+        db.Index('ix_booking_teacher_start', 'teacher_id', 'starts_at', 'ends_at', 'status'),
+        db.Index('ix_booking_student_start', 'student_id', 'starts_at', 'ends_at', 'status'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    starts_at = db.Column(db.DateTime, nullable=False)
+    ends_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), default='booked')  # booked, cancelled
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    enrollment = db.relationship('Enrollment')
+    teacher = db.relationship('User', foreign_keys=[teacher_id])
+    student = db.relationship('User', foreign_keys=[student_id])
+
+# Hifz (memorization) progress - one bit per ayah in mushaf order, see hifz.py
+class HifzProgress(db.Model):
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), primary_key=True)
+    bits = db.Column(db.LargeBinary, nullable=False)  # little-endian, bit i = ayah i
+    memorized_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+# Progress as it stood at the start of each week, written before the week's first change
+class HifzSnapshot(db.Model):
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), primary_key=True)
+    week_start = db.Column(db.Date, primary_key=True)  # Monday
+    bits = db.Column(db.LargeBinary, nullable=False)
+
+# Spaced-repetition state per memorized portion, see revision.py
+class RevisionState(db.Model):
+    __table_args__ = (
+        db.Index('ix_revision_state_due', 'enrollment_id', 'due_on'),
+    )
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), primary_key=True)
+    portion = db.Column(db.Integer, primary_key=True)  # index into revision.PORTIONS
+    ease = db.Column(db.Float, nullable=False, default=2.5)
+    interval_days = db.Column(db.Integer, nullable=False, default=0)
+    reps = db.Column(db.Integer, nullable=False, default=0)
+    lapses = db.Column(db.Integer, nullable=False, default=0)
+    due_on = db.Column(db.Date, nullable=False)
+    last_reviewed = db.Column(db.Date)
+
+# Daily revision queue - written by the nightly job, read by the dashboards
+class RevisionQueue(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('enrollment_id', 'queue_date', 'portion', name='uq_revision_queue_item'),
+        db.Index('ix_revision_queue_date', 'queue_date'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
+    queue_date = db.Column(db.Date, nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    portion = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, done
+    grade = db.Column(db.String(20))
+    reviewed_at = db.Column(db.DateTime)
+
+# Attendance per student per class session, marked a whole class at a time - see attendance.py
+class Attendance(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('enrollment_id', 'session_date', name='uq_attendance_session'),
+        db.Index('ix_attendance_course_date', 'course_id', 'session_date'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    session_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(10), nullable=False)  # present, late, absent, excused
+    marked_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    marked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Monthly attendance rollups - kept in step with Attendance in the same transaction
+class StudentAttendance(db.Model):
+    __table_args__ = (
+        db.Index('ix_student_attendance_course_period', 'course_id', 'period'),
+    )
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), primary_key=True)
+    period = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    sessions = db.Column(db.Integer, nullable=False, default=0)  # excused sessions are left out
+    attended = db.Column(db.Integer, nullable=False, default=0)  # present or late
+
+class CourseAttendance(db.Model):
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), primary_key=True)
+    period = db.Column(db.String(7), primary_key=True)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    attended = db.Column(db.Integer, nullable=False, default=0)
+
+# Recitation a student uploads for Tajweed feedback - the audio itself is on disk, see recordings.py
+class Recording(db.Model):
+    __table_args__ = (
+        db.Index('ix_recording_enrollment', 'enrollment_id', 'status', 'completed_at'),
+        db.Index('ix_recording_user', 'user_id', 'size'),  # quota sums never touch the table
+        db.Index('ix_recording_status_updated', 'status', 'updated_at'),  # abandoned upload cleanup
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    storage_key = db.Column(db.String(32), unique=True, nullable=False)  # file name under RECORDING_FOLDER
+    filename = db.Column(db.String(200), nullable=False)  # as uploaded, for downloads
+    content_type = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # declared up front, reserved against the quota
+    received = db.Column(db.Integer, nullable=False, default=0)  # bytes written so far
+    status = db.Column(db.String(20), nullable=False, default='uploading')  # uploading, complete
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+# Rendered receipt for a payment - the HTML is stored on disk by its SHA-256, see receipts.py
+class Receipt(db.Model):
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'), primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# A year's receipts in one document, written by the batch job - one row per student it covers
+class ReceiptStatement(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    payment_count = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Revenue ledger - append-only, one entry per completed payment
+class LedgerEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'), unique=True, nullable=False)
+    enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False, index=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)  # Teacher at time of payment
+    amount = db.Column(db.Float, nullable=False)
+    period = db.Column(db.String(7), nullable=False, index=True)  # YYYY-MM
+    payment_date = db.Column(db.DateTime, nullable=False)
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Revenue rollups - kept in step with the ledger in the same transaction
+class CourseRevenue(db.Model):
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), primary_key=True)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    last_payment_date = db.Column(db.DateTime)
+    course = db.relationship('Course')
+
+class TeacherRevenue(db.Model):
+    teacher_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    last_payment_date = db.Column(db.DateTime)
+    teacher = db.relationship('User')
+
+class MonthlyRevenue(db.Model):
+    period = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    last_payment_date = db.Column(db.DateTime)
+
+def _bump_revenue_rollup(model, key_column, key, amount, payment_date):
+    stmt = sqlite_insert(model).values({
+        key_column.key: key,
+        'total_amount': amount,
+        'payment_count': 1,
+        'last_payment_date': payment_date
+    })
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key_column],
+        set_={
+            'total_amount': model.total_amount + stmt.excluded.total_amount,
+            'payment_count': model.payment_count + 1,
+            'last_payment_date': db.func.max(model.last_payment_date, stmt.excluded.last_payment_date)
+        }
+    )
+    db.session.execute(stmt)
+
+def record_revenue(payment, course):
+    """Append a ledger entry for a completed payment and update the rollups.
+
+    Must be called before the caller commits, so the Payment row, its ledger
+    entry and the rollups are written in one transaction.
+    """
+    db.session.flush()  # Assigns payment.id and payment_date defaults
+    payment_date = payment.payment_date
+    db.session.add(LedgerEntry(
+        payment_id=payment.id,
+        enrollment_id=payment.enrollment_id,
+        course_id=course.id,
+        teacher_id=course.teacher_id,
+        amount=payment.amount,
+        period=payment_date.strftime('%Y-%m'),
+        payment_date=payment_date
+    ))
+    _bump_revenue_rollup(CourseRevenue, CourseRevenue.course_id, course.id, payment.amount, payment_date)
+    _bump_revenue_rollup(MonthlyRevenue, MonthlyRevenue.period, payment_date.strftime('%Y-%m'), payment.amount, payment_date)
+    if course.teacher_id:
+        _bump_revenue_rollup(TeacherRevenue, TeacherRevenue.teacher_id, course.teacher_id, payment.amount, payment_date)
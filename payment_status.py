@@ -0,0 +1,68 @@
+"""
+Payment status classification for Raindrops Academy
+Turns next-payment due dates into the "Overdue by N days / Due today /
+Due in N days" labels, badge classes and summary counts shared by the
+teacher dashboard, the teacher report and payment reminders. A whole batch
+is classified against one reference time, and each distinct day offset is
+only turned into a status once.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+# Due within this many days counts as "due soon"
+DUE_SOON_DAYS = 7
+
+# Status kinds, in the order summaries list them
+OVERDUE = 'overdue'
+DUE_TODAY = 'due_today'
+DUE_SOON = 'due_soon'
+UPCOMING = 'upcoming'
+UNSCHEDULED = 'unscheduled'
+KINDS = (OVERDUE, DUE_TODAY, DUE_SOON, UPCOMING, UNSCHEDULED)
+
+PaymentStatus = namedtuple('PaymentStatus', ['kind', 'label', 'css_class', 'days_until_due'])
+
+UNSCHEDULED_STATUS = PaymentStatus(UNSCHEDULED, 'No payment yet', 'warning', None)
+
+
+def _status_for_days(days):
+    if days < 0:
+        return PaymentStatus(OVERDUE, f'Overdue by {-days} days', 'danger', days)
+    if days == 0:
+        return PaymentStatus(DUE_TODAY, 'Due today', 'warning', days)
+    if days <= DUE_SOON_DAYS:
+        return PaymentStatus(DUE_SOON, f'Due in {days} days', 'warning', days)
+    return PaymentStatus(UPCOMING, f'Due in {days} days', 'success', days)
+
+
+def day_offsets(due_dates, now=None):
+    """Whole days from now until each due date (None where there is no date)."""
+    now = now or datetime.utcnow()
+    return [None if due is None else (due - now).days for due in due_dates]
+
+
+def classify(due_date, now=None):
+    """Status of a single enrollment's next payment."""
+    if due_date is None:
+        return UNSCHEDULED_STATUS
+    return _status_for_days((due_date - (now or datetime.utcnow())).days)
+
+
+def classify_batch(due_dates, now=None):
+    """Classify many due dates against one reference time.
+
+    Returns (statuses, counts) where statuses line up with due_dates and
+    counts maps every kind in KINDS to how many rows fell into it.
+    """
+    counts = dict.fromkeys(KINDS, 0)
+    statuses = []
+    # Day offsets repeat heavily across a batch - build each status once
+    seen = {None: UNSCHEDULED_STATUS}
+    for days in day_offsets(due_dates, now):
+        status = seen.get(days)
+        if status is None:
+            status = seen[days] = _status_for_days(days)
+        statuses.append(status)
+        counts[status.kind] += 1
+    return statuses, counts
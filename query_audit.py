@@ -0,0 +1,125 @@
+"""
+Development-mode query auditing for Raindrops Academy
+Counts SQL statements per request, flags N+1 patterns (the same statement
+issued over and over by lazy relationship loads) and enforces the per-route
+budgets declared with @query_budget. On by default when the app runs with
+debug or testing enabled; a blown budget raises under testing so the test
+fails, and is logged otherwise. Streamed responses are checked once the
+body has been sent, since their rows are queried while it renders.
+"""
+
+from collections import Counter
+from contextvars import ContextVar
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Audit for the request currently being handled (None when auditing is off)
+_current = ContextVar('query_audit', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A route issued more SQL statements than its declared budget."""
+
+
+class RequestAudit:
+    __slots__ = ('count', 'lazy_depth', 'lazy_loads', 'streamed')
+
+    def __init__(self):
+        self.count = 0
+        self.lazy_depth = 0
+        self.lazy_loads = Counter()  # statement -> times issued from a lazy load
+        self.streamed = False
+
+    def repeated_lazy_loads(self, threshold):
+        return [(statement, count) for statement, count in self.lazy_loads.most_common() if count >= threshold]
+
+
+def query_budget(limit):
+    """Declare the most SQL statements a view may issue per request."""
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+def current_audit():
+    return _current.get()
+
+
+# Lazy loads are run inside the ORM execute hook so the statements they emit can be attributed to them
+@event.listens_for(Session, 'do_orm_execute')
+def _track_relationship_load(orm_execute_state):
+    audit = _current.get()
+    if audit is None or not orm_execute_state.is_relationship_load:
+        return None
+    audit.lazy_depth += 1
+    try:
+        return orm_execute_state.invoke_statement()
+    finally:
+        audit.lazy_depth -= 1
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    audit = _current.get()
+    if audit is None:
+        return
+    audit.count += 1
+    if audit.lazy_depth:
+        audit.lazy_loads[statement] += 1
+
+
+def _audit_enabled(app):
+    enabled = app.config['QUERY_AUDIT']
+    return (app.debug or app.testing) if enabled is None else enabled
+
+
+def init_app(app):
+    app.config.setdefault('QUERY_AUDIT', None)            # None: on under debug or testing
+    app.config.setdefault('QUERY_AUDIT_STRICT', None)     # None: raise on blown budgets under testing
+    app.config.setdefault('QUERY_AUDIT_N_PLUS_ONE', 3)    # lazy repeats of one statement before warning
+
+    @app.before_request
+    def _start_query_audit():
+        if _audit_enabled(app):
+            request.environ['query_audit.token'] = _current.set(RequestAudit())
+
+    def check(audit):
+        endpoint = request.endpoint or 'unmatched'
+        for statement, count in audit.repeated_lazy_loads(app.config['QUERY_AUDIT_N_PLUS_ONE']):
+            app.logger.warning('Possible N+1 in %s: %dx lazy load %r', endpoint, count, statement[:200])
+
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None and audit.count > budget:
+            message = f'{endpoint} issued {audit.count} queries, over its budget of {budget}'
+            strict = app.config['QUERY_AUDIT_STRICT']
+            if app.testing if strict is None else strict:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+
+    @app.after_request
+    def _check_query_audit(response):
+        audit = _current.get()
+        if audit is None:
+            return response
+        if response.is_streamed:
+            # Rows are still to be queried - check when the request context is torn down
+            audit.streamed = True
+            return response
+        response.headers['X-Query-Count'] = str(audit.count)
+        check(audit)
+        return response
+
+    @app.teardown_request
+    def _reset_query_audit(exc):
+        token = request.environ.pop('query_audit.token', None)
+        if token is None:
+            return
+        audit = _current.get()
+        _current.reset(token)
+        if audit.streamed and exc is None:
+            check(audit)
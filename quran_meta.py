@@ -0,0 +1,67 @@
+"""
+Quran structure for memorization tracking
+Ayah counts per surah and where each juz begins, following the Tanzil
+metadata (Hafs numbering, 6,236 ayahs). Ayahs are addressed by their
+0-based index in mushaf order.
+"""
+
+from bisect import bisect_right
+from itertools import accumulate
+
+SURAH_NAMES = (
+    'Al-Faatiha', 'Al-Baqara', "Aal-i-Imraan", 'An-Nisaa', 'Al-Maaida', "Al-An'aam", "Al-A'raaf",
+    'Al-Anfaal', 'At-Tawba', 'Yunus', 'Hud', 'Yusuf', "Ar-Ra'd", 'Ibrahim', 'Al-Hijr', 'An-Nahl',
+    'Al-Israa', 'Al-Kahf', 'Maryam', 'Taa-Haa', 'Al-Anbiyaa', 'Al-Hajj', 'Al-Muminoon', 'An-Noor',
+    'Al-Furqaan', "Ash-Shu'araa", 'An-Naml', 'Al-Qasas', 'Al-Ankaboot', 'Ar-Room', 'Luqman',
+    'As-Sajda', 'Al-Ahzaab', 'Saba', 'Faatir', 'Yaseen', 'As-Saaffaat', 'Saad', 'Az-Zumar', 'Ghafir',
+    'Fussilat', 'Ash-Shura', 'Az-Zukhruf', 'Ad-Dukhaan', 'Al-Jaathiya', 'Al-Ahqaf', 'Muhammad',
+    'Al-Fath', 'Al-Hujuraat', 'Qaaf', 'Adh-Dhaariyat', 'At-Tur', 'An-Najm', 'Al-Qamar', 'Ar-Rahmaan',
+    'Al-Waaqia', 'Al-Hadid', 'Al-Mujaadila', 'Al-Hashr', 'Al-Mumtahana', 'As-Saff', "Al-Jumu'a",
+    'Al-Munaafiqoon', 'At-Taghaabun', 'At-Talaaq', 'At-Tahrim', 'Al-Mulk', 'Al-Qalam', 'Al-Haaqqa',
+    "Al-Ma'aarij", 'Nooh', 'Al-Jinn', 'Al-Muzzammil', 'Al-Muddaththir', 'Al-Qiyaama', 'Al-Insaan',
+    'Al-Mursalaat', 'An-Naba', "An-Naazi'aat", 'Abasa', 'At-Takwir', 'Al-Infitaar', 'Al-Mutaffifin',
+    'Al-Inshiqaaq', 'Al-Burooj', 'At-Taariq', "Al-A'laa", 'Al-Ghaashiya', 'Al-Fajr', 'Al-Balad',
+    'Ash-Shams', 'Al-Lail', 'Ad-Dhuhaa', 'Ash-Sharh', 'At-Tin', 'Al-Alaq', 'Al-Qadr', 'Al-Bayyina',
+    'Az-Zalzala', 'Al-Aadiyaat', "Al-Qaari'a", 'At-Takaathur', 'Al-Asr', 'Al-Humaza', 'Al-Fil',
+    'Quraish', "Al-Maa'un", 'Al-Kawthar', 'Al-Kaafiroon', 'An-Nasr', 'Al-Masad', 'Al-Ikhlaas',
+    'Al-Falaq', 'An-Naas'
+)
+
+SURAH_AYAHS = (
+    7, 286, 200, 176, 120, 165, 206, 75, 129, 109, 123, 111, 43, 52, 99, 128, 111, 110, 98, 135,
+    112, 78, 118, 64, 77, 227, 93, 88, 69, 60, 34, 30, 73, 54, 45, 83, 182, 88, 75, 85,
+    54, 53, 89, 59, 37, 35, 38, 29, 18, 45, 60, 49, 62, 55, 78, 96, 29, 22, 24, 13,
+    14, 11, 11, 18, 12, 12, 30, 52, 52, 44, 28, 28, 20, 56, 40, 31, 50, 40, 46, 42,
+    29, 19, 36, 25, 22, 17, 19, 26, 30, 20, 15, 21, 11, 8, 8, 19, 5, 8, 8, 11,
+    11, 8, 3, 9, 5, 4, 7, 3, 6, 3, 5, 4, 5, 6
+)
+
+# (surah, ayah) each of the 30 juz starts at
+JUZ_STARTS = (
+    (1, 1), (2, 142), (2, 253), (3, 93), (4, 24), (4, 148), (5, 83), (6, 111), (7, 88), (8, 41),
+    (9, 93), (11, 6), (12, 53), (15, 1), (17, 1), (18, 75), (21, 1), (23, 1), (25, 21), (27, 56),
+    (29, 46), (33, 31), (36, 28), (39, 32), (41, 47), (46, 1), (51, 31), (58, 1), (67, 1), (78, 1)
+)
+
+TOTAL_AYAHS = sum(SURAH_AYAHS)
+
+# Index of each surah's first ayah, plus TOTAL_AYAHS at the end
+SURAH_OFFSETS = tuple(accumulate(SURAH_AYAHS, initial=0))
+
+assert len(SURAH_NAMES) == len(SURAH_AYAHS) == 114 and TOTAL_AYAHS == 6236
+
+
+def ayah_index(surah, ayah):
+    """0-based mushaf index of surah:ayah (both 1-based). Raises ValueError when out of range."""
+    if not 1 <= surah <= 114 or not 1 <= ayah <= SURAH_AYAHS[surah - 1]:
+        raise ValueError(f'No ayah {surah}:{ayah}')
+    return SURAH_OFFSETS[surah - 1] + ayah - 1
+
+
+def ayah_ref(index):
+    """Inverse of ayah_index: (surah, ayah) for a 0-based index."""
+    surah = bisect_right(SURAH_OFFSETS, index)
+    return surah, index - SURAH_OFFSETS[surah - 1] + 1
+
+
+JUZ_OFFSETS = tuple(ayah_index(surah, ayah) for surah, ayah in JUZ_STARTS) + (TOTAL_AYAHS,)
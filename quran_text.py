@@ -0,0 +1,375 @@
+"""
+Offline Quran text for lesson preparation
+The text lives in one read-only binary file that every process memory-maps,
+so app workers share a single copy through the OS page cache instead of
+each loading the whole mushaf into its heap. Lookups slice the map through
+memoryviews and only decode the ayahs asked for; search runs mmap.find over
+a normalized copy of the text and maps hits back to ayahs with a bisect on
+the offset index.
+
+The corpus is built once from a Tanzil text download ("surah|ayah|text"
+lines, e.g. quran-simple.txt or quran-uthmani.txt). Page numbers come from
+Tanzil's quran-data.xml when it is given:
+
+    python quran_text.py build quran-uthmani.txt --metadata quran-data.xml
+    python quran_text.py info
+
+File layout, all integers little-endian:
+
+    header   magic, version, ayah count, page count, then (offset, length) of each section
+    offsets  uint32 start of every ayah in the text section, plus its end
+    folded   uint32 start of every ayah in the search section, plus its end
+    pages    uint16 index of the first ayah on each mushaf page
+    text     UTF-8 ayah text, concatenated
+    search   normalized text (see fold), one ayah per line
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+import unicodedata
+import xml.etree.ElementTree as ElementTree
+from array import array
+from bisect import bisect_right
+
+from flask import Blueprint, current_app, flash, jsonify, redirect, render_template, request, url_for
+
+from auth import login_required
+from quran_meta import (JUZ_OFFSETS, SURAH_AYAHS, SURAH_NAMES, TOTAL_AYAHS,
+                        ayah_index, ayah_ref)
+
+MAGIC = b'RAQT'
+VERSION = 1
+SECTIONS = ('offsets', 'folded', 'pages', 'text', 'search')
+HEADER = struct.Struct('<4sHHII' + 'QQ' * len(SECTIONS))
+SEARCH_LIMIT = 50     # hits returned per search (all hits are counted)
+MAX_PASSAGE = 600     # ayahs returned by one lookup - enough for any juz (juz 30 has 564)
+MIN_QUERY = 2         # characters, after normalization
+
+# Letter forms that readers type interchangeably
+_FOLD_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ٲ': 'ا', 'ٳ': 'ا',
+    'ى': 'ي', 'ی': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه', 'ک': 'ك',
+    'ـ': None,  # tatweel
+})
+
+quran = Blueprint('quran', __name__, url_prefix='/quran')
+
+
+class CorpusError(Exception):
+    pass
+
+
+def fold(text):
+    """Search form of text: no harakat or Quranic annotation marks, unified letter forms, casefolded."""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if unicodedata.category(char) not in ('Mn', 'Me', 'Cf'))
+    return ' '.join(text.translate(_FOLD_LETTERS).casefold().split())
+
+
+def _align(length):
+    return -length % 8
+
+
+def _read_tanzil(path):
+    """Ayah texts in mushaf order from a Tanzil "surah|ayah|text" file, checked against quran_meta."""
+    texts = [None] * TOTAL_AYAHS
+    with open(path, encoding='utf-8-sig') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            try:
+                surah, ayah, text = line.split('|', 2)
+                index = ayah_index(int(surah), int(ayah))
+            except ValueError as e:
+                raise CorpusError(f'{path}:{line_number}: expected "surah|ayah|text" ({e})')
+            if texts[index] is not None:
+                raise CorpusError(f'{path}:{line_number}: {surah}:{ayah} appears twice')
+            texts[index] = text.strip()
+    missing = [index for index, text in enumerate(texts) if text is None]
+    if missing:
+        surah, ayah = ayah_ref(missing[0])
+        raise CorpusError(f'{path}: {len(missing)} ayahs missing, starting with {surah}:{ayah}')
+    return texts
+
+
+def _read_pages(path):
+    """First ayah index of each mushaf page from Tanzil's quran-data.xml."""
+    starts = []
+    for page in ElementTree.parse(path).getroot().iter('page'):
+        starts.append(ayah_index(int(page.get('sura')), int(page.get('aya'))))
+    if not starts or starts[0] != 0 or starts != sorted(starts):
+        raise CorpusError(f'{path}: no usable <page> entries')
+    return starts
+
+
+def build(text_path, output_path, metadata_path=None):
+    """Write the corpus file for a Tanzil text (and optional metadata) download. Returns its size."""
+    texts = _read_tanzil(text_path)
+    pages = _read_pages(metadata_path) if metadata_path else []
+
+    encoded = [text.encode('utf-8') for text in texts]
+    folded = [fold(text).encode('utf-8') + b'\n' for text in texts]
+    sections = {}
+    for name, parts in (('offsets', encoded), ('folded', folded)):
+        offsets = array('I', [0])
+        for part in parts:
+            offsets.append(offsets[-1] + len(part))
+        sections[name] = offsets
+    sections['pages'] = array('H', pages)
+    if sys.byteorder != 'little':
+        for name in ('offsets', 'folded', 'pages'):
+            sections[name].byteswap()
+    sections = {name: values.tobytes() for name, values in sections.items()}
+    sections['text'] = b''.join(encoded)
+    sections['search'] = b''.join(folded)
+
+    layout, position = [], HEADER.size + _align(HEADER.size)
+    for name in SECTIONS:
+        layout.extend((position, len(sections[name])))
+        position += len(sections[name]) + _align(len(sections[name]))
+
+    # Write beside the target and rename over it - workers that still map the old file keep reading it
+    temp_path = f'{output_path}.tmp'
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, TOTAL_AYAHS, len(pages), *layout))
+        f.write(b'\0' * _align(HEADER.size))
+        for name in SECTIONS:
+            f.write(sections[name])
+            f.write(b'\0' * _align(len(sections[name])))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, output_path)
+    return position
+
+
+class Corpus:
+    """Read-only view of a corpus file. Safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, _, ayahs, pages, *layout = HEADER.unpack_from(self._map)
+        except struct.error:
+            magic = version = ayahs = None
+        if magic != MAGIC or version != VERSION or ayahs != TOTAL_AYAHS:
+            self._map.close()
+            raise CorpusError(f'{path} is not a version {VERSION} Quran corpus - rebuild it')
+        self.page_count = pages
+
+        view = memoryview(self._map)
+        sections = {name: view[layout[2 * i]:layout[2 * i] + layout[2 * i + 1]]
+                    for i, name in enumerate(SECTIONS)}
+        self._offsets = self._integers(sections['offsets'], 'I')
+        self._folded = self._integers(sections['folded'], 'I')
+        self._pages = self._integers(sections['pages'], 'H')
+        self._text = sections['text']
+        self._search_start = layout[2 * SECTIONS.index('search')]
+
+    @staticmethod
+    def _integers(section, code):
+        if sys.byteorder == 'little':
+            return section.cast(code)  # zero-copy
+        values = array(code, section)
+        values.byteswap()
+        return values
+
+    def text(self, index):
+        """Text of the ayah at a 0-based mushaf index - only this ayah is decoded."""
+        return str(self._text[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def page_of(self, index):
+        """1-based mushaf page of an ayah, or None if the corpus was built without page data."""
+        return bisect_right(self._pages, index) if self.page_count else None
+
+    def page_range(self, page):
+        """(start, end) ayah indexes of a 1-based page."""
+        if not 1 <= page <= self.page_count:
+            raise ValueError(f'No page {page}' if self.page_count else 'Page data was not included in this corpus')
+        end = self._pages[page] if page < self.page_count else TOTAL_AYAHS
+        return self._pages[page - 1], end
+
+    def ayah(self, index):
+        surah, number = ayah_ref(index)
+        return {
+            'surah': surah,
+            'ayah': number,
+            'surah_name': SURAH_NAMES[surah - 1],
+            'juz': bisect_right(JUZ_OFFSETS, index),
+            'page': self.page_of(index),
+            'text': self.text(index)
+        }
+
+    def passage(self, start, end):
+        """Ayahs start..end-1 as dicts, at most MAX_PASSAGE."""
+        return [self.ayah(index) for index in range(start, min(end, start + MAX_PASSAGE, TOTAL_AYAHS))]
+
+    def search(self, query, limit=SEARCH_LIMIT, start=0, end=TOTAL_AYAHS):
+        """(hits, ayahs) for ayahs start..end-1 containing query, ignoring harakat and letter forms."""
+        needle = fold(query).encode('utf-8')
+        if len(needle) < MIN_QUERY:
+            raise ValueError(f'Search for at least {MIN_QUERY} letters')
+        position = self._search_start + self._folded[start]
+        stop = self._search_start + self._folded[end]
+        hits, found = 0, []
+        while True:
+            position = self._map.find(needle, position, stop)
+            if position < 0:
+                break
+            index = bisect_right(self._folded, position - self._search_start) - 1
+            hits += 1
+            if len(found) < limit:
+                found.append(self.ayah(index))
+            # One hit per ayah - carry on from the next one
+            position = self._search_start + self._folded[index + 1]
+        return hits, found
+
+    def close(self):
+        for view in (self._offsets, self._folded, self._pages, self._text):
+            if isinstance(view, memoryview):
+                view.release()
+        self._map.close()
+
+
+def get_corpus():
+    """The app's Corpus, mapped on first use in this process. None when the corpus is not installed."""
+    state = current_app.extensions['quran_text']
+    if state['corpus'] is None:
+        with state['lock']:
+            if state['corpus'] is None and os.path.exists(current_app.config['QURAN_CORPUS']):
+                state['corpus'] = Corpus(current_app.config['QURAN_CORPUS'])
+    return state['corpus']
+
+
+def init_app(app):
+    app.config.setdefault('QURAN_CORPUS', os.path.join(app.root_path, 'data', 'quran.corpus'))
+    app.extensions['quran_text'] = {'lock': threading.Lock(), 'corpus': None}
+
+
+def _scope():
+    """(start, end, label) for the surah, juz or page in the request args; the whole mushaf by default."""
+    surah = request.args.get('surah', type=int)
+    juz = request.args.get('juz', type=int)
+    page = request.args.get('page', type=int)
+    if juz:
+        if not 1 <= juz <= len(JUZ_OFFSETS) - 1:
+            raise ValueError(f'No juz {juz}')
+        return JUZ_OFFSETS[juz - 1], JUZ_OFFSETS[juz], f'Juz {juz}'
+    if page:
+        start, end = get_corpus().page_range(page)
+        return start, end, f'Page {page}'
+    if surah:
+        if not 1 <= surah <= len(SURAH_NAMES):
+            raise ValueError(f'No surah {surah}')
+        first = request.args.get('from', type=int) or 1
+        last = request.args.get('to', type=int) or (first if request.args.get('from') else SURAH_AYAHS[surah - 1])
+        start, end = ayah_index(surah, first), ayah_index(surah, last) + 1
+        if end <= start:
+            raise ValueError(f'{surah}:{first}-{last} ends before it starts')
+        label = SURAH_NAMES[surah - 1] + (f' {first}-{last}' if (first, last) != (1, SURAH_AYAHS[surah - 1]) else '')
+        return start, end, label
+    return 0, TOTAL_AYAHS, 'The whole Quran'
+
+
+@quran.route('/')
+@login_required
+def reader():
+    corpus = get_corpus()
+    if corpus is None:
+        flash('The Quran text is not installed on this server yet.', 'warning')
+        return redirect(url_for('main.dashboard'))
+    query = request.args.get('q', '').strip()
+    ayahs, hits, label = [], None, None
+    try:
+        start, end, label = _scope()
+        if query:
+            hits, ayahs = corpus.search(query, start=start, end=end)
+        elif (start, end) != (0, TOTAL_AYAHS):
+            ayahs = corpus.passage(start, end)
+        else:
+            label = None
+    except ValueError as e:
+        flash(str(e), 'danger')
+    return render_template('quran_reader.html',
+                           ayahs=ayahs,
+                           hits=hits,
+                           query=query,
+                           label=label,
+                           page_count=corpus.page_count,
+                           juz_count=len(JUZ_OFFSETS) - 1,
+                           surah_names=SURAH_NAMES,
+                           surah_ayahs=SURAH_AYAHS)
+
+
+@quran.route('/api/ayahs')
+@login_required
+def api_ayahs():
+    """JSON lookup: ?surah=2&from=255&to=257, ?juz=30 or ?page=604."""
+    corpus = get_corpus()
+    if corpus is None:
+        return jsonify({'error': 'The Quran text is not installed'}), 503
+    try:
+        start, end, label = _scope()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if (start, end) == (0, TOTAL_AYAHS):
+        return jsonify({'error': 'Give a surah, juz or page'}), 400
+    return jsonify({'label': label, 'ayahs': corpus.passage(start, end)})
+
+
+@quran.route('/api/search')
+@login_required
+def api_search():
+    """JSON search: ?q=...&limit=20, optionally narrowed with surah/juz/page like api_ayahs."""
+    corpus = get_corpus()
+    if corpus is None:
+        return jsonify({'error': 'The Quran text is not installed'}), 503
+    limit = min(request.args.get('limit', SEARCH_LIMIT, type=int), MAX_PASSAGE)
+    try:
+        start, end, label = _scope()
+        hits, ayahs = corpus.search(request.args.get('q', ''), limit, start, end)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'label': label, 'hits': hits, 'ayahs': ayahs})
+
+
+def main():
+    default_output = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'quran.corpus')
+    parser = argparse.ArgumentParser(description='Build or inspect the offline Quran corpus.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('build', help='Build the corpus from a Tanzil text download')
+    command.add_argument('text', help='Tanzil "surah|ayah|text" file, e.g. quran-uthmani.txt')
+    command.add_argument('--metadata', help="Tanzil quran-data.xml, for page lookups")
+    command.add_argument('--output', default=default_output)
+    command = commands.add_parser('info', help='Check a built corpus')
+    command.add_argument('--corpus', default=default_output)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'build':
+            size = build(args.text, args.output, args.metadata)
+            print(f'✓ Wrote {args.output} ({size / 1024:.0f} KB, {TOTAL_AYAHS} ayahs)')
+            if not args.metadata:
+                print('  No --metadata given: page lookups are disabled')
+            return 0
+        corpus = Corpus(args.corpus)
+    except (CorpusError, OSError, ValueError) as e:
+        print(f'❌ {e}')
+        return 1
+    first, last = corpus.ayah(0), corpus.ayah(TOTAL_AYAHS - 1)
+    print(f'✓ {args.corpus}: {TOTAL_AYAHS} ayahs, {corpus.page_count or "no"} pages')
+    print(f"  1:1    {first['text'][:60]}")
+    print(f"  114:6  {last['text'][:60]}")
+    corpus.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""
+Payment receipts for Raindrops Academy
+A background worker renders each payment's receipt as soon as the payment is
+committed. Receipts are self-contained HTML pages, styled for printing, so
+the browser's "Save as PDF" gives the PDF. They are stored on disk under
+their SHA-256 - identical documents are written once - and Receipt maps each
+payment to its document. Downloads only ever read a stored file, with the
+hash as ETag so a repeat download is a 304; a receipt that is not ready yet
+is queued for the worker rather than rendered in the request.
+
+The batch job renders a year of receipts in one pass, plus a statement
+holding all of them, for a family (any set of student accounts) or for
+every student:
+
+    python receipts.py batch --year 2025 --users amina yusuf   # one statement for both
+    python receipts.py batch --year 2025                       # a statement per student
+    python receipts.py backfill                                # receipts for older payments
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import (Blueprint, abort, current_app, flash, redirect, render_template, send_file, session,
+                   url_for)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import archive
+from auth import login_required
+from models import db, Course, Receipt, ReceiptStatement, User
+from query_audit import query_budget
+
+FIRST_YEAR = 2000  # statements cover years from here to the current one
+
+receipts = Blueprint('receipts', __name__, url_prefix='/receipts')
+
+
+def receipt_number(payment_id):
+    return f'RA-{payment_id:07d}'
+
+
+def document_path(sha256):
+    return os.path.join(current_app.config['RECEIPT_FOLDER'], sha256[:2], f'{sha256}.html')
+
+
+def store(html):
+    """Write a document under its SHA-256 unless it is already there. Returns (sha256, size)."""
+    data = html.encode('utf-8')
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = document_path(sha256)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return sha256, len(data)
+
+
+def _history():
+    """Payment and Enrollment over live and archived rows - receipts outlive the archiving of their payments."""
+    return archive.payment_source(True), archive.enrollment_source(True)
+
+
+def _payment_rows(payments, enrollments, *criteria):
+    """(Payment, Enrollment, Course, User) rows - everything a receipt shows, in one query.
+
+    payments and enrollments are the sources from _history(), which criteria refer to.
+    """
+    return db.session.query(payments, enrollments, Course, User).join(
+        enrollments, payments.enrollment_id == enrollments.id
+    ).join(
+        Course, enrollments.course_id == Course.id
+    ).join(
+        User, enrollments.user_id == User.id
+    ).filter(*criteria).order_by(payments.payment_date, payments.id)
+
+
+def render_receipt(payment, enrollment, course, student):
+    # Nothing time-dependent goes in, so an unchanged payment renders to the same document
+    return render_template('receipt.html', payment=payment, enrollment=enrollment, course=course,
+                           student=student, number=receipt_number(payment.id))
+
+
+def _save_receipts(documents):
+    """Upsert Receipt rows for [(payment_id, sha256, size)] in one statement."""
+    if not documents:
+        return
+    now = datetime.utcnow()
+    stmt = sqlite_insert(Receipt)
+    stmt = stmt.on_conflict_do_update(index_elements=['payment_id'], set_={
+        'sha256': stmt.excluded.sha256, 'size': stmt.excluded.size, 'generated_at': stmt.excluded.generated_at
+    })
+    db.session.execute(stmt, [{'payment_id': payment_id, 'sha256': sha256, 'size': size, 'generated_at': now}
+                              for payment_id, sha256, size in documents])
+
+
+def generate_receipts(payment_ids):
+    """Render and store receipts for the completed ones of these payments. Returns how many.
+
+    A statement for a year one of them falls in no longer lists every payment,
+    so it is dropped - for the whole family sharing it - and rebuilt on request.
+    """
+    documents, years = [], set()
+    payments, enrollments = _history()
+    for row in _payment_rows(payments, enrollments, payments.id.in_(list(payment_ids)),
+                             payments.status == 'completed'):
+        documents.append((row[0].id, *store(render_receipt(*row))))
+        years.add((row[3].id, row[0].payment_date.year))
+    _save_receipts(documents)
+    if years:
+        stale = db.select(ReceiptStatement.sha256).where(
+            db.tuple_(ReceiptStatement.user_id, ReceiptStatement.year).in_(list(years))
+        )
+        db.session.execute(db.delete(ReceiptStatement).where(ReceiptStatement.sha256.in_(stale)))
+    db.session.commit()
+    return len(documents)
+
+
+def build_statements(year, families=None):
+    """Render a year's receipts and statements in one pass over the payments.
+
+    families is a list of user-id lists that share one statement; by default
+    every student with a payment that year gets their own. Returns stats.
+    """
+    started = time.perf_counter()
+    payments, enrollments = _history()
+    criteria = [payments.status == 'completed', payments.payment_date >= datetime(year, 1, 1),
+                payments.payment_date < datetime(year + 1, 1, 1)]
+    if families is not None:
+        criteria.append(enrollments.user_id.in_([user_id for family in families for user_id in family]))
+
+    documents, by_user, students = [], {}, {}
+    for row in _payment_rows(payments, enrollments, *criteria):
+        payment, _, _, student = row
+        documents.append((payment.id, *store(render_receipt(*row))))
+        by_user.setdefault(student.id, []).append(row)
+        students[student.id] = student
+    _save_receipts(documents)
+
+    if families is None:
+        families = [[user_id] for user_id in by_user]
+    statements = []
+    now = datetime.utcnow()
+    for family in families:
+        members = [user_id for user_id in family if user_id in by_user]
+        if not members:
+            continue
+        rows = sorted((row for user_id in members for row in by_user[user_id]),
+                      key=lambda row: (row[0].payment_date, row[0].id))
+        totals = [(students[user_id], sum(row[0].amount for row in by_user[user_id])) for user_id in members]
+        sha256, _ = store(render_template('receipt_statement.html', year=year, rows=rows, totals=totals,
+                                          total=sum(amount for _, amount in totals), number=receipt_number))
+        for user_id in members:
+            statements.append({'user_id': user_id, 'year': year, 'sha256': sha256,
+                               'payment_count': len(rows), 'total': sum(amount for _, amount in totals),
+                               'generated_at': now})
+    if statements:
+        stmt = sqlite_insert(ReceiptStatement)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['user_id', 'year'], set_={
+            column: stmt.excluded[column] for column in ('sha256', 'payment_count', 'total', 'generated_at')
+        }), statements)
+    db.session.commit()
+    return {'receipts': len(documents), 'statements': len({row['sha256'] for row in statements}),
+            'students': len(statements), 'seconds': round(time.perf_counter() - started, 2)}
+
+
+def backfill(batch_size=500):
+    """Receipts for completed payments that have none, e.g. from before receipts existed."""
+    done = 0
+    payments, _ = _history()
+    while True:
+        missing = [payment_id for (payment_id,) in db.session.query(payments.id).outerjoin(
+            Receipt, Receipt.payment_id == payments.id
+        ).filter(Receipt.payment_id.is_(None), payments.status == 'completed').limit(batch_size)]
+        rendered = generate_receipts(missing) if missing else 0
+        if not rendered:
+            return done
+        done += rendered
+
+
+def _state(app):
+    return app.extensions['receipts']
+
+
+def _run(app, job, key):
+    with app.app_context():
+        try:
+            job()
+        except Exception:
+            app.logger.exception('Background receipt job %s failed', key)
+            raise
+
+
+def _submit(key, job):
+    """Run job in the receipt worker unless the same key is already queued. Returns the future."""
+    app = current_app._get_current_object()
+    state = _state(app)
+    with state['lock']:
+        future = state['pending'].get(key)
+        if future is not None:
+            return future
+        if state['executor'] is None:
+            state['executor'] = ThreadPoolExecutor(max_workers=app.config['RECEIPT_WORKERS'],
+                                                   thread_name_prefix='receipts')
+        future = state['executor'].submit(_run, app, job, key)
+        state['pending'][key] = future
+
+    def _done(_):
+        with state['lock']:
+            if state['pending'].get(key) is future:
+                del state['pending'][key]
+    future.add_done_callback(_done)
+    return future
+
+
+def queue_receipt(payment_id):
+    """Render a payment's receipt in the background. Call after the payment is committed."""
+    return _submit(('receipt', payment_id), lambda: generate_receipts([payment_id]))
+
+
+def queue_statement(user_id, year):
+    return _submit(('statement', user_id, year), lambda: build_statements(year, [[user_id]]))
+
+
+def init_app(app):
+    app.config.setdefault('RECEIPT_FOLDER', os.path.join(app.instance_path, 'receipts'))  # not web-served
+    app.config.setdefault('RECEIPT_WORKERS', 1)
+    app.config.setdefault('RECEIPT_MAX_AGE', 3600)  # seconds browsers reuse a download before revalidating
+    app.extensions['receipts'] = {'lock': threading.Lock(), 'executor': None, 'pending': {}}
+
+
+def _send(sha256, download_name):
+    response = send_file(document_path(sha256), mimetype='text/html', conditional=True, etag=sha256,
+                         download_name=download_name, max_age=current_app.config['RECEIPT_MAX_AGE'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+
+@receipts.route('/')
+@login_required
+@query_budget(3)
+def index():
+    user = User.query.get(session['user_id'])
+    payments, enrollments = _history()
+    rows = _payment_rows(payments, enrollments, enrollments.user_id == user.id,
+                         payments.status == 'completed').add_columns(
+        Receipt.sha256
+    ).outerjoin(
+        Receipt, Receipt.payment_id == payments.id
+    ).order_by(None).order_by(payments.payment_date.desc(), payments.id.desc()).all()
+    statements = ReceiptStatement.query.filter_by(user_id=user.id).order_by(ReceiptStatement.year.desc()).all()
+    years = sorted({row[0].payment_date.year for row in rows}, reverse=True)
+    return render_template('receipts.html', payments=rows, statements={s.year: s for s in statements},
+                           years=years, number=receipt_number)
+
+
+@receipts.route('/<int:payment_id>')
+@login_required
+@query_budget(3)
+def download(payment_id):
+    payments, enrollments = _history()
+    row = db.session.query(payments.id, enrollments.user_id, Receipt.sha256).join(
+        enrollments, payments.enrollment_id == enrollments.id
+    ).outerjoin(
+        Receipt, Receipt.payment_id == payments.id
+    ).filter(payments.id == payment_id, payments.status == 'completed').first()
+    if row is None:
+        abort(404)
+    if row.user_id != session['user_id'] and not User.query.get(session['user_id']).is_admin:
+        abort(403)
+    if row.sha256 is None or not os.path.exists(document_path(row.sha256)):
+        queue_receipt(payment_id)
+        flash('Your receipt is being prepared. Please try again in a moment.', 'info')
+        return redirect(url_for('receipts.index'))
+    return _send(row.sha256, f'receipt-{receipt_number(payment_id)}.html')
+
+
+@receipts.route('/statement/<int:year>')
+@login_required
+@query_budget(2)
+def statement(year):
+    if not FIRST_YEAR <= year <= datetime.utcnow().year:
+        abort(404)
+    found = db.session.get(ReceiptStatement, (session['user_id'], year))
+    if found is None or not os.path.exists(document_path(found.sha256)):
+        # build_statements writes nothing for a year without payments, so there is nothing to wait for
+        payments, enrollments = _history()
+        paid = db.session.query(payments.id).join(enrollments, payments.enrollment_id == enrollments.id).filter(
+            enrollments.user_id == session['user_id'], payments.status == 'completed',
+            payments.payment_date >= datetime(year, 1, 1), payments.payment_date < datetime(year + 1, 1, 1)
+        ).first()
+        if paid is None:
+            flash(f'You have no payments in {year}.', 'info')
+            return redirect(url_for('receipts.index'))
+        queue_statement(session['user_id'], year)
+        flash(f'Your {year} statement is being prepared. Please try again in a moment.', 'info')
+        return redirect(url_for('receipts.index'))
+    return _send(found.sha256, f'statement-{year}.html')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render payment receipts and yearly statements.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('batch', help="A year's receipts and statements")
+    command.add_argument('--year', type=int, required=True)
+    command.add_argument('--users', nargs='+', metavar='USERNAME',
+                         help='Students sharing one statement (default: a statement per student)')
+    commands.add_parser('backfill', help='Receipts for completed payments that have none')
+    args = parser.parse_args()
+    if args.command == 'batch' and not FIRST_YEAR <= args.year <= datetime.utcnow().year:
+        print(f'❌ --year must be between {FIRST_YEAR} and {datetime.utcnow().year}')
+        return 1
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        if args.command == 'backfill':
+            print(f'✓ Rendered {backfill()} receipts')
+            return 0
+        families = None
+        if args.users:
+            users = User.query.filter(User.username.in_(args.users)).all()
+            unknown = set(args.users) - {user.username for user in users}
+            if unknown:
+                print(f"❌ No such user: {', '.join(sorted(unknown))}")
+                return 1
+            families = [[user.id for user in users]]
+        stats = build_statements(args.year, families)
+    print(f"✓ {args.year}: {stats['receipts']} receipts, {stats['statements']} statements covering "
+          f"{stats['students']} students in {stats['seconds']}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
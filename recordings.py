@@ -0,0 +1,431 @@
+"""
+Recitation recordings for Tajweed feedback
+Students upload recordings in chunks of at most RECORDING_CHUNK_BYTES. Each
+chunk is streamed from the request straight to its place in a .part file,
+so an upload is never held in memory and MAX_CONTENT_LENGTH can stay small.
+An interrupted upload resumes from the offset the server reports - starting
+the same file again picks up the unfinished upload. The offset only moves
+past a chunk once it is on disk and reads back as sent; clients that can
+hash add Upload-Checksum: sha256 <base64> and damaged chunks are refused.
+
+Teachers play recordings back through send_file(conditional=True), which
+answers Range requests (seeking in the audio player). Players send Range on
+nearly every request, and Werkzeug serves those partial responses by reading
+the file in the worker, so behind nginx set RECORDING_ACCEL_REDIRECT to an
+internal location aliased to RECORDING_FOLDER and playback is handed off
+with X-Accel-Redirect - nginx then answers the ranges itself, with sendfile:
+
+    location /_recordings/ { internal; alias /srv/academy/instance/recordings/; }
+
+Every upload, finished or not, counts against the student's
+RECORDING_QUOTA_BYTES at its declared size. The reservation is made by the
+insert itself, so parallel uploads cannot overshoot the quota. Uploads idle
+for RECORDING_ABANDON_HOURS are removed by the cleanup job:
+
+    python recordings.py cleanup                  # once, e.g. hourly from cron
+    python recordings.py cleanup --every 3600     # or keep running
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+import sys
+import time
+import unicodedata
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from flask import (Blueprint, abort, current_app, flash, jsonify, redirect, render_template, request,
+                   send_file, session, url_for)
+from sqlalchemy.exc import OperationalError
+from werkzeug.exceptions import ClientDisconnected
+
+from auth import login_required
+from entity_cache import get_course
+from models import db, Enrollment, Recording, User
+from query_audit import query_budget
+
+AUDIO_TYPES = {
+    'mp3': 'audio/mpeg', 'm4a': 'audio/mp4', 'aac': 'audio/aac', 'ogg': 'audio/ogg', 'oga': 'audio/ogg',
+    'opus': 'audio/ogg', 'webm': 'audio/webm', 'wav': 'audio/wav'
+}
+COPY_BYTES = 64 * 1024   # read from the request and written to disk this much at a time
+MB = 1024 * 1024
+
+recitation = Blueprint('recitation', __name__, url_prefix='/recordings')
+
+
+def _path(folder, storage_key, part=False):
+    return os.path.join(folder, storage_key[:2], storage_key + ('.part' if part else ''))
+
+
+def recording_path(recording, part=False):
+    return _path(current_app.config['RECORDING_FOLDER'], recording.storage_key, part)
+
+
+def chunk_bytes():
+    """Largest chunk accepted - never more than the app-wide request size limit."""
+    limit = current_app.config.get('MAX_CONTENT_LENGTH')
+    return min(current_app.config['RECORDING_CHUNK_BYTES'], limit or current_app.config['RECORDING_CHUNK_BYTES'])
+
+
+def quota_used(user_id):
+    return db.session.query(db.func.coalesce(db.func.sum(Recording.size), 0)).filter(
+        Recording.user_id == user_id
+    ).scalar()
+
+
+def start_upload(enrollment, filename, size):
+    """Reserve quota and create the .part file. Returns (recording or None, error message or None)."""
+    config = current_app.config
+    filename = os.path.basename(filename.replace('\\', '/')).strip()[:200]
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension not in AUDIO_TYPES:
+        return None, 'Please upload an audio recording (MP3, M4A, OGG, WEBM or WAV).'
+    if not 0 < size <= config['RECORDING_MAX_BYTES']:
+        return None, f"Recordings can be up to {config['RECORDING_MAX_BYTES'] // MB} MB."
+
+    # Starting the same file again resumes it
+    unfinished = Recording.query.filter_by(
+        enrollment_id=enrollment.id, user_id=enrollment.user_id, filename=filename, size=size, status='uploading'
+    ).first()
+    if unfinished:
+        return unfinished, None
+
+    # Insert only if the student's uploads, this one included, fit the quota - one statement,
+    # so two uploads started together cannot both take the last of it
+    used = db.select(db.func.coalesce(db.func.sum(Recording.size), 0)).where(
+        Recording.user_id == enrollment.user_id
+    ).scalar_subquery()
+    storage_key = uuid.uuid4().hex
+    now = datetime.utcnow()
+    values = db.select(
+        db.literal(enrollment.id), db.literal(enrollment.user_id), db.literal(storage_key), db.literal(filename),
+        db.literal(AUDIO_TYPES[extension]), db.literal(size), db.literal(0), db.literal('uploading'),
+        db.literal(now), db.literal(now)
+    ).where(used + size <= config['RECORDING_QUOTA_BYTES'])
+    try:
+        result = db.session.execute(db.insert(Recording).from_select(
+            ['enrollment_id', 'user_id', 'storage_key', 'filename', 'content_type', 'size', 'received', 'status',
+             'created_at', 'updated_at'], values
+        ))
+        if not result.rowcount:
+            db.session.rollback()
+            left = max(0, config['RECORDING_QUOTA_BYTES'] - quota_used(enrollment.user_id))
+            return None, f'Not enough recording space left ({left / MB:.1f} MB). Delete older recordings first.'
+        path = _path(config['RECORDING_FOLDER'], storage_key, part=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'xb').close()
+        db.session.commit()
+    except (OperationalError, OSError):
+        db.session.rollback()
+        current_app.logger.exception('Could not start a recording upload for enrollment %s', enrollment.id)
+        return None, 'The upload could not be started. Please try again.'
+    return Recording.query.filter_by(storage_key=storage_key).first(), None
+
+
+def _range_digest(path, offset, length):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            piece = f.read(min(COPY_BYTES, length))
+            if not piece:
+                break
+            digest.update(piece)
+            length -= len(piece)
+    return digest.digest()
+
+
+def write_chunk(recording, offset, length, stream, checksum=None):
+    """Write length bytes from stream at offset. Returns an error message, or None once written.
+
+    received only moves past bytes that are on disk and read back intact, so a
+    failed or interrupted chunk leaves the upload resumable from the last good
+    offset. checksum is the client's SHA-256 of the chunk, when it sent one.
+    """
+    end = offset + length
+    if recording.status != 'uploading':
+        return 'This recording is already uploaded.'
+    if end > recording.size:
+        return 'The chunk runs past the end of the recording.'
+    if recording.received != offset:
+        return 'The upload has moved on - resume from the current offset.'
+
+    path = recording_path(recording, part=True)
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with open(path, 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                piece = stream.read(min(COPY_BYTES, length - written))
+                if not piece:
+                    break
+                f.write(piece)
+                digest.update(piece)
+                written += len(piece)
+            if written == length:
+                f.flush()
+                os.fsync(f.fileno())
+    except (OSError, ClientDisconnected):
+        current_app.logger.warning('Recording %s: chunk at %s cut short', recording.id, offset, exc_info=True)
+    if written != length:
+        return 'The chunk was cut short - resume from the current offset.'
+    if checksum is not None and digest.digest() != checksum:
+        return 'The chunk was damaged on the way - send it again.'
+    # A retry racing its original may have written the same range; only move on if our bytes are what is there
+    if _range_digest(path, offset, length) != digest.digest():
+        return 'The chunk was not stored intact - send it again.'
+
+    advanced = db.session.execute(db.update(Recording).where(
+        Recording.id == recording.id, Recording.status == 'uploading', Recording.received == offset
+    ).values(received=end, updated_at=datetime.utcnow())).rowcount
+    db.session.commit()
+    if not advanced:
+        return 'The upload has moved on - resume from the current offset.'
+
+    if end == recording.size:
+        if os.path.getsize(path) != recording.size:
+            current_app.logger.error('Recording %s: file is %s bytes, expected %s - restarting the upload',
+                                     recording.id, os.path.getsize(path), recording.size)
+            os.truncate(path, 0)
+            db.session.execute(db.update(Recording).where(Recording.id == recording.id).values(received=0))
+            db.session.commit()
+            return 'The recording did not arrive intact - it will be uploaded again.'
+        os.replace(path, recording_path(recording))
+        db.session.execute(db.update(Recording).where(
+            Recording.id == recording.id, Recording.received == recording.size
+        ).values(status='complete', completed_at=datetime.utcnow()))
+        db.session.commit()
+    return None
+
+
+def recent_recordings(enrollment_ids, limit=10):
+    """[(Recording, student name)] - the newest finished recordings for these enrollments, in one query."""
+    enrollment_ids = list(enrollment_ids)
+    if not enrollment_ids:
+        return []
+    return db.session.query(Recording, User.full_name).join(User, Recording.user_id == User.id).filter(
+        Recording.enrollment_id.in_(enrollment_ids), Recording.status == 'complete'
+    ).order_by(Recording.completed_at.desc()).limit(limit).all()
+
+
+def delete_recording(recording):
+    for part in (True, False):
+        try:
+            os.remove(recording_path(recording, part))
+        except FileNotFoundError:
+            pass
+    db.session.delete(recording)
+    db.session.commit()
+
+
+def cleanup():
+    """Remove uploads idle for RECORDING_ABANDON_HOURS, then files no recording owns. Call inside an app context."""
+    idle = timedelta(hours=current_app.config['RECORDING_ABANDON_HOURS'])
+    # One statement - an upload resumed while we run has a fresh updated_at and is left alone
+    removed = db.session.execute(db.delete(Recording).where(
+        Recording.status == 'uploading', Recording.updated_at < datetime.utcnow() - idle
+    )).rowcount
+    db.session.commit()
+
+    # Files without a row: the uploads just removed, and leftovers of failed deletes. Only old
+    # files go - start_upload creates its file just before committing the row.
+    known = {storage_key for (storage_key,) in db.session.query(Recording.storage_key)}
+    oldest = time.time() - idle.total_seconds()
+    stats = {'uploads': removed, 'files': 0, 'bytes': 0}
+    for directory, _, files in os.walk(current_app.config['RECORDING_FOLDER']):
+        for name in files:
+            if name.split('.', 1)[0] in known:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                info = os.stat(path)
+                if info.st_mtime < oldest:
+                    os.remove(path)
+                    stats['files'] += 1
+                    stats['bytes'] += info.st_size
+            except FileNotFoundError:
+                pass
+    return stats
+
+
+def init_app(app):
+    app.config.setdefault('RECORDING_FOLDER', os.path.join(app.instance_path, 'recordings'))  # not web-served
+    app.config.setdefault('RECORDING_CHUNK_BYTES', 1 * MB)
+    app.config.setdefault('RECORDING_MAX_BYTES', 50 * MB)     # per recording
+    app.config.setdefault('RECORDING_QUOTA_BYTES', 300 * MB)  # per student, unfinished uploads included
+    app.config.setdefault('RECORDING_ABANDON_HOURS', 24)
+    app.config.setdefault('RECORDING_ACCEL_REDIRECT', None)   # e.g. '/_recordings/' - nginx serves playback
+
+
+def _access(enrollment, user):
+    """(can view, can upload) for a user on an enrollment's recordings."""
+    if enrollment.user_id == user.id:
+        return True, True
+    if user.is_admin:
+        return True, False
+    return user.is_teacher and get_course(enrollment.course_id).teacher_id == user.id, False
+
+
+def _status(recording):
+    return {
+        'id': recording.id,
+        'url': url_for('recitation.upload', recording_id=recording.id),
+        'offset': recording.received,
+        'size': recording.size,
+        'chunk_bytes': chunk_bytes(),
+        'complete': recording.status == 'complete'
+    }
+
+
+@recitation.route('/<int:enrollment_id>')
+@login_required
+@query_budget(5)
+def index(enrollment_id):
+    enrollment = Enrollment.query.get_or_404(enrollment_id)
+    user = User.query.get(session['user_id'])
+    can_view, can_upload = _access(enrollment, user)
+    if not can_view:
+        flash('Unauthorized access!', 'danger')
+        return redirect(url_for('main.dashboard'))
+    items = Recording.query.filter_by(enrollment_id=enrollment.id).order_by(Recording.created_at.desc()).all()
+    return render_template('recordings.html',
+                           enrollment=enrollment,
+                           student=user if enrollment.user_id == user.id else db.session.get(User, enrollment.user_id),
+                           course=get_course(enrollment.course_id),
+                           recordings=items,
+                           can_upload=can_upload,
+                           quota_used=quota_used(enrollment.user_id) if can_upload else None,
+                           quota=current_app.config['RECORDING_QUOTA_BYTES'],
+                           max_bytes=current_app.config['RECORDING_MAX_BYTES'],
+                           extensions=sorted(AUDIO_TYPES))
+
+
+@recitation.route('/<int:enrollment_id>/uploads', methods=['POST'])
+@login_required
+def create_upload(enrollment_id):
+    """Start (or resume) an upload: JSON {"filename": ..., "size": bytes}."""
+    enrollment = db.session.get(Enrollment, enrollment_id)
+    if enrollment is None or enrollment.user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'The recording size is required.'}), 400
+    recording, error = start_upload(enrollment, str(data.get('filename') or ''), size)
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify(_status(recording)), 201
+
+
+@recitation.route('/uploads/<int:recording_id>', methods=['GET', 'PATCH'])
+@login_required
+def upload(recording_id):
+    """GET (or HEAD) reports the offset to resume from; PATCH writes the chunk at the Upload-Offset header."""
+    recording = db.session.get(Recording, recording_id)
+    if recording is None or recording.user_id != session['user_id']:
+        return jsonify({'error': 'Upload not found'}), 404
+    if request.method == 'GET':
+        return jsonify(_status(recording))
+
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({'error': 'Upload-Offset header required'}), 400
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length required'}), 411
+    if request.content_length > chunk_bytes():
+        return jsonify({'error': f'Chunks can be up to {chunk_bytes()} bytes'}), 413
+    checksum = None
+    if 'Upload-Checksum' in request.headers:
+        algorithm, _, value = request.headers['Upload-Checksum'].partition(' ')
+        try:
+            checksum = base64.b64decode(value, validate=True)
+        except ValueError:
+            checksum = None
+        if algorithm.lower() != 'sha256' or checksum is None or len(checksum) != 32:
+            return jsonify({'error': 'Upload-Checksum must be "sha256 <base64 digest>"'}), 400
+    error = write_chunk(recording, offset, request.content_length, request.stream, checksum)
+    db.session.refresh(recording)
+    if error:
+        return jsonify(dict(_status(recording), error=error)), 409
+    return jsonify(_status(recording))
+
+
+def _filename_params(filename):
+    """Content-Disposition filename parameters, as send_file builds them - RFC 2231 for non-ASCII names."""
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        fallback = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': fallback, 'filename*': f"UTF-8''{quote(filename, safe='!#$&+^`|~')}"}
+    return {'filename': filename}
+
+
+@recitation.route('/<int:recording_id>/audio')
+@login_required
+def audio(recording_id):
+    recording = Recording.query.get_or_404(recording_id)
+    if recording.status != 'complete':
+        abort(404)
+    if recording.user_id != session['user_id']:
+        enrollment = db.session.get(Enrollment, recording.enrollment_id)
+        if not _access(enrollment, User.query.get(session['user_id']))[0]:
+            abort(403)
+    accel = current_app.config['RECORDING_ACCEL_REDIRECT']
+    if accel:
+        # nginx answers the Range request and sends the file; this worker only checked access
+        response = current_app.response_class(mimetype=recording.content_type)
+        response.headers['X-Accel-Redirect'] = f"{accel.rstrip('/')}/{recording.storage_key[:2]}/{recording.storage_key}"
+        response.headers.set('Content-Disposition', 'inline', **_filename_params(recording.filename))
+        response.cache_control.max_age = 3600
+        return response
+    # Range requests get 206 partial responses, read from the file by this worker
+    return send_file(recording_path(recording), mimetype=recording.content_type, conditional=True,
+                     download_name=recording.filename, max_age=3600)
+
+
+@recitation.route('/<int:recording_id>/delete', methods=['POST'])
+@login_required
+def delete(recording_id):
+    recording = Recording.query.get_or_404(recording_id)
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or recording.user_id == user.id):
+        flash('Unauthorized access!', 'danger')
+        return redirect(url_for('main.dashboard'))
+    enrollment_id = recording.enrollment_id
+    delete_recording(recording)
+    flash(f'{recording.filename} deleted.', 'success')
+    return redirect(url_for('recitation.index', enrollment_id=enrollment_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain uploaded recitation recordings.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('cleanup', help='Remove abandoned uploads and stray files')
+    command.add_argument('--every', type=int, help='Keep running, cleaning up every this many seconds')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        try:
+            while True:
+                started = time.monotonic()
+                stats = cleanup()
+                print(f"✓ Removed {stats['uploads']} abandoned uploads, {stats['files']} files "
+                      f"({stats['bytes'] / MB:.1f} MB)")
+                if not args.every:
+                    return 0
+                time.sleep(max(0, args.every - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+Daily Hifz revision queues for Raindrops Academy
+Memorized material is split into portions of about PORTION_AYAHS ayahs
+(never crossing a surah). Every enrollment keeps SM-2 style review state
+per portion in RevisionState, and one nightly batch job writes each
+student's queue for the day into RevisionQueue, which the dashboards read
+directly. Teachers grade portions during revision class, which reschedules
+them.
+
+Planning runs over contiguous enrollment-id ranges; with --workers > 1 the
+ranges are planned in a process pool and this process writes the results,
+so SQLite only ever sees one writer.
+
+    python revision.py generate                      # queues for today (UTC)
+    python revision.py generate --date 2026-03-01 --workers 4
+
+Schedule it nightly, e.g. cron: 0 1 * * * cd /srv/academy && python revision.py generate
+"""
+
+import argparse
+import sys
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+
+from flask import Blueprint, flash, redirect, request, session, url_for
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from auth import login_required, safe_next
+from entity_cache import get_course
+from hifz import from_blob, runs
+from models import db, Enrollment, HifzProgress, RevisionQueue, RevisionState, User
+from quran_meta import SURAH_AYAHS, SURAH_NAMES, SURAH_OFFSETS
+
+PORTION_AYAHS = 20         # target portion size - surahs are split into near-equal parts
+DAILY_AYAHS = 100          # revision load per student per day
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+CHUNK_SIZE = 1000          # enrollments planned per batch
+QUEUE_KEEP_DAYS = 30       # older queue rows are pruned by the nightly job
+GRADES = {'strong': 5, 'good': 4, 'hesitant': 3, 'forgot': 1}
+
+revision = Blueprint('revision', __name__, url_prefix='/revision')
+
+
+def _portions():
+    portions = []
+    for surah, count in enumerate(SURAH_AYAHS, start=1):
+        parts = -(-count // PORTION_AYAHS)
+        base = SURAH_OFFSETS[surah - 1]
+        for part in range(parts):
+            first, last = count * part // parts, count * (part + 1) // parts
+            portions.append((base + first, base + last, f'{SURAH_NAMES[surah - 1]} {first + 1}-{last}'))
+    return portions
+
+
+PORTIONS = _portions()
+PORTION_STARTS = tuple(start for start, _, _ in PORTIONS)
+PORTION_SIZES = tuple(end - start for start, end, _ in PORTIONS)
+PORTION_LABELS = tuple(label for _, _, label in PORTIONS)
+
+
+def memorized_portions(bits):
+    """Portions whose every ayah is memorized, walking the runs of set bits."""
+    found = []
+    for start, end in runs(bits):
+        portion = bisect_left(PORTION_STARTS, start)
+        while portion < len(PORTIONS) and PORTIONS[portion][1] <= end:
+            found.append(portion)
+            portion += 1
+    return found
+
+
+def review(state, quality, day):
+    """SM-2: reschedule a RevisionState after a review graded 0-5."""
+    if quality < 3:
+        state.reps = 0
+        state.lapses = (state.lapses or 0) + 1
+        state.interval_days = 1
+    else:
+        state.reps = (state.reps or 0) + 1
+        if state.reps == 1:
+            state.interval_days = 1
+        elif state.reps == 2:
+            state.interval_days = 3
+        else:
+            state.interval_days = max(1, round(state.interval_days * state.ease))
+    state.ease = max(MIN_EASE, state.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    state.last_reviewed = day
+    state.due_on = day + timedelta(days=state.interval_days)
+
+
+def plan_chunk(first_id, last_id, day):
+    """Plan enrollments first_id..last_id for day. Returns (new state rows, queue rows)."""
+    progress = db.session.query(HifzProgress.enrollment_id, HifzProgress.bits).join(
+        Enrollment, HifzProgress.enrollment_id == Enrollment.id
+    ).filter(
+        HifzProgress.enrollment_id.between(first_id, last_id), Enrollment.status == 'active'
+    ).all()
+    states = {}
+    for row in db.session.query(
+        RevisionState.enrollment_id, RevisionState.portion, RevisionState.due_on,
+        RevisionState.interval_days, RevisionState.ease
+    ).filter(RevisionState.enrollment_id.between(first_id, last_id)):
+        states.setdefault(row.enrollment_id, {})[row.portion] = row
+    # Portions already graded on day count against its budget when the job is re-run
+    graded = {}
+    for enrollment_id, portion in db.session.query(RevisionQueue.enrollment_id, RevisionQueue.portion).filter(
+        RevisionQueue.enrollment_id.between(first_id, last_id),
+        RevisionQueue.queue_date == day,
+        RevisionQueue.status == 'done'
+    ):
+        graded.setdefault(enrollment_id, []).append(portion)
+
+    new_states, queue = [], []
+    for enrollment_id, blob in progress:
+        known = states.get(enrollment_id, {})
+        due = []
+        for portion in memorized_portions(from_blob(blob)):
+            state = known.get(portion)
+            if state is None:
+                # Newly memorized - first review on the day being planned
+                new_states.append({'enrollment_id': enrollment_id, 'portion': portion, 'ease': DEFAULT_EASE,
+                                   'interval_days': 0, 'reps': 0, 'lapses': 0, 'due_on': day})
+                due.append((-1.0, DEFAULT_EASE, portion))
+            elif state.due_on <= day:
+                # Most overdue relative to its interval first, then the shakiest
+                overdue = (day - state.due_on).days + 1
+                due.append((-overdue / max(state.interval_days, 1), state.ease, portion))
+        due.sort()
+
+        done = graded.get(enrollment_id, ())
+        budget = DAILY_AYAHS - sum(PORTION_SIZES[portion] for portion in done)
+        for position, (_, _, portion) in enumerate(due, start=len(done)):
+            if budget <= 0 or (position and PORTION_SIZES[portion] > budget):
+                break
+            queue.append({'enrollment_id': enrollment_id, 'queue_date': day, 'position': position,
+                          'portion': portion, 'status': 'pending'})
+            budget -= PORTION_SIZES[portion]
+    return new_states, queue
+
+
+def _write_chunk(first_id, last_id, day, new_states, queue):
+    if new_states:
+        db.session.execute(sqlite_insert(RevisionState).on_conflict_do_nothing(), new_states)
+    # Replace the day's pending items - portions already graded today stay as they are
+    db.session.execute(db.delete(RevisionQueue).where(
+        RevisionQueue.enrollment_id.between(first_id, last_id),
+        RevisionQueue.queue_date == day,
+        RevisionQueue.status == 'pending'
+    ))
+    if queue:
+        db.session.execute(sqlite_insert(RevisionQueue).on_conflict_do_nothing(), queue)
+    db.session.commit()
+
+
+_worker_app = None
+
+
+def _init_worker():
+    """Each pool process builds its own app (and engine) once."""
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app()
+    _worker_app.app_context().push()
+
+
+def _plan_in_worker(bounds, day):
+    result = plan_chunk(bounds[0], bounds[1], day)
+    db.session.remove()
+    return result
+
+
+def generate(day=None, workers=1, chunk_size=CHUNK_SIZE):
+    """Write every enrollment's revision queue for day. Call inside an app context."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    day = day or datetime.utcnow().date()
+    started = time.perf_counter()
+    # Only active enrollments are planned; pending items left for any others in a chunk are cleared
+    ids = [row[0] for row in db.session.query(HifzProgress.enrollment_id).join(
+        Enrollment, HifzProgress.enrollment_id == Enrollment.id
+    ).filter(Enrollment.status == 'active').order_by(HifzProgress.enrollment_id)]
+    chunks = [(ids[i], ids[min(i + chunk_size, len(ids)) - 1]) for i in range(0, len(ids), chunk_size)]
+
+    stats = {'enrollments': len(ids), 'new_states': 0, 'queued': 0}
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) if workers > 1 and chunks else None
+    try:
+        if pool:
+            results = pool.map(_plan_in_worker, chunks, [day] * len(chunks))
+        else:
+            results = (plan_chunk(first_id, last_id, day) for first_id, last_id in chunks)
+        for (first_id, last_id), (new_states, queue) in zip(chunks, results):
+            _write_chunk(first_id, last_id, day, new_states, queue)
+            stats['new_states'] += len(new_states)
+            stats['queued'] += len(queue)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    db.session.execute(db.delete(RevisionQueue).where(
+        RevisionQueue.queue_date < day - timedelta(days=QUEUE_KEEP_DAYS)
+    ))
+    db.session.commit()
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+def todays_queue(enrollment_ids, day=None):
+    """{enrollment_id: [RevisionQueue]} for day, in queue order - one query."""
+    day = day or datetime.utcnow().date()
+    enrollment_ids = list(enrollment_ids)
+    if not enrollment_ids:
+        return {}
+    queue = {}
+    for item in RevisionQueue.query.filter(
+        RevisionQueue.enrollment_id.in_(enrollment_ids), RevisionQueue.queue_date == day
+    ).order_by(RevisionQueue.enrollment_id, RevisionQueue.position):
+        queue.setdefault(item.enrollment_id, []).append(item)
+    return queue
+
+
+@revision.app_template_filter('portion_label')
+def portion_label(portion):
+    return PORTION_LABELS[portion]
+
+
+@revision.route('/<int:item_id>', methods=['POST'])
+@login_required
+def grade(item_id):
+    item = RevisionQueue.query.get_or_404(item_id)
+    enrollment = db.session.get(Enrollment, item.enrollment_id)
+    user = User.query.get(session['user_id'])
+    if not (user.is_admin or (user.is_teacher and get_course(enrollment.course_id).teacher_id == user.id)):
+        flash('Unauthorized access!', 'danger')
+        return redirect(url_for('main.dashboard'))
+    back = safe_next(url_for('main.teacher_dashboard'))
+    quality = GRADES.get(request.form.get('grade'))
+    if quality is None:
+        flash('Please choose a grade.', 'danger')
+        return redirect(back)
+
+    # Claim the item first, so a re-posted form cannot apply the review twice
+    claimed = db.session.execute(db.update(RevisionQueue).where(
+        RevisionQueue.id == item.id, RevisionQueue.status == 'pending'
+    ).values(status='done', grade=request.form['grade'], reviewed_at=datetime.utcnow())).rowcount
+    if not claimed:
+        db.session.rollback()
+        flash(f'{PORTION_LABELS[item.portion]} has already been graded.', 'info')
+        return redirect(back)
+
+    today = datetime.utcnow().date()
+    state = db.session.get(RevisionState, (item.enrollment_id, item.portion))
+    if state is None:
+        state = RevisionState(enrollment_id=item.enrollment_id, portion=item.portion, ease=DEFAULT_EASE,
+                              interval_days=0, reps=0, lapses=0, due_on=today)
+        db.session.add(state)
+    review(state, quality, today)
+    db.session.commit()
+    flash(f'{PORTION_LABELS[item.portion]}: next revision on {state.due_on.strftime("%b %d")}.', 'success')
+    return redirect(back)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate daily Hifz revision queues.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('generate')
+    command.add_argument('--date', type=date.fromisoformat, help='Day to plan (default: today, UTC)')
+    command.add_argument('--workers', type=int, default=1, help='Planning processes')
+    command.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Enrollments per batch')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        stats = generate(args.date, args.workers, args.chunk_size)
+    print(f"✓ Planned {stats['enrollments']} enrollments: {stats['queued']} portions queued, "
+          f"{stats['new_states']} newly memorized portions, {stats['seconds']}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""
+One-on-one session scheduling for Raindrops Academy
+Teachers publish weekly availability in their own time zone and students
+with an active enrollment book sessions with the course's teacher.
+
+Open slots are found by expanding the weekly windows into UTC intervals for
+the requested days and walking them against an IntervalIndex of the
+sessions already booked - a couple of queries and a bisect per gap, however
+many teachers are searched. Bookings are inserted with a NOT EXISTS overlap
+check in the same statement, so two students can never take one slot.
+"""
+
+from bisect import bisect_right
+from datetime import datetime, time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+from flask import Blueprint, flash, redirect, render_template, request, session, url_for
+from sqlalchemy.exc import OperationalError
+
+from auth import login_required, safe_next, teacher_required
+from entity_cache import get_course, get_teacher
+from models import db, Availability, Booking, Enrollment, User
+from query_audit import query_budget
+
+SLOT_STEP_MINUTES = 30           # slots start on this grid, counted from the window start
+SESSION_LENGTHS = (30, 45, 60)   # minutes a student can book
+MAX_SESSION_MINUTES = max(SESSION_LENGTHS)
+SEARCH_DAYS = 14                 # how far ahead students can book
+BOOKING_LEAD_MINUTES = 60        # earliest a session can start, from now
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+scheduling = Blueprint('scheduling', __name__, url_prefix='/schedule')
+
+
+@lru_cache(maxsize=1024)
+def get_zone(name):
+    """ZoneInfo for an IANA name, or None if it is not a known zone."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return None
+
+
+@lru_cache(maxsize=1)
+def zone_names():
+    return sorted(available_timezones())
+
+
+def user_zone(user):
+    return get_zone(user.timezone or 'UTC') or get_zone('UTC')
+
+
+def to_local(moment, zone):
+    """Naive UTC datetime -> aware datetime in zone."""
+    return moment.replace(tzinfo=timezone.utc).astimezone(zone)
+
+
+def to_utc(moment):
+    """Aware datetime -> naive UTC datetime, as stored in the database."""
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class IntervalIndex:
+    """Sorted, disjoint [start, end) intervals with bisect-based overlap and gap queries."""
+
+    def __init__(self, intervals=()):
+        merged = _merge(intervals)
+        self.starts = [start for start, _ in merged]
+        self.ends = [end for _, end in merged]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, start, end):
+        # Ends are sorted because the intervals are disjoint - find the first one ending after start
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def gaps(self, start, end):
+        """Yield the free (start, end) stretches inside [start, end)."""
+        cursor = start
+        i = bisect_right(self.ends, start)
+        while i < len(self.starts) and self.starts[i] < end:
+            if self.starts[i] > cursor:
+                yield cursor, self.starts[i]
+            cursor = max(cursor, self.ends[i])
+            i += 1
+        if cursor < end:
+            yield cursor, end
+
+
+@lru_cache(maxsize=65536)
+def _local_to_utc(zone_name, day, minute):
+    # Wall-clock arithmetic on the local date, so DST changes keep 09:00 at 09:00
+    midnight = datetime.combine(day, time(0), tzinfo=get_zone(zone_name))
+    return to_utc(midnight + timedelta(minutes=minute))
+
+
+def expand_availability(windows, range_start, range_end):
+    """Weekly windows -> {teacher_id: merged [(start, end)]} in naive UTC.
+
+    Windows are cut off at range_end but keep their real start, which the slot grid is counted from.
+    """
+    expanded = {}
+    local_dates = {}  # zone -> (first, last) local date of the range
+    for window in windows:
+        if window.timezone not in local_dates:
+            zone = get_zone(window.timezone)
+            local_dates[window.timezone] = zone and (to_local(range_start, zone).date() - timedelta(days=1),
+                                                     to_local(range_end, zone).date())
+        if local_dates[window.timezone] is None:
+            continue
+        first, last = local_dates[window.timezone]
+        day = first + timedelta(days=(window.weekday - first.weekday()) % 7)
+        while day <= last:
+            start = _local_to_utc(window.timezone, day, window.start_minute)
+            end = min(_local_to_utc(window.timezone, day, window.end_minute), range_end)
+            if start < end and end > range_start:
+                expanded.setdefault(window.teacher_id, []).append((start, end))
+            day += timedelta(days=7)
+    return {teacher_id: _merge(intervals) for teacher_id, intervals in expanded.items()}
+
+
+def booked_intervals(column, ids, range_start, range_end):
+    """{id: [(start, end)]} of booked sessions overlapping the range, for teachers or students."""
+    rows = db.session.query(column, Booking.starts_at, Booking.ends_at).filter(
+        column.in_(ids),
+        Booking.status == 'booked',
+        # Sessions are at most MAX_SESSION_MINUTES long, which keeps this an index range scan
+        Booking.starts_at >= range_start - timedelta(minutes=MAX_SESSION_MINUTES),
+        Booking.starts_at < range_end
+    ).all()
+    booked = {}
+    for key, start, end in rows:
+        if end > range_start:
+            booked.setdefault(key, []).append((start, end))
+    return booked
+
+
+def find_open_slots(teacher_ids, range_start, range_end, minutes, student_id=None):
+    """Open session start times as {teacher_id: [naive UTC datetimes]}, earliest first.
+
+    With student_id, slots that clash with the student's own sessions are left out.
+    """
+    teacher_ids = list(teacher_ids)
+    earliest = datetime.utcnow() + timedelta(minutes=BOOKING_LEAD_MINUTES)
+    range_start = max(range_start, earliest)
+    if not teacher_ids or range_start >= range_end:
+        return {}
+
+    query = db.select(
+        Availability.teacher_id, Availability.weekday, Availability.start_minute,
+        Availability.end_minute, Availability.timezone
+    ).where(Availability.teacher_id.in_(teacher_ids))
+    if range_end - range_start < timedelta(days=5):
+        # Local dates are within a day of UTC ones, so short searches only need a few weekdays
+        day = range_start.date() - timedelta(days=1)
+        weekdays = set()
+        while day <= range_end.date() + timedelta(days=1):
+            weekdays.add(day.weekday())
+            day += timedelta(days=1)
+        query = query.where(Availability.weekday.in_(sorted(weekdays)))
+    windows = db.session.execute(query).all()
+    expanded = expand_availability(windows, range_start, range_end)
+    booked = booked_intervals(Booking.teacher_id, list(expanded), range_start, range_end)
+    student = IntervalIndex()
+    if student_id is not None:
+        student = IntervalIndex(booked_intervals(Booking.student_id, [student_id], range_start, range_end)
+                                .get(student_id, ()))
+
+    length = timedelta(minutes=minutes)
+    step = timedelta(minutes=SLOT_STEP_MINUTES)
+    slots = {}
+    for teacher_id, intervals in expanded.items():
+        index = IntervalIndex(booked.get(teacher_id, ()))
+        found = []
+        for window_start, window_end in intervals:
+            for gap_start, gap_end in index.gaps(max(window_start, range_start), window_end):
+                # First grid point at or after the gap start
+                offset = gap_start - window_start
+                candidate = window_start + step * -(-offset // step)
+                while candidate + length <= gap_end:
+                    if not student.overlaps(candidate, candidate + length):
+                        found.append(candidate)
+                    candidate += step
+        if found:
+            slots[teacher_id] = found
+    return slots
+
+
+def book_session(enrollment, starts_at, minutes):
+    """Book a session for an active enrollment. Returns (booking or None, error message or None)."""
+    course = get_course(enrollment.course_id)
+    if enrollment.status != 'active':
+        return None, 'Sessions can be booked once the enrollment is active.'
+    if course is None or not course.teacher_id:
+        return None, 'This course has no teacher assigned yet.'
+    if minutes not in SESSION_LENGTHS:
+        return None, 'Please choose a valid session length.'
+
+    ends_at = starts_at + timedelta(minutes=minutes)
+    open_slots = find_open_slots([course.teacher_id], starts_at, ends_at, minutes, enrollment.user_id)
+    if starts_at not in open_slots.get(course.teacher_id, ()):
+        return None, 'That time is not available. Please pick another slot.'
+
+    # Insert only if neither the teacher nor the student has an overlapping session - one
+    # statement, so a racing booking for the same slot inserts nothing
+    existing = db.aliased(Booking)
+    window = starts_at - timedelta(minutes=MAX_SESSION_MINUTES)
+
+    def clash(column, value):
+        return db.exists().where(
+            column == value, existing.status == 'booked', existing.starts_at >= window,
+            existing.starts_at < ends_at, existing.ends_at > starts_at
+        )
+
+    now = datetime.utcnow()
+    values = db.select(
+        db.literal(enrollment.id), db.literal(course.teacher_id), db.literal(enrollment.user_id),
+        db.literal(starts_at), db.literal(ends_at), db.literal('booked'), db.literal(now)
+    ).where(~clash(existing.teacher_id, course.teacher_id), ~clash(existing.student_id, enrollment.user_id))
+    try:
+        result = db.session.execute(db.insert(Booking).from_select(
+            ['enrollment_id', 'teacher_id', 'student_id', 'starts_at', 'ends_at', 'status', 'created_at'], values
+        ))
+        db.session.commit()
+    except OperationalError:
+        # Another booking committed between our read and write
+        db.session.rollback()
+        result = None
+    if not result or not result.rowcount:
+        return None, 'That time was just booked by someone else. Please pick another slot.'
+    return Booking.query.filter_by(teacher_id=course.teacher_id, starts_at=starts_at, status='booked').first(), None
+
+
+def _parse_minutes(value):
+    """'HH:MM' -> minutes after midnight ('24:00' allowed as an end), or None."""
+    try:
+        hours, minutes = (int(part) for part in value.split(':'))
+    except (AttributeError, ValueError):
+        return None
+    total = hours * 60 + minutes
+    if 0 <= minutes < 60 and 0 <= total <= 24 * 60:
+        return total
+    return None
+
+
+@scheduling.app_template_filter('localtime')
+def localtime_filter(moment, zone):
+    return to_local(moment, zone)
+
+
+@scheduling.app_template_filter('clock')
+def clock_filter(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+@scheduling.route('/timezone', methods=['POST'])
+@login_required
+def set_timezone():
+    user = User.query.get(session['user_id'])
+    name = request.form.get('timezone', '')
+    # Check against the known names first so arbitrary input never reaches the zone cache
+    if name not in zone_names() or get_zone(name) is None:
+        flash('Please choose a valid time zone.', 'danger')
+    else:
+        user.timezone = name
+        db.session.commit()
+        flash(f'Time zone set to {name}.', 'success')
+    return redirect(safe_next(url_for('main.dashboard')))
+
+
+@scheduling.route('/availability', methods=['GET', 'POST'])
+@login_required
+@teacher_required
+@query_budget(5)
+def availability():
+    teacher = User.query.get(session['user_id'])
+    zone = user_zone(teacher)
+
+    if request.method == 'POST':
+        weekday = request.form.get('weekday', type=int)
+        start_minute = _parse_minutes(request.form.get('start', ''))
+        end_minute = _parse_minutes(request.form.get('end', ''))
+        if weekday not in range(7) or start_minute is None or end_minute is None:
+            flash('Please choose a day and valid start and end times.', 'danger')
+        elif end_minute - start_minute < min(SESSION_LENGTHS):
+            flash(f'A window must be at least {min(SESSION_LENGTHS)} minutes long.', 'danger')
+        else:
+            db.session.add(Availability(
+                teacher_id=teacher.id, weekday=weekday, start_minute=start_minute,
+                end_minute=end_minute, timezone=zone.key
+            ))
+            db.session.commit()
+            flash(f'Added {WEEKDAYS[weekday]} {request.form["start"]}-{request.form["end"]} ({zone.key}).', 'success')
+        return redirect(url_for('scheduling.availability'))
+
+    windows = Availability.query.filter_by(teacher_id=teacher.id).order_by(
+        Availability.weekday, Availability.start_minute
+    ).all()
+    now = datetime.utcnow()
+    bookings = Booking.query.filter(
+        Booking.teacher_id == teacher.id, Booking.status == 'booked',
+        Booking.starts_at >= now, Booking.starts_at < now + timedelta(days=SEARCH_DAYS)
+    ).options(
+        db.joinedload(Booking.student), db.joinedload(Booking.enrollment).joinedload(Enrollment.course)
+    ).order_by(Booking.starts_at).all()
+    return render_template('schedule_availability.html', teacher=teacher, zone=zone, windows=windows,
+                           bookings=bookings, weekdays=WEEKDAYS, zone_names=zone_names())
+
+
+@scheduling.route('/availability/<int:window_id>/delete', methods=['POST'])
+@login_required
+@teacher_required
+def delete_availability(window_id):
+    window = Availability.query.get_or_404(window_id)
+    if window.teacher_id != session['user_id']:
+        flash('Unauthorized access!', 'danger')
+    else:
+        db.session.delete(window)
+        db.session.commit()
+        flash('Availability window removed. Sessions already booked are kept.', 'info')
+    return redirect(url_for('scheduling.availability'))
+
+
+@scheduling.route('/book/<int:enrollment_id>', methods=['GET', 'POST'])
+@login_required
+@query_budget(8)
+def book(enrollment_id):
+    enrollment = Enrollment.query.get_or_404(enrollment_id)
+    if enrollment.user_id != session['user_id']:
+        flash('Unauthorized access!', 'danger')
+        return redirect(url_for('main.dashboard'))
+    student = User.query.get(session['user_id'])
+    zone = user_zone(student)
+    course = get_course(enrollment.course_id)
+    teacher = get_teacher(course.teacher_id) if course.teacher_id else None
+    minutes = request.values.get('minutes', SESSION_LENGTHS[-1], type=int)
+    if minutes not in SESSION_LENGTHS:
+        minutes = SESSION_LENGTHS[-1]
+
+    if request.method == 'POST':
+        try:
+            starts_at = datetime.fromisoformat(request.form['starts_at'])
+        except (KeyError, ValueError):
+            flash('Please pick a time slot.', 'danger')
+            return redirect(url_for('scheduling.book', enrollment_id=enrollment.id, minutes=minutes))
+        if starts_at.tzinfo is not None:
+            # Slots are posted as naive UTC; an offset would not compare with the stored times
+            starts_at = to_utc(starts_at)
+        booking, error = book_session(enrollment, starts_at, minutes)
+        if error:
+            flash(error, 'danger')
+            return redirect(url_for('scheduling.book', enrollment_id=enrollment.id, minutes=minutes))
+        flash(f'Session booked for {to_local(booking.starts_at, zone).strftime("%A %B %d, %H:%M")} ({zone.key}).',
+              'success')
+        return redirect(url_for('scheduling.book', enrollment_id=enrollment.id, minutes=minutes))
+
+    slots_by_day = {}
+    if enrollment.status == 'active' and course.teacher_id:
+        now = datetime.utcnow()
+        slots = find_open_slots([course.teacher_id], now, now + timedelta(days=SEARCH_DAYS), minutes, student.id)
+        for slot in slots.get(course.teacher_id, ()):
+            local = to_local(slot, zone)
+            slots_by_day.setdefault(local.date(), []).append((slot, local))
+
+    bookings = Booking.query.filter(
+        Booking.enrollment_id == enrollment.id, Booking.status == 'booked',
+        Booking.ends_at > datetime.utcnow()
+    ).order_by(Booking.starts_at).all()
+    return render_template('schedule_book.html', enrollment=enrollment, course=course, teacher=teacher, zone=zone,
+                           minutes=minutes, session_lengths=SESSION_LENGTHS, slots_by_day=slots_by_day,
+                           bookings=bookings, zone_names=zone_names())
+
+
+@scheduling.route('/bookings/<int:booking_id>/cancel', methods=['POST'])
+@login_required
+def cancel_booking(booking_id):
+    booking = Booking.query.get_or_404(booking_id)
+    user_id = session['user_id']
+    if user_id not in (booking.student_id, booking.teacher_id):
+        flash('Unauthorized access!', 'danger')
+        return redirect(url_for('main.dashboard'))
+    if booking.status == 'booked' and booking.starts_at > datetime.utcnow():
+        booking.status = 'cancelled'
+        db.session.commit()
+        flash('Session cancelled.', 'info')
+    else:
+        flash('Only upcoming sessions can be cancelled.', 'warning')
+    if user_id == booking.teacher_id:
+        return redirect(url_for('scheduling.availability'))
+    return redirect(url_for('scheduling.book', enrollment_id=booking.enrollment_id))
@@ -0,0 +1,253 @@
+"""
+Local Stripe stand-in for development and testing
+Implements the handful of API calls the academy makes (customers, payment
+intents, retrieve and confirm, detaching a saved card) in memory and honours
+Idempotency-Key, so the checkout and renewal flows can run without network
+access or real keys.
+
+Charges follow Stripe's test cards: pm_card_visa succeeds and
+pm_card_chargeDeclined* are declined. --decline-rate declines that share of
+other charges at random, and --latency-ms/--latency-jitter-ms slow every
+response down, to exercise retries and the billing pool.
+
+    python stripe_stub.py --port 12111
+    python stripe_stub.py --latency-ms 300 --latency-jitter-ms 400 --decline-rate 0.1
+    STRIPE_SECRET_KEY=sk_test_stub STRIPE_PUBLIC_KEY=pk_test_stub STRIPE_API_BASE=http://127.0.0.1:12111 python app.py
+"""
+
+import argparse
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+# metadata[course_id]=3 -> ('metadata', 'course_id')
+NESTED_KEY = re.compile(r'^(\w+)\[(\w+)\]$')
+
+# Stripe's test payment methods that always fail, with their decline_code
+DECLINED_CARDS = {
+    'pm_card_chargeDeclined': 'generic_decline',
+    'pm_card_chargeDeclinedInsufficientFunds': 'insufficient_funds',
+    'pm_card_chargeDeclinedExpiredCard': 'expired_card',
+}
+DEFAULT_CARD = 'pm_card_visa'
+
+
+def parse_form(body):
+    """Decode Stripe's form encoding, including one level of key[subkey] nesting."""
+    params = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        match = NESTED_KEY.match(key)
+        if match:
+            params.setdefault(match.group(1), {})[match.group(2)] = value
+        else:
+            params[key] = value
+    return params
+
+
+class StripeState:
+    def __init__(self, latency_ms=0, latency_jitter_ms=0, decline_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.decline_rate = decline_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.objects = {}      # id -> object
+        self.idempotent = {}   # (path, key) -> (status, body)
+        self.requests = 0
+        self.charges = 0
+        self.declines = 0
+
+    def new_id(self, prefix):
+        return f'{prefix}_{secrets.token_hex(12)}'
+
+    def delay(self):
+        """Seconds to hold this response back."""
+        with self.lock:
+            jitter = self.random.uniform(0, self.latency_jitter_ms) if self.latency_jitter_ms else 0
+        return (self.latency_ms + jitter) / 1000
+
+    def decline_code(self, payment_method):
+        """Why a charge to payment_method fails, or None when it goes through. Call with the lock held."""
+        if payment_method in DECLINED_CARDS:
+            return DECLINED_CARDS[payment_method]
+        if self.decline_rate and self.random.random() < self.decline_rate:
+            return 'generic_decline'
+        return None
+
+
+class StripeStubHandler(BaseHTTPRequestHandler):
+    server_version = 'StripeStub/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Request-Id', f'req_{secrets.token_hex(8)}')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status, message, code=None, error_type='invalid_request_error'):
+        error = {'type': error_type, 'message': message}
+        if code:
+            error['code'] = code
+        return status, {'error': error}
+
+    def _charge(self, intent, params):
+        """Confirm intent against its payment method. Call with the state lock held."""
+        state = self.server.state
+        payment_method = params.get('payment_method') or intent.get('payment_method') or DEFAULT_CARD
+        intent['payment_method'] = payment_method
+        state.charges += 1
+        decline_code = state.decline_code(payment_method)
+        if decline_code is None:
+            intent['status'] = 'succeeded'
+            intent['last_payment_error'] = None
+            return 200, dict(intent)
+        state.declines += 1
+        message = 'Your card has insufficient funds.' if decline_code == 'insufficient_funds' else 'Your card was declined.'
+        intent['status'] = 'requires_payment_method'
+        intent['last_payment_error'] = {'type': 'card_error', 'code': 'card_declined',
+                                        'decline_code': decline_code, 'message': message}
+        status, body = self._error(402, message, code='card_declined', error_type='card_error')
+        body['error'].update(decline_code=decline_code, payment_intent=dict(intent))
+        return status, body
+
+    def _authorized(self):
+        auth = self.headers.get('Authorization', '')
+        return auth.startswith('Bearer sk_')
+
+    def _handle(self, method):
+        state = self.server.state
+        with state.lock:
+            state.requests += 1
+        delay = state.delay()
+        if delay:
+            time.sleep(delay)
+
+        if not self._authorized():
+            return self._send(*self._error(401, 'Invalid API Key provided.', error_type='authentication_error'))
+
+        length = int(self.headers.get('Content-Length') or 0)
+        params = parse_form(self.rfile.read(length).decode()) if length else {}
+        path = self.path.split('?', 1)[0]
+
+        key = self.headers.get('Idempotency-Key') if method == 'POST' else None
+        if key:
+            with state.lock:
+                replay = state.idempotent.get((path, key))
+            if replay is not None:
+                return self._send(*replay)
+
+        status, body = self._route(method, path, params)
+        if key and status < 500:
+            with state.lock:
+                state.idempotent.setdefault((path, key), (status, body))
+                status, body = state.idempotent[(path, key)]
+        return self._send(status, body)
+
+    def _route(self, method, path, params):
+        state = self.server.state
+        parts = path.strip('/').split('/')
+        if parts[:1] != ['v1'] or len(parts) < 2:
+            return self._error(404, f'Unrecognized request URL ({method}: {path}).')
+
+        if method == 'POST' and parts[1:] == ['customers']:
+            customer = {
+                'id': state.new_id('cus'), 'object': 'customer', 'created': int(time.time()),
+                'email': params.get('email'), 'name': params.get('name'),
+                'metadata': params.get('metadata', {})
+            }
+            with state.lock:
+                state.objects[customer['id']] = customer
+            return 200, customer
+
+        if method == 'POST' and parts[1:] == ['payment_intents']:
+            try:
+                amount = int(params['amount'])
+            except (KeyError, ValueError):
+                return self._error(400, 'Missing required param: amount.', code='parameter_missing')
+            intent_id = state.new_id('pi')
+            intent = {
+                'id': intent_id, 'object': 'payment_intent', 'created': int(time.time()),
+                'amount': amount, 'currency': params.get('currency', 'usd'),
+                'customer': params.get('customer'), 'description': params.get('description'),
+                'metadata': params.get('metadata', {}), 'status': 'requires_payment_method',
+                'payment_method': params.get('payment_method'),
+                'setup_future_usage': params.get('setup_future_usage'), 'last_payment_error': None,
+                'client_secret': f'{intent_id}_secret_{secrets.token_hex(12)}'
+            }
+            with state.lock:
+                state.objects[intent_id] = intent
+                if params.get('confirm') == 'true':
+                    return self._charge(intent, params)
+            return 200, dict(intent)
+
+        if len(parts) >= 3 and parts[1] == 'payment_intents':
+            with state.lock:
+                intent = state.objects.get(parts[2])
+                if intent is None:
+                    return self._error(404, f"No such payment_intent: '{parts[2]}'", code='resource_missing')
+                if method == 'GET' and len(parts) == 3:
+                    return 200, dict(intent)
+                if method == 'POST' and parts[3:] == ['confirm']:
+                    return self._charge(intent, params)
+
+        if method == 'POST' and len(parts) == 4 and parts[1] == 'payment_methods' and parts[3] == 'detach':
+            return 200, {'id': parts[2], 'object': 'payment_method', 'customer': None}
+
+        return self._error(404, f'Unrecognized request URL ({method}: {path}).')
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+def make_server(host='127.0.0.1', port=12111, latency_ms=0, verbose=False, **faults):
+    """faults: latency_jitter_ms, decline_rate and seed, see StripeState."""
+    server = ThreadingHTTPServer((host, port), StripeStubHandler)
+    server.daemon_threads = True
+    server.state = StripeState(latency_ms, **faults)
+    server.verbose = verbose
+    return server
+
+
+def serve_in_thread(host='127.0.0.1', port=0, latency_ms=0, **faults):
+    """Start a stub on a background thread; returns (server, api_base). Call server.shutdown() when done."""
+    server = make_server(host, port, latency_ms, **faults)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local Stripe API stand-in.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--latency-ms', type=int, default=0, help='Delay every response to mimic the real API')
+    parser.add_argument('--latency-jitter-ms', type=int, default=0, help='Add up to this much random delay')
+    parser.add_argument('--decline-rate', type=float, default=0.0, help='Share of charges to decline (0-1)')
+    parser.add_argument('--seed', type=int, help='Seed for the random latency and declines')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency_ms, verbose=True,
+                         latency_jitter_ms=args.latency_jitter_ms, decline_rate=args.decline_rate, seed=args.seed)
+    print(f'✓ Stripe stub listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()